@@ -0,0 +1,88 @@
+"""
+End-to-end benchmark of PDF captioning against a local stub of Vertex.
+
+Builds an image-heavy PDF, then runs document_chunker.process_pdf_with_captions on it
+with several captioning settings and reports the wall time and the number of requests
+the stub received. The caption cache is disabled, so every run captions every image.
+
+Usage (from /backend):
+    poetry run python -m benchmarks.bench_captioning --pages 20 --images-per-page 8 --latency 0.5
+"""
+import io
+import os
+import time
+import random
+import argparse
+import tempfile
+import logging
+
+# google_calls validates these at import, the stub ignores them
+os.environ.setdefault("GCP_PROJECT_ID", "benchmark")
+os.environ.setdefault("GCP_LOCATION", "us-central1")
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from src import google_calls
+from src import disk_cache
+from src import document_chunker as chunker
+from benchmarks.stubs import StubVertexHandler, start_stub
+
+def make_pdf(path: str, pages: int, images_per_page: int, seed: int = 0) -> None:
+    """Writes a PDF with a line of text and images_per_page distinct small figures per page."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 48), f"Page {page_num + 1} of the figure-heavy sample document.")
+        for i in range(images_per_page):
+            image = Image.new("RGB", (200, 150), tuple(rng.randrange(256) for _ in range(3)))
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG")
+            x, y = 72 + (i % 2) * 240, 72 + (i // 2) * 170
+            page.insert_image(fitz.Rect(x, y, x + 200, y + 150), stream=buffer.getvalue())
+    doc.save(path)
+
+def run(name: str, pdf_path: str, server, batch_size: int, concurrency: int, rate: float) -> None:
+    google_calls.CAPTION_BATCH_SIZE = batch_size
+    google_calls.CAPTION_CONCURRENCY = concurrency
+    google_calls.CAPTION_RATE_LIMIT = rate
+    google_calls.request_limiter = None
+    # A fresh, empty caption cache per run
+    disk_cache.image_cache = disk_cache.DiskCache(os.path.join(tempfile.mkdtemp(), "cache.sqlite3"), 64 * 1024 * 1024)
+    server.stats.update(requests=0, images=0)
+
+    start = time.perf_counter()
+    text = chunker.process_pdf_with_captions(pdf_path, tempfile.gettempdir())
+    elapsed = time.perf_counter() - start
+    captions = text.count(chunker.CAPTION_START)
+    print(f"{name:<32} {elapsed:8.2f} s {server.stats['requests']:6d} requests {captions:6d} captions")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--images-per-page", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the stub takes per request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=0, help="requests per second, 0 for no limit")
+    parser.add_argument("--with-ocr", action="store_true", help="also OCR the inline images (needs tesseract)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    server = start_stub(StubVertexHandler, latency=args.latency)
+    google_calls.VERTEX_ENDPOINT_URL = f"http://127.0.0.1:{server.server_address[1]}/chat/completions"
+    google_calls.get_access_token = lambda: "stub-token"
+    if not args.with_ocr:
+        chunker.ocr_planner.run_tesseract = lambda image: ""
+
+    pdf_path = os.path.join(tempfile.mkdtemp(), "figures.pdf")
+    make_pdf(pdf_path, args.pages, args.images_per_page)
+    print(f"{args.pages} pages x {args.images_per_page} images, {args.latency}s per request")
+
+    run("serial, one image per request", pdf_path, server, 1, 1, args.rate)
+    run(f"{args.concurrency} concurrent, one per request", pdf_path, server, 1, args.concurrency, args.rate)
+    run(f"{args.concurrency} concurrent, {args.batch_size} per request", pdf_path, server, args.batch_size, args.concurrency, args.rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark for document_chunker.chunk_document.
+
+Chunks a large synthetic document (prose with image captions mixed in) and reports
+the throughput in MB/s, next to the previous string-concatenation chunker.
+
+Usage (from /backend):
+    poetry run python -m benchmarks.bench_chunker --size-mb 8
+"""
+import re
+import time
+import random
+import argparse
+import logging
+
+from nltk.tokenize import sent_tokenize
+
+from src import document_chunker as chunker
+
+WORDS = (
+    "the cell membrane regulates transport of ions and molecules while enzymes catalyse "
+    "reactions in the cytoplasm and energy is stored as adenosine triphosphate for later use"
+).split()
+
+def make_document(size_bytes: int, seed: int = 0) -> str:
+    """Builds a synthetic document of roughly size_bytes with a caption every ~50 sentences."""
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size_bytes:
+        if rng.random() < 0.02:
+            part = f"{chunker.CAPTION_START}A diagram showing {' '.join(rng.choices(WORDS, k=20))}.{chunker.CAPTION_END}\n"
+        else:
+            part = " ".join(rng.choices(WORDS, k=rng.randint(8, 30))).capitalize() + ". "
+            if rng.random() < 0.1:
+                part += "\n"
+        parts.append(part)
+        total += len(part)
+    return "".join(parts)
+
+def legacy_chunk_document(content: str, chunk_size: int = 1000, overlap: int = 200):
+    """The chunker before the span-based rewrite, without its per-chunk logging."""
+    caption_pattern = re.escape(chunker.CAPTION_START) + r'.*?' + re.escape(chunker.CAPTION_END)
+    parts = re.split(f'({caption_pattern})', content, flags=re.DOTALL)
+    chunks = []
+    current_chunk = ""
+    for part in parts:
+        if re.match(caption_pattern, part):
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+                current_chunk = ""
+            chunks.append(part.strip())
+        else:
+            for sentence in sent_tokenize(part):
+                if len(current_chunk) + len(sentence) <= chunk_size:
+                    current_chunk += sentence + " "
+                else:
+                    chunks.append(current_chunk.strip())
+                    overlap_text = current_chunk[-overlap:].strip()
+                    current_chunk = overlap_text + " " + sentence + " "
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+def bench(name: str, func, content: str, repeat: int):
+    best = float("inf")
+    chunks = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = func(content)
+        best = min(best, time.perf_counter() - start)
+    size_mb = len(content.encode("utf-8")) / (1024 * 1024)
+    print(f"{name:<28} {size_mb:8.2f} MB {best:8.3f} s {size_mb / best:8.2f} MB/s {len(chunks):8d} chunks")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=8, help="size of the synthetic document")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per chunker, the best one is reported")
+    parser.add_argument("--skip-legacy", action="store_true", help="only benchmark the current chunker")
+    args = parser.parse_args()
+
+    # Per-chunk logging is part of what we are getting rid of, keep it out of the timings
+    logging.getLogger(chunker.__name__).setLevel(logging.WARNING)
+    content = make_document(int(args.size_mb * 1024 * 1024))
+    chunker.get_sentence_tokenizer()  # Load the tokenizer outside of the timings
+
+    bench("chunk_document (chars)", chunker.chunk_document, content, args.repeat)
+    bench("chunk_document (tokens)", lambda text: chunker.chunk_document(text, 250, 50, unit="tokens"), content, args.repeat)
+    if not args.skip_legacy:
+        bench("legacy chunk_document", legacy_chunk_document, content, args.repeat)
+
+if __name__ == "__main__":
+    main()
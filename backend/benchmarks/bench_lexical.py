@@ -0,0 +1,86 @@
+"""
+Benchmark for the BM25 lexical index used by hybrid search.
+
+Indexes synthetic chunks (prose with a course code and a formula name here and there)
+into a temporary lexical index, then reports the query latency percentiles for rare
+terms, common terms and natural language questions.
+
+Usage (from /backend):
+    poetry run python -m benchmarks.bench_lexical --chunks 100000
+"""
+import os
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+
+from src import lexical_index
+
+WORDS = (
+    "the cell membrane regulates transport of ions and molecules while enzymes catalyse "
+    "reactions in the cytoplasm and energy is stored as adenosine triphosphate for later use "
+    "students review recursion sorting graphs matrices derivatives integrals and probability"
+).split()
+
+# A long tail of rarer words with Zipf-like frequencies, like the vocabulary of real course notes
+VOCABULARY = WORDS + [f"term{i}" for i in range(20000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+QUERIES = {
+    "rare term": ["CHEM{:03d}"],
+    "common terms": ["cell membrane transport", "energy stored in the cytoplasm", "recursion and sorting"],
+    "mixed terms": ["term{} in the cell membrane", "how do term{} and term500 relate?"],
+    "question": ["What does the cell membrane regulate?", "How is energy stored for later use?", "What is CS{:03d} about?"],
+}
+
+def make_chunk(rng: random.Random, i: int) -> str:
+    words = rng.choices(VOCABULARY, weights=WEIGHTS, k=rng.randint(120, 180))
+    if i % 100 == 0:
+        words.insert(rng.randrange(len(words)), f"CHEM{i // 100 % 1000:03d}")
+    if i % 37 == 0:
+        words.insert(rng.randrange(len(words)), f"CS{i % 1000:03d}")
+    return " ".join(words).capitalize() + "."
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=100000, help="number of indexed chunks")
+    parser.add_argument("--queries", type=int, default=200, help="queries per query type")
+    parser.add_argument("--n-results", type=int, default=20, help="results per query, hybrid search asks for 4 per result")
+    args = parser.parse_args()
+
+    logging.getLogger(lexical_index.__name__).setLevel(logging.WARNING)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        index = lexical_index.LexicalIndex(os.path.join(temp_dir, "index.sqlite3"))
+        rng = random.Random(0)
+        start = time.perf_counter()
+        batch_size = 64
+        for offset in range(0, args.chunks, batch_size):
+            ids = [f"doc{i // 500}.pdf_{i}" for i in range(offset, min(offset + batch_size, args.chunks))]
+            documents = [make_chunk(rng, offset + i) for i in range(len(ids))]
+            index.add(ids, documents, [{"source": id.split("_")[0]} for id in ids])
+        print(f"Indexed {args.chunks} chunks in {time.perf_counter() - start:.1f} s")
+
+        for name, queries in QUERIES.items():
+            latencies = []
+            for i in range(args.queries):
+                query = queries[i % len(queries)].format(rng.randrange(1000))
+                start = time.perf_counter()
+                index.search(query, args.n_results)
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(f"{name:<14} p50 {percentile(latencies, 0.5):7.2f} ms  p95 {percentile(latencies, 0.95):7.2f} ms")
+
+        start = time.perf_counter()
+        index.delete_source("doc0.pdf")
+        print(f"Deleted a 500 chunk document in {(time.perf_counter() - start) * 1000:.1f} ms")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
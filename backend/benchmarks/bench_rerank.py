@@ -0,0 +1,80 @@
+"""
+Benchmark for the cross-encoder reranking stage.
+
+Scores 20, 50 and 100 synthetic candidates of about one chunk each against a query in one
+batched run, and reports the p50/p95 latency of each candidate count next to the rerank budget.
+
+Without a cross-encoder (--model-path or RERANKER_MODEL_PATH), --proxy times the MiniLM-L6
+embedding model Chroma downloads on the same query and chunk pairs. It has the same encoder
+as cross-encoder/ms-marco-MiniLM-L-6-v2 without the classification head, so the latency is
+representative even though the scores are meaningless.
+
+Usage (from /backend):
+    RERANKER_MODEL_PATH=models/ms-marco-MiniLM-L-6-v2 poetry run python -m benchmarks.bench_rerank
+    poetry run python -m benchmarks.bench_rerank --proxy
+"""
+import os
+import time
+import random
+import argparse
+import logging
+
+from src import reranker
+
+WORDS = (
+    "the cell membrane regulates transport of ions and molecules while enzymes catalyse "
+    "reactions in the cytoplasm and energy is stored as adenosine triphosphate for later use"
+).split()
+
+def make_chunk(rng: random.Random, size: int) -> str:
+    """Builds a chunk of roughly size characters out of short sentences."""
+    sentences = []
+    while sum(len(sentence) + 1 for sentence in sentences) < size:
+        sentences.append(" ".join(rng.choices(WORDS, k=rng.randint(8, 20))).capitalize() + ".")
+    return " ".join(sentences)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path", default=reranker.RERANKER_MODEL_PATH, help="directory with model.onnx and tokenizer.json")
+    parser.add_argument("--proxy", action="store_true", help="time Chroma's MiniLM-L6 model when there is no cross-encoder")
+    parser.add_argument("--candidates", type=int, nargs="+", default=[20, 50, 100], help="candidate counts to time")
+    parser.add_argument("--chunk-chars", type=int, default=1000, help="size of each candidate, chunk_document makes up to 1000")
+    parser.add_argument("--runs", type=int, default=30, help="timed runs per candidate count")
+    parser.add_argument("--threads", type=int, default=reranker.RERANK_THREADS, help="ONNX Runtime intra-op threads")
+    args = parser.parse_args()
+
+    model_path = args.model_path
+    if args.proxy:
+        from src import embeddings
+        embedding_function = embeddings.get_embedding_function()
+        embedding_function._download_model_if_not_exists()
+        model_path = os.path.join(embedding_function.DOWNLOAD_PATH, embedding_function.EXTRACTED_FOLDER_NAME)
+    if not model_path:
+        parser.error("set --model-path or RERANKER_MODEL_PATH, or use --proxy")
+
+    logging.getLogger(reranker.__name__).setLevel(logging.WARNING)
+    cross_encoder = reranker.CrossEncoderReranker(model_path, intra_op_threads=args.threads)
+    # The proxy model has no classification head, time the forward pass it shares with a cross-encoder
+    run = cross_encoder.forward if args.proxy else cross_encoder.score
+    rng = random.Random(0)
+    query = "How does the cell membrane regulate the transport of ions?"
+    run(query, [make_chunk(rng, args.chunk_chars)])  # Load the model outside of the timings
+
+    print(f"Model {model_path}, budget {cross_encoder.budget_ms:.0f} ms, max length {cross_encoder.max_length} tokens")
+    for count in args.candidates:
+        documents = [make_chunk(rng, args.chunk_chars) for _ in range(count)]
+        latencies = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            run(query, documents)
+            latencies.append((time.perf_counter() - start) * 1000)
+        p50, p95 = percentile(latencies, 0.5), percentile(latencies, 0.95)
+        within = "within" if p95 <= cross_encoder.budget_ms else "over"
+        print(f"{count:4d} candidates  p50 {p50:8.1f} ms  p95 {p95:8.1f} ms  ({within} budget)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Startup benchmark for the Flask app factory.
+
+Starts fresh interpreters and measures how long `import src` and `create_app()` take before
+the app can serve, and how long until every warmup step is ready, with and without
+FAST_START. Run it with Redis, Chroma and the NLTK data available for realistic numbers.
+
+Usage (from /backend):
+    poetry run python -m benchmarks.bench_startup --repeat 3
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+PROBE = r"""
+import json, time
+start = time.perf_counter()
+import src
+imported = time.perf_counter()
+app = src.create_app()
+created = time.perf_counter()
+app.warmup.wait()
+ready = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "create_app": created - imported,
+    "ready": ready - start,
+    "steps": {step: result["seconds"] for step, result in app.warmup.status()["steps"].items()},
+    "errors": app.warmup.error(),
+}))
+"""
+
+def measure(fast_start: bool) -> dict:
+    env = dict(os.environ, FAST_START="true" if fast_start else "false")
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per mode, the median is reported")
+    args = parser.parse_args()
+
+    print(f"{'mode':<12} {'import':>8} {'create_app':>11} {'serving':>8} {'ready':>8}  steps")
+    for fast_start in (False, True):
+        runs = [measure(fast_start) for _ in range(args.repeat)]
+        median = lambda key: statistics.median(run[key] for run in runs)
+        steps = ", ".join(f"{step} {statistics.median(run['steps'][step] or 0 for run in runs):.2f}s" for step in runs[0]["steps"])
+        print(f"{'fast start' if fast_start else 'blocking':<12} {median('import'):7.2f}s {median('create_app'):10.2f}s "
+              f"{median('import') + median('create_app'):7.2f}s {median('ready'):7.2f}s  {steps}")
+        if runs[-1]["errors"]:
+            print(f"{'':<12} warmup errors: {runs[-1]['errors']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Load test for the backend API.
+
+Sends requests to one endpoint from many concurrent clients and reports throughput
+and latency percentiles. To compare serving modes, run the backend against the stub
+Ollama server, once with each worker class, and load it the same way:
+
+    poetry run python -m benchmarks.stubs ollama --port 11500 --latency 2 &
+    OLLAMA_HOST=127.0.0.1:11500 GUNICORN_WORKER_CLASS=sync poetry run gunicorn -c gunicorn.conf.py src.wsgi:app
+    OLLAMA_HOST=127.0.0.1:11500 GUNICORN_WORKER_CLASS=gevent poetry run gunicorn -c gunicorn.conf.py src.wsgi:app
+
+    poetry run python -m benchmarks.load_test --endpoint chat --concurrency 50 --requests 200
+"""
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ENDPOINTS = {
+    "chat": ("POST", "chat", {"prompt": "What does the cell membrane do?", "model": "stub-model:latest"}),
+    "chat-stream": ("POST", "chat", {"prompt": "What does the cell membrane do?", "model": "stub-model:latest", "stream": True}),
+    "search": ("POST", "search", {"query": "cell membrane"}),
+    "status": ("GET", "status", None),
+}
+
+def percentile(values, fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def send(session: requests.Session, method: str, url: str, body, timeout: float):
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, json=body, timeout=timeout)
+        # Read the whole body so streamed responses are timed to their last byte
+        response.content
+        ok = response.status_code < 400
+    except requests.RequestException:
+        ok = False
+    return ok, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:9090/api/")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="chat")
+    parser.add_argument("--concurrency", type=int, default=20, help="clients sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=100, help="total requests to send")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    method, path, body = ENDPOINTS[args.endpoint]
+    url = args.base_url.rstrip("/") + "/" + path
+    # One session per client thread so connections are reused like a browser would
+    sessions = [requests.Session() for _ in range(args.concurrency)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(
+            lambda i: send(sessions[i % args.concurrency], method, url, body, args.timeout),
+            range(args.requests)
+        ))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for ok, latency in results if ok]
+    errors = len(results) - len(latencies)
+    print(f"{args.endpoint}: {args.requests} requests, {args.concurrency} concurrent, {elapsed:.2f} s")
+    print(f"throughput  {len(latencies) / elapsed:8.2f} req/s")
+    print(f"errors      {errors:8d}")
+    if latencies:
+        print(f"latency p50 {percentile(latencies, 0.50):8.3f} s")
+        print(f"latency p95 {percentile(latencies, 0.95):8.3f} s")
+        print(f"latency p99 {percentile(latencies, 0.99):8.3f} s")
+        print(f"latency avg {statistics.mean(latencies):8.3f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Local stand-ins for the upstream services, so benchmarks measure our code and not a GPU.
+
+Each stub is a threaded http.server that answers after a fixed latency, and can run
+in the background of a benchmark or on its own:
+    poetry run python -m benchmarks.stubs ollama --port 11500 --latency 2
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    """Answers the Ollama endpoints the backend uses after server.latency seconds."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "stub-model:latest", "size": 0, "details": {}}]})
+        else:
+            self._send_json({})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        words = ["This", "is", "a", "stub", "answer."]
+        if not request.get("stream"):
+            time.sleep(self.server.latency)
+            self._send_json({"message": {"role": "assistant", "content": " ".join(words)}, "done": True})
+            return
+
+        # Stream NDJSON like Ollama does, spreading the latency over the tokens
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        for word in words:
+            time.sleep(self.server.latency / len(words))
+            self.wfile.write((json.dumps({"message": {"content": word + " "}, "done": False}) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write((json.dumps({"done": True, "eval_count": len(words)}) + "\n").encode("utf-8"))
+
+class StubVertexHandler(BaseHTTPRequestHandler):
+    """
+    Answers Vertex chat-completions requests after server.latency seconds.
+
+    Requests with several images get a JSON array with one caption per image, like a model
+    following the batch captioning prompt. Counts requests and images in server.stats.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        content = request["messages"][0]["content"]
+        images = sum(1 for part in content if part.get("type") == "image_url")
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            self.server.stats["images"] += images
+        time.sleep(self.server.latency)
+
+        if images > 1:
+            answer = json.dumps([f"Stub caption of image {i + 1}." for i in range(images)])
+        else:
+            answer = "Stub caption of the image."
+        data = json.dumps({"choices": [{"message": {"role": "assistant", "content": answer}}]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_stub(handler, port: int = 0, latency: float = 1.0) -> ThreadingHTTPServer:
+    """
+    Starts a stub server on a background thread.
+
+    Args:
+        handler: The request handler class, e.g. StubOllamaHandler.
+        port (int): The port to listen on, 0 picks a free one.
+        latency (float): Seconds each request takes.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its URL port is server.server_address[1].
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.stats = {"requests": 0, "images": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+STUBS = {"ollama": StubOllamaHandler, "vertex": StubVertexHandler}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stub", choices=sorted(STUBS), help="which upstream to stand in for")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency", type=float, default=2.0, help="seconds each request takes")
+    args = parser.parse_args()
+
+    server = start_stub(STUBS[args.stub], args.port, args.latency)
+    print(f"Stub {args.stub} listening on http://127.0.0.1:{server.server_address[1]} with {args.latency}s latency")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# gunicorn.conf.py
+#
+# Gevent workers serve many requests per process: while a request waits on Ollama,
+# Chroma or Redis, the worker serves other requests instead of blocking. This matters
+# for /chat, which holds a request open for the whole generation.
+# Set GUNICORN_WORKER_CLASS=sync to go back to one request per worker.
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:9090")
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# Concurrent requests per gevent worker
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+# For gevent workers this only bounds how long a worker may stop responding, not a request
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
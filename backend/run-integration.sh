@@ -41,19 +41,24 @@ done
 echo "Chroma is ready!"
 
 # Start Gunicorn in the background
-poetry run gunicorn --bind 0.0.0.0:9090 src.wsgi:app &
+poetry run gunicorn -c gunicorn.conf.py src.wsgi:app &
 GUNICORN_PID=$!
 echo "Started Gunicorn with PID $GUNICORN_PID"
 
-# Start Celery Worker in the background
-poetry run celery -A src worker --pool=solo --loglevel=INFO &
-CELERY_PID=$!
-echo "Started Celery with PID $CELERY_PID"
+# Start one Celery worker per queue in the background, see supervisord.conf
+poetry run celery -A src worker -Q ocr -n ocr@%h --pool=solo --loglevel=INFO &
+CELERY_OCR_PID=$!
+poetry run celery -A src worker -Q caption -n caption@%h --pool=threads --concurrency=4 --loglevel=INFO &
+CELERY_CAPTION_PID=$!
+poetry run celery -A src worker -Q embed,celery -n embed@%h --pool=threads --concurrency=2 --loglevel=INFO &
+CELERY_EMBED_PID=$!
+CELERY_PIDS="$CELERY_OCR_PID $CELERY_CAPTION_PID $CELERY_EMBED_PID"
+echo "Started Celery workers with PIDs $CELERY_PIDS"
 
 # Function to handle termination
 terminate() {
     echo "Terminating processes..."
-    kill $CHROMA_PID $GUNICORN_PID $CELERY_PID
+    kill $CHROMA_PID $GUNICORN_PID $CELERY_PIDS
     exit 0
 }
 
@@ -61,4 +66,4 @@ terminate() {
 trap terminate SIGINT SIGTERM
 
 # Wait for all processes to finish
-wait $CHROMA_PID $GUNICORN_PID $CELERY_PID
+wait $CHROMA_PID $GUNICORN_PID $CELERY_PIDS
@@ -18,6 +18,10 @@ def make_celery(app):
     celery.conf.update(app.config)
     celery.autodiscover_tasks(['src'])  # Auto-discover tasks in 'src' package
 
+    # Send each ingestion stage to the queue of its workload type
+    from .tasks import TASK_ROUTES
+    celery.conf.task_routes = TASK_ROUTES
+
     class ContextTask(celery.Task):
         """Ensures each task runs within the Flask app context."""
         def __call__(self, *args, **kwargs):
@@ -62,28 +66,14 @@ def create_app():
     except Exception as e:
         app.logger.error(f"Error creating directories: {str(e)}")
 
-    # Global variables to track initialization status
-    app.nltk_ready = False
-    app.chroma_ready = False
-    app.initialization_error = None
-
-    with app.app_context():
-        try:
-            # Initialize NLTK
-            import nltk
-            nltk.download('punkt_tab', quiet=True)
-            app.nltk_ready = True
-
-            # Initialize Chroma collection
-            from . import vector_db
-            vector_db.initialize_chroma()
-            app.chroma_ready = True
-        except LookupError as le:
-            app.initialization_error = f"NLTK LookupError: {str(le)}"
-            app.logger.error(f"Initialization error: {str(le)}")
-        except Exception as e:
-            app.initialization_error = f"General Initialization Error: {str(e)}"
-            app.logger.error(f"Initialization error: {str(e)}")
+    # Slow startup work (NLTK data, the embedding model, the Chroma connection) is done by
+    # app.warmup, in the background with FAST_START, and reported by /status
+    from .warmup import Warmup, FAST_START
+    app.warmup = Warmup(app)
+    if FAST_START:
+        app.warmup.start()
+    else:
+        app.warmup.run()
 
     # Register blueprints or routes
     from .main import bp as main_bp
@@ -91,5 +81,11 @@ def create_app():
 
     return app
 
-# Expose the celery app instance at the module level
-celery = make_celery(create_app())
+def __getattr__(name):
+    # Expose the celery app instance at the module level (`celery -A src`), created on first
+    # access so importing src (gunicorn, tests, benchmarks) doesn't build a second Flask app
+    if name == "celery":
+        global celery
+        celery = make_celery(create_app())
+        return celery
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CATALOGUE_PATH = os.getenv("CATALOGUE_PATH", os.path.join("cache", "catalogue.sqlite3"))
+CATALOGUE_PAGE_SIZE = int(os.getenv("CATALOGUE_PAGE_SIZE", "50"))  # Documents per page of /documents by default
+CATALOGUE_MAX_PAGE_SIZE = 500
+
+STATUSES = ("queued", "processing", "ready", "failed")
+# Columns /documents can be sorted on, each has an index with the filename so a page is read without sorting the table
+SORT_COLUMNS = ("filename", "uploaded_at", "size", "pages", "chunks", "status")
+# Columns set by update, the rest are set when a document is added
+UPDATABLE_COLUMNS = ("status", "error", "pages", "chunks", "job_id", "started_at", "finished_at")
+
+# Global variable to store the catalogue so it doesn't get made more than once
+catalogue = None
+
+class DocumentCatalogue:
+    """
+    The uploaded documents, their content hash, size, page and chunk counts, ingestion status and timings.
+
+    Kept in SQLite next to the caches, so listing documents and detecting duplicate uploads are
+    indexed lookups instead of a listing of the upload folder or a metadata query to Chroma.
+    The web process adds documents, the Celery tasks record their progress. Like LexicalIndex,
+    each thread of each process opens its own connection.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        with connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    filename TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    pages INTEGER,
+                    chunks INTEGER,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    job_id TEXT,
+                    uploaded_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    timings TEXT NOT NULL DEFAULT '{}'
+                );
+            """)
+            # Pages are ordered by the sort column then the filename, so each index covers both
+            for column in SORT_COLUMNS:
+                if column != "filename":
+                    connection.execute(f"DROP INDEX IF EXISTS documents_{column}")
+                    connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS documents_{column}_filename ON documents ({column}, filename)"
+                    )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not be shared across threads or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def add(self, filename: str, path: str, hash: str, size: int, status: str = "queued",
+            job_id: Optional[str] = None) -> None:
+        """
+        Records an uploaded document, replacing the record of an earlier upload under the same name.
+
+        Args:
+            filename (str): The name of the document, as listed by /documents.
+            path (str): The path of the uploaded file.
+            hash (str): The content hash of the file, see disk_cache.file_hash.
+            size (int): The size of the file in bytes.
+            status (str): One of STATUSES.
+            job_id (str): The id of the ingestion job.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                """
+                INSERT OR REPLACE INTO documents (filename, path, hash, size, status, job_id, uploaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (filename, path, hash, size, status, job_id, time.time())
+            )
+
+    def update(self, filename: str, **fields) -> None:
+        """
+        Sets some of the UPDATABLE_COLUMNS of a document, documents not in the catalogue are ignored.
+
+        Args:
+            filename (str): The name of the document.
+            **fields: The columns to set, e.g. status="ready", chunks=120.
+        """
+        unknown = set(fields) - set(UPDATABLE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown catalogue columns: {', '.join(sorted(unknown))}")
+        if "status" in fields and fields["status"] not in STATUSES:
+            raise ValueError(f"Unknown document status: {fields['status']}")
+        if not fields:
+            return
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        connection = self._connection()
+        with connection:
+            connection.execute(f"UPDATE documents SET {assignments} WHERE filename = ?", (*fields.values(), filename))
+
+    def add_timing(self, filename: str, stage: str, seconds: float) -> None:
+        """
+        Records how long an ingestion stage took for a document.
+
+        Args:
+            filename (str): The name of the document.
+            stage (str): The stage, e.g. one of progress.STAGES.
+            seconds (float): Its duration.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "UPDATE documents SET timings = json_set(timings, ?, ?) WHERE filename = ?",
+                (f'$."{stage}"', round(seconds, 3), filename)
+            )
+
+    def delete(self, filename: str) -> None:
+        """Removes a document from the catalogue."""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM documents WHERE filename = ?", (filename,))
+
+    def get(self, filename: str) -> Optional[dict]:
+        """
+        The record of a document.
+
+        Args:
+            filename (str): The name of the document.
+
+        Returns:
+            Optional[dict]: Its columns, timings as a dict, None if it is not in the catalogue.
+        """
+        row = self._connection().execute("SELECT * FROM documents WHERE filename = ?", (filename,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def is_duplicate(self, filename: str, hash: str) -> bool:
+        """
+        Whether an upload is the same content as the document already stored under its name.
+
+        A document whose ingestion failed is not a duplicate, so it can be uploaded again.
+
+        Args:
+            filename (str): The name of the upload.
+            hash (str): Its content hash.
+
+        Returns:
+            bool: True if the upload should be rejected.
+        """
+        row = self._connection().execute(
+            "SELECT hash, status FROM documents WHERE filename = ?", (filename,)
+        ).fetchone()
+        return row is not None and row["hash"] == hash and row["status"] != "failed"
+
+    def filenames(self) -> List[str]:
+        """The names of every document, in name order."""
+        return [row[0] for row in self._connection().execute("SELECT filename FROM documents ORDER BY filename")]
+
+    def list_documents(self, page: int = 1, per_page: int = CATALOGUE_PAGE_SIZE, sort: str = "filename",
+             order: str = "asc") -> Tuple[List[dict], int]:
+        """
+        A page of documents.
+
+        Args:
+            page (int): The page number, from 1.
+            per_page (int): Documents per page, at most CATALOGUE_MAX_PAGE_SIZE.
+            sort (str): One of SORT_COLUMNS.
+            order (str): "asc" or "desc".
+
+        Returns:
+            Tuple[List[dict], int]: The documents of the page and the total number of documents.
+
+        Raises:
+            ValueError: If sort, order, page or per_page is not valid.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        if page < 1 or not 1 <= per_page <= CATALOGUE_MAX_PAGE_SIZE:
+            raise ValueError(f"page must be at least 1 and per_page between 1 and {CATALOGUE_MAX_PAGE_SIZE}")
+
+        connection = self._connection()
+        # The filename breaks ties, so pages don't overlap when sorting on a column with repeated values
+        order_by = f"filename {order}" if sort == "filename" else f"{sort} {order}, filename {order}"
+        rows = connection.execute(
+            f"SELECT * FROM documents ORDER BY {order_by} LIMIT ? OFFSET ?",
+            (per_page, (page - 1) * per_page)
+        ).fetchall()
+        total = connection.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        return [self._to_dict(row) for row in rows], total
+
+    def sync(self, upload_folder: str, hash_file) -> Tuple[int, int]:
+        """
+        Adds the files of the upload folder that are not in the catalogue, e.g. uploaded before it
+        existed, as ready documents, and removes the documents whose file is gone.
+
+        Args:
+            upload_folder (str): The upload folder.
+            hash_file: Hashes a binary file object, see disk_cache.file_hash.
+
+        Returns:
+            Tuple[int, int]: The number of documents added and removed.
+        """
+        files = {
+            entry.name: entry.path for entry in os.scandir(upload_folder) if entry.is_file()
+        } if os.path.isdir(upload_folder) else {}
+        known = set(self.filenames())
+
+        added = 0
+        for filename in sorted(set(files) - known):
+            path = files[filename]
+            with open(path, 'rb') as f:
+                file_hash = hash_file(f)
+            self.add(filename, path, file_hash, os.path.getsize(path), status="ready")
+            added += 1
+        removed = known - set(files)
+        for filename in removed:
+            self.delete(filename)
+        if added or removed:
+            logger.info(f"Synced the document catalogue with {upload_folder}: {added} added, {len(removed)} removed")
+        return added, len(removed)
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        document = dict(row)
+        document["timings"] = json.loads(document["timings"])
+        return document
+
+def get_catalogue() -> DocumentCatalogue:
+    """
+    Getter for the document catalogue shared by the API and the ingestion tasks.
+
+    Returns:
+        DocumentCatalogue: the document catalogue.
+    """
+    global catalogue
+    if catalogue is None:
+        catalogue = DocumentCatalogue(CATALOGUE_PATH)
+    return catalogue
@@ -0,0 +1,184 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", os.path.join("cache", "image_cache.sqlite3"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))  # 64 MB
+
+# Global variable to store the image cache so it doesn't get made more than once
+image_cache = None
+
+def content_hash(data: bytes) -> str:
+    """
+    Hashes raw content, e.g. the bytes of an image.
+
+    Args:
+        data (bytes): The content to hash.
+
+    Returns:
+        str: The hex SHA-256 digest of the content.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def file_hash(file) -> str:
+    """
+    Hashes the content of a binary file object without reading it into memory at once.
+
+    Args:
+        file: A file object opened in binary mode, read from its current position.
+
+    Returns:
+        str: The hex SHA-256 digest of the content.
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+def make_key(*parts) -> str:
+    """
+    Builds a cache key out of several parts, e.g. a content hash, a prompt and a model id.
+
+    Args:
+        *parts: The parts of the key, converted to strings.
+
+    Returns:
+        str: The hex SHA-256 digest of the joined parts.
+    """
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+class DiskCache:
+    """
+    A persistent, size-bounded key/value cache stored in SQLite.
+
+    Entries are evicted least recently used first once the total size of the stored
+    values exceeds max_bytes. The cache can be shared by threads and processes, each
+    thread of each process opens its own connection.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        with connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+                CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER NOT NULL);
+                INSERT OR IGNORE INTO stats (id, total_size) VALUES (0, 0);
+                CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                    UPDATE stats SET total_size = total_size + NEW.size WHERE id = 0;
+                END;
+                CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                    UPDATE stats SET total_size = total_size - OLD.size WHERE id = 0;
+                END;
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not be shared across threads or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Looks up a value and marks it as recently used.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Optional[bytes]: The cached value, or None on a miss or a cache error.
+        """
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with connection:
+                connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Cache lookup failed in {self.path}: {e}")
+            return None
+
+    def set(self, key: str, value: bytes) -> None:
+        """
+        Stores a value, evicting the least recently used entries if the cache grows too big.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value to store.
+        """
+        if len(value) > self.max_bytes:
+            return
+        try:
+            connection = self._connection()
+            with connection:
+                # Delete first so the size triggers stay correct when a key is overwritten
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                connection.execute(
+                    "INSERT INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), time.time())
+                )
+                self._evict(connection)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache write failed in {self.path}: {e}")
+
+    def get_text(self, key: str) -> Optional[str]:
+        """Like get, for values stored with set_text."""
+        value = self.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set_text(self, key: str, value: str) -> None:
+        """Like set, for string values."""
+        self.set(key, value.encode("utf-8"))
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        total_size = connection.execute("SELECT total_size FROM stats WHERE id = 0").fetchone()[0]
+        if total_size <= self.max_bytes:
+            return
+        # Evict down to 90% of the limit so we don't evict on every single write
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY last_access"):
+            if total_size - freed <= target:
+                break
+            evicted.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} entries ({freed} bytes) from {self.path}")
+
+def get_image_cache() -> DiskCache:
+    """
+    Getter for the cache of image captions and OCR results, keyed by image content hash.
+
+    Returns:
+        DiskCache: the shared image cache.
+    """
+    global image_cache
+    if image_cache is None:
+        image_cache = DiskCache(IMAGE_CACHE_PATH, IMAGE_CACHE_MAX_BYTES)
+    return image_cache
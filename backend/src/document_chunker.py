@@ -1,27 +1,37 @@
 import os
 import re
 import io
-import uuid
 import logging
 import glob
+import zlib
+import time
+import multiprocessing
 
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import List
-from nltk.tokenize import sent_tokenize
+from typing import Iterable, Iterator, List, Tuple, Union
+from nltk.tokenize.punkt import PunktTokenizer
 from logging.handlers import RotatingFileHandler
 from PIL import Image
 from chromadb.config import Settings
 
 import fitz  # PyMuPDF
-import pytesseract
 import chromadb
 
 from . import google_calls
 from . import document_textractor
+from . import disk_cache
+from . import vector_db
+from . import embeddings
+from . import http_sessions
+from . import progress
+from . import ocr_planner
 
 # Constants
-MAX_IMAGE_SIZE = (1000, 1000)  # Maximum width and height for images
 IMAGE_DIR_NAME = "extracted_images"  # Directory to save extracted images
+# Extracted images are kept in memory and handed to the captioner as they are, saving a copy
+# of each under IMAGE_DIR_NAME is only useful to see what was captioned
+SAVE_EXTRACTED_IMAGES = os.getenv("SAVE_EXTRACTED_IMAGES", "false").lower() in ("1", "true", "yes")
 CAPTION_START = "[[IMAGE_CAPTION_START]]"
 CAPTION_END = "[[IMAGE_CAPTION_END]]"
 ALLOWED_FILE_EXTENSIONS = {'.txt', '.md', '.pdf'}  # Allowed file types
@@ -30,7 +40,25 @@ LOG_DIR = "logs"
 LOG_FILE = "document_chunker.log"
 MAX_LOG_SIZE = 10 * 1024 * 1024  # 10 MB
 BACKUP_COUNT = 5
+# Write the extracted text of every document to LOG_DIR, to see what was chunked
+LOG_FULL_CONTENT = os.getenv("LOG_FULL_CONTENT", "false").lower() in ("1", "true", "yes")
+TEXT_READ_SIZE = 1024 * 1024  # Characters of text files read at a time
 BASE_PATH = "."
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", os.cpu_count() or 1))  # Processes for page extraction/OCR
+PDF_PAGE_WINDOW = int(os.getenv("PDF_PAGE_WINDOW", "4"))  # Pages submitted ahead per page worker
+CAPTION_WORKERS = int(os.getenv("CAPTION_WORKERS", "4"))  # Concurrent image captioning requests
+CAPTION_PAGES_AHEAD = int(os.getenv("CAPTION_PAGES_AHEAD", "8"))  # Pages captioned ahead of the page being streamed
+CHUNK_SIZE_UNITS = ("chars", "tokens")
+CAPTION_PATTERN = re.compile(re.escape(CAPTION_START) + r'.*?' + re.escape(CAPTION_END), re.DOTALL)
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+CHUNK_ANCHOR_DIVISOR = 4  # On average one sentence in this many is an anchor for content-defined chunk boundaries
+# Sentences at the end of a part of a streamed document that are split again with the next part,
+# the last one may be cut off and the sentence boundary before it depends on the words after it
+STREAM_CARRY_SENTENCES = 2
+STREAM_MAX_CARRY_CHARS = 100000  # Past this, text without sentence boundaries is chunked without waiting for more
+
+# Global variable to store the sentence tokenizer so it doesn't get loaded more than once
+sentence_tokenizer = None
 
 def setup_logging(log_to_file=True):
     logger = logging.getLogger(__name__)
@@ -107,7 +135,17 @@ def cleanup_existing_files(base_path: str, log_file: str, image_dir: str):
 
     logger.info("Cleanup of project files completed.")
 
-def log_full_content(content, file_path):
+def log_full_content(parts: Iterable[str], file_path: str) -> Iterator[str]:
+    """
+    Writes the extracted content of a document to LOG_DIR as it streams by, see LOG_FULL_CONTENT.
+
+    Args:
+        parts (Iterable[str]): The content of the document, in order.
+        file_path (str): The path to the document, which names the log.
+
+    Yields:
+        str: The parts, unchanged.
+    """
     # Ensure content log directory exists
     os.makedirs(LOG_DIR, exist_ok=True)
     
@@ -118,7 +156,9 @@ def log_full_content(content, file_path):
     
     # Write content to file
     with open(log_path, 'w', encoding='utf-8') as f:
-        f.write(content)
+        for part in parts:
+            f.write(part)
+            yield part
 
 def ensure_image_dir(base_path: str) -> str:
     """
@@ -135,91 +175,552 @@ def ensure_image_dir(base_path: str) -> str:
     logger.debug(f"Ensured image directory exists at: {image_path}")
     return image_path
 
-def scale_image(image_bytes: bytes) -> bytes:
+def image_path_for(image_dir: str, image_bytes: bytes) -> str:
     """
-    Scale the image to a maximum size while maintaining aspect ratio.
+    Content-addressed path of an extracted image, so the same image is only saved once.
 
     Args:
-        image_bytes (bytes): The original image bytes.
+        image_dir (str): The directory for extracted images.
+        image_bytes (bytes): The original bytes of the image.
 
     Returns:
-        bytes: The scaled image bytes in JPEG format.
+        str: The path of the image inside image_dir.
+    """
+    return os.path.join(image_dir, f"{disk_cache.content_hash(image_bytes)}.jpeg")
+
+def save_extracted_image(image_dir: str, image_bytes: bytes, jpeg_bytes: bytes) -> None:
     """
+    Saves the JPEG sent for captioning of an extracted image, for debugging, see SAVE_EXTRACTED_IMAGES.
+
+    Args:
+        image_dir (str): The directory for extracted images.
+        image_bytes (bytes): The original bytes of the image, which name the file.
+        jpeg_bytes (bytes): The image as sent for captioning.
+    """
+    image_path = image_path_for(image_dir, image_bytes)
+    if os.path.exists(image_path):
+        return
     try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            img.thumbnail(MAX_IMAGE_SIZE, Image.LANCZOS)
-            output = io.BytesIO()
-            img.save(output, format='JPEG')
-            scaled_bytes = output.getvalue()
-            logger.debug("Image scaled successfully.")
-            return scaled_bytes
+        # Write then rename, another worker may be saving the same image
+        tmp_path = f"{image_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as img_file:
+            img_file.write(jpeg_bytes)
+        os.replace(tmp_path, image_path)
+        logger.debug(f"Saved image to {image_path}")
     except Exception as e:
-        logger.error(f"Failed to scale image: {e}")
-        raise
+        logger.error(f"Failed to save image {image_path}: {e}")
+
+def count_tokens(text: str) -> int:
+    """
+    Cheap token count estimate: words and punctuation marks.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return sum(1 for _ in TOKEN_PATTERN.finditer(text))
 
-def chunk_document(content: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+def get_sentence_tokenizer() -> PunktTokenizer:
+    """
+    Getter for the Punkt sentence tokenizer, loaded once instead of on every call.
+
+    Returns:
+        PunktTokenizer: the english sentence tokenizer.
+    """
+    global sentence_tokenizer
+    if sentence_tokenizer is None:
+        sentence_tokenizer = PunktTokenizer("english")
+    return sentence_tokenizer
+
+def is_anchor_sentence(sentence: str) -> bool:
+    """
+    Whether a sentence is a content-defined chunk boundary, decided by a hash of the sentence alone.
+
+    Args:
+        sentence (str): The sentence.
+
+    Returns:
+        bool: True for roughly one sentence in CHUNK_ANCHOR_DIVISOR.
+    """
+    return zlib.crc32(sentence.encode("utf-8")) % CHUNK_ANCHOR_DIVISOR == 0
+
+def chunk_document(content: str, chunk_size: int = 1000, overlap: int = 200, unit: str = "chars",
+                   anchored: bool = False) -> List[str]:
     """
     Chunks the document while respecting image captions.
     Ensures that caption start and end markers are always in the same chunk.
 
     Args:
         content (str): The full text content of the document.
-        chunk_size (int): Maximum number of characters per chunk.
-        overlap (int): Number of overlapping characters between chunks.
+        chunk_size (int): Maximum size of a chunk, in characters or tokens.
+        overlap (int): Maximum size of the overlap between consecutive chunks, in the same unit.
+        unit (str): "chars" to measure characters, "tokens" to measure estimated tokens (see count_tokens).
+        anchored (bool): Also end a chunk after an anchor sentence, see iter_chunks.
 
     Returns:
         List[str]: A list of text chunks.
     """
-    logger.debug("Starting document chunking.")
-    # Define a regex pattern to match image captions
-    caption_pattern = re.escape(CAPTION_START) + r'.*?' + re.escape(CAPTION_END)
+    return list(iter_chunks([content], chunk_size, overlap, unit, anchored))
 
-    # Split the content into parts, separating captions and other text
-    parts = re.split(f'({caption_pattern})', content, flags=re.DOTALL)
+def iter_chunks(parts: Iterable[str], chunk_size: int = 1000, overlap: int = 200, unit: str = "chars",
+                anchored: bool = False) -> Iterator[str]:
+    """
+    Chunks a document given as consecutive parts of its text, e.g. its pages, as the parts come in.
+
+    The chunks are the same as chunk_document would make of the parts joined together: the
+    last STREAM_CARRY_SENTENCES sentences of a part, which may go on in the next part, are
+    carried over and split into sentences again with it. Only the current chunk and the
+    carried text are held in memory, whatever the length of the document.
 
-    chunks = []
-    current_chunk = ""
+    Every sentence is measured once, and the overlap is made of the last whole sentences of
+    the previous chunk, so chunking is linear in the content size.
 
+    Args:
+        parts (Iterable[str]): The text of the document, in order.
+        chunk_size (int): Maximum size of a chunk, in characters or tokens.
+        overlap (int): Maximum size of the overlap between consecutive chunks, in the same unit.
+        unit (str): "chars" to measure characters, "tokens" to measure estimated tokens (see count_tokens).
+        anchored (bool): Also end a chunk after an anchor sentence (see is_anchor_sentence) once it is
+            half full. Boundaries then depend on the content instead of the position, so an edit only
+            changes the chunks around it and the chunks after it stay the same.
+
+    Yields:
+        str: The text chunks, in order.
+    """
+    if unit not in CHUNK_SIZE_UNITS:
+        raise ValueError(f"Unsupported chunk size unit: {unit}")
+    logger.debug("Starting document chunking.")
+    measure = len if unit == "chars" else count_tokens
+    # Sentences are joined with a space, which counts towards the size in characters
+    separator_size = 1 if unit == "chars" else 0
+    tokenizer = get_sentence_tokenizer()
+
+    ready = []  # Chunks made but not yielded yet
+    sentences = []  # (text, size) of the sentences in the current chunk
+    carried_count = 0  # Leading sentences carried over from the previous chunk as overlap
+    current_size = 0
+    chunk_count = 0
+    caption_count = 0
+
+    def has_new_content():
+        return len(sentences) > carried_count
+
+    def emit():
+        ready.append(" ".join(text for text, _ in sentences).strip())
+
+    def next_chunk(first_sentences):
+        # Emits the current chunk and starts the next one with the trailing sentences that fit in the
+        # overlap, never the whole chunk, or the next chunk would contain it entirely
+        nonlocal sentences, carried_count, current_size
+        emit()
+        carried = []
+        carried_size = 0
+        for sentence in reversed(sentences[1:]):
+            if carried_size + sentence[1] > overlap:
+                break
+            carried.append(sentence)
+            carried_size += sentence[1]
+        carried.reverse()
+        sentences = carried + first_sentences
+        carried_count = len(carried)
+        current_size = carried_size + sum(sentence[1] for sentence in first_sentences)
+
+    def add_sentence(text: str):
+        nonlocal current_size
+        size = measure(text) + separator_size
+        if not has_new_content() or current_size + size <= chunk_size:
+            sentences.append((text, size))
+            current_size += size
+            if anchored and current_size >= chunk_size // 2 and is_anchor_sentence(text):
+                next_chunk([])
+        else:
+            next_chunk([(text, size)])
+
+    def add_text(region: str, final: bool) -> str:
+        # Adds the sentences of region and returns the text left to carry into the next part
+        spans = list(tokenizer.span_tokenize(region))
+        keep = 0 if final or len(region) > STREAM_MAX_CARRY_CHARS else min(len(spans), STREAM_CARRY_SENTENCES)
+        complete = spans[:len(spans) - keep]
+        carry_start = spans[len(complete)][0] if keep else len(region)
+        if CAPTION_START in region[:carry_start] or CAPTION_END in region[:carry_start]:
+            logger.warning("Text contains incomplete caption markers.")
+        for start, end in complete:
+            add_sentence(region[start:end])
+        return region[carry_start:] if spans else ("" if final else region)
+
+    def end_chunk():
+        # Captions and the end of the content close the current chunk without any overlap
+        nonlocal sentences, carried_count, current_size
+        if has_new_content():
+            emit()
+        sentences = []
+        carried_count = 0
+        current_size = 0
+
+    pending = ""
     for part in parts:
-        if re.match(caption_pattern, part):
+        pending += part
+        position = 0
+        for match in CAPTION_PATTERN.finditer(pending):
+            add_text(pending[position:match.start()], final=True)
             # Always start a new chunk for captions if the current chunk is not empty
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-                logger.debug(f"Added chunk without caption. Current chunk size: {len(current_chunk)}")
-                current_chunk = ""
-            
+            end_chunk()
             # Add the entire caption as a single chunk
-            chunks.append(part.strip())
-            logger.debug(f"Added chunk with caption. Caption length: {len(part)}")
+            ready.append(match.group(0).strip())
+            caption_count += 1
+            position = match.end()
+        # A caption that ends in a later part is carried whole
+        caption_start = pending.find(CAPTION_START, position)
+        if caption_start < 0:
+            pending = add_text(pending[position:], final=False)
         else:
-            sentences = sent_tokenize(part)
-            for sentence in sentences:
-                if len(current_chunk) + len(sentence) <= chunk_size:
-                    current_chunk += sentence + " "
-                else:
-                    chunks.append(current_chunk.strip())
-                    logger.debug(f"Added chunk during sentence processing. Current chunk size: {len(current_chunk)}")
-                    # Add overlap based on characters
-                    overlap_text = current_chunk[-overlap:].strip()
-                    current_chunk = overlap_text + " " + sentence + " "
-
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-        logger.debug(f"Added final chunk. Final chunk size: {len(current_chunk)}")
-
-    # Log chunk information
-    for i, chunk in enumerate(chunks):
-        if CAPTION_START in chunk and CAPTION_END in chunk:
-            logger.info(f"Chunk {i} contains complete caption.")
-        elif CAPTION_START in chunk or CAPTION_END in chunk:
-            logger.warning(f"Chunk {i} contains incomplete caption markers.")
+            pending = add_text(pending[position:caption_start], final=False) + pending[caption_start:]
+        chunk_count += len(ready)
+        yield from ready
+        ready.clear()
+
+    add_text(pending, final=True)
+    end_chunk()
+    chunk_count += len(ready)
+    yield from ready
+
+    logger.debug(f"Document chunking completed: {chunk_count} chunks, {caption_count} with captions.")
+
+def _extract_page_segments(doc, page_index: int, image_dir: str, stats: dict = None) -> List[tuple]:
+    """
+    Extracts the text, images and OCR output of a single PDF page.
+
+    This is the CPU-heavy half of the PDF pipeline (text extraction, image decoding,
+    rasterization and Tesseract OCR). Captioning is left to the caller, images are
+    returned as ("image", jpeg_bytes, label) segments next to ("text", text) segments
+    in the order they must appear in the page text. OCR is planned by ocr_planner, which
+    only reads the text blocks of pages without text layer and of images containing text.
+
+    Args:
+        doc (fitz.Document): The opened PDF document.
+        page_index (int): Zero-based index of the page to process.
+        image_dir (str): The directory where extracted images are saved, None to keep them in memory only.
+        stats (dict): Receives the page timings and OCR stats, see ocr_planner.summarize_page_stats.
+
+    Returns:
+        List[tuple]: The ordered segments of the page.
+    """
+    page_start = time.perf_counter()
+    stats = stats if stats is not None else {}
+    page_num = page_index + 1
+    stats['page'] = page_num
+    page = doc[page_index]
+    logger.debug(f"Processing page {page_num}")
+    blocks = page.get_text("dict")["blocks"]
+    segments = []
+    elements = []
+
+    for block in blocks:
+        block_type = block.get("type")
+        if block_type == 0:  # Text block
+            # Dict text blocks only hold their text in their lines and spans
+            text = "\n".join(
+                "".join(span["text"] for span in line.get("spans", []))
+                for line in block.get("lines", [])
+            ).strip()
+            if text:
+                elements.append({
+                    "type": "text",
+                    "y0": block["bbox"][1],
+                    "content": text
+                })
+        elif block_type == 1:  # Image block
+            img = block.get("image")
+            if img is None:
+                logger.warning(f"No image data found in image block on page {page_num}")
+                continue
+
+            logger.debug(f"Image block on page {page_num}")
+            logger.debug(f"Type of image block: {type(img)}")
+
+            if isinstance(img, dict):
+                xref = img.get("xref")
+                if xref is None:
+                    logger.error(f"No 'xref' found in image block on page {page_num}")
+                    continue
+                elements.append({
+                    "type": "image",
+                    "y0": block["bbox"][1],
+                    "xref": xref
+                })
+            elif isinstance(img, bytes):
+                # Handle bytes image data
+                logger.debug(f"Image data (bytes) on page {page_num}: {img[:20]}...")  # Log first 20 bytes
+                try:
+                    # Decoded once, for OCR and for captioning
+                    image = Image.open(io.BytesIO(img))
+                    image.load()
+                    jpeg_bytes = google_calls.prepare_image(img, image)
+                    if image_dir:
+                        save_extracted_image(image_dir, img, jpeg_bytes)
+
+                    # Caption is generated by the caller
+                    segments.append(("image", jpeg_bytes, "inline image"))
+
+                    # Perform OCR on the text blocks of the image, if it has any
+                    ocr_text = ocr_planner.ocr_image(image, (disk_cache.content_hash(img),), stats)
+                    if ocr_text:
+                        segments.append(("text", ocr_text + "\n"))
+                        logger.info(f"Added OCR text from image on page {page_num}: {ocr_text[:100]}...")
+                    else:
+                        logger.debug(f"No text extracted via OCR from image on page {page_num}")
+                except Exception as e:
+                    logger.error(f"Failed to process image bytes on page {page_num}: {e}")
+                    segments.append(("text", f"{CAPTION_START}Image processing failed{CAPTION_END}\n"))
+            else:
+                logger.error(f"Unexpected image block format on page {page_num}: {type(img)}")
         else:
-            logger.info(f"Chunk {i} does not contain caption.")
+            logger.debug(f"Unknown block type {block_type} on page {page_num}")
+
+    # Log the number of elements found on the page
+    num_text = sum(1 for el in elements if el["type"] == "text")
+    num_images = sum(1 for el in elements if el["type"] == "image")
+    logger.debug(f"Page {page_num}: Found {num_text} text blocks and {num_images} image blocks")
+
+    # If no text blocks, OCR the text regions of the page
+    if num_text == 0:
+        logger.debug(f"No text blocks found on page {page_num}. Performing OCR on its text regions.")
+        try:
+            ocr_text = ocr_planner.ocr_page(page, stats)
+            if ocr_text:
+                segments.append(("text", ocr_text + "\n"))
+                logger.info(f"Added OCR text from page {page_num}: {ocr_text[:100]}...")
+            else:
+                logger.warning(f"No text extracted via OCR from page {page_num}")
+        except Exception as e:
+            logger.error(f"Failed to perform OCR on page {page_num}: {e}")
+
+    # Sort elements by their vertical position (y0)
+    elements.sort(key=lambda el: el["y0"])
+
+    for element in elements:
+        if element["type"] == "text":
+            segments.append(("text", element["content"] + "\n"))
+            logger.debug(f"Appended text block: {element['content'][:100]}...")
+        elif element["type"] == "image":
+            xref = element["xref"]
+            try:
+                base_image = doc.extract_image(xref)
+                image_bytes = base_image["image"]
+            except Exception as e:
+                logger.error(f"Failed to extract image xref {xref} on page {page_num}: {e}")
+                segments.append(("text", f"{CAPTION_START}Image extraction failed{CAPTION_END}\n"))
+                continue
+
+            # The image is decoded and resized at most once, small JPEGs are passed through as they are
+            try:
+                jpeg_bytes = google_calls.prepare_image(image_bytes)
+            except Exception as e:
+                logger.error(f"Scaling failed for image xref {xref} on page {page_num}: {e}")
+                segments.append(("text", f"{CAPTION_START}Image scaling failed{CAPTION_END}\n"))
+                continue
+            if image_dir:
+                save_extracted_image(image_dir, image_bytes, jpeg_bytes)
+
+            segments.append(("image", jpeg_bytes, f"image xref {xref}"))
+
+    stats['total_ms'] = (time.perf_counter() - page_start) * 1000
+    logger.debug(f"Page {page_num} stats: {stats}")
+    return segments
+
+# Per-process state of the page worker pool, set up once by _init_page_worker.
+_worker_doc = None
+_worker_image_dir = None
+
+def _init_page_worker(file_path: str, image_dir: str):
+    """Opens the PDF once per worker process instead of once per page."""
+    global _worker_doc, _worker_image_dir
+    _worker_doc = fitz.open(file_path)
+    _worker_image_dir = image_dir
+
+def _extract_page_in_worker(page_index: int):
+    """Process pool entry point, returns the page index alongside its segments and stats."""
+    stats = {}
+    segments = _extract_page_segments(_worker_doc, page_index, _worker_image_dir, stats)
+    return page_index, segments, stats
+
+def _iter_extracted_pages(doc, file_path: str, image_dir: str, page_stats: List[dict] = None) -> Iterator[tuple]:
+    """
+    Yields (page_index, segments) for every page of the PDF as soon as the page is extracted.
+
+    Pages are fanned out to a process pool of PDF_PAGE_WORKERS processes, so pages may come
+    back out of order, though never more than PDF_PAGE_WINDOW pages per worker apart. Small documents, a pool size of 1 and daemonic processes (which are
+    not allowed to have children, e.g. Celery prefork workers) fall back to serial extraction.
+
+    Args:
+        doc (fitz.Document): The opened PDF document, used for serial extraction.
+        file_path (str): The path to the PDF file, reopened by each worker process.
+        image_dir (str): The directory where extracted images are saved, None to keep them in memory only.
+        page_stats (List[dict]): Receives the stats of each extracted page.
+    """
+    page_count = doc.page_count
+    workers = min(PDF_PAGE_WORKERS, page_count)
+    page_stats = page_stats if page_stats is not None else []
+
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        for page_index in range(page_count):
+            try:
+                stats = {}
+                segments = _extract_page_segments(doc, page_index, image_dir, stats)
+                page_stats.append(stats)
+                yield page_index, segments
+            except Exception as e:
+                logger.error(f"Failed to process page {page_index + 1} of {file_path}: {e}")
+                yield page_index, []
+        return
+
+    logger.info(f"Extracting {page_count} pages of {file_path} with {workers} worker processes")
+    # Pages are submitted at most PDF_PAGE_WINDOW per worker past the first unfinished page, so
+    # the pages extracted ahead of the ones still being worked on stay bounded
+    window = workers * PDF_PAGE_WINDOW
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_page_worker,
+                             initargs=(file_path, image_dir)) as executor:
+        futures = {}
+        next_page = 0
+        while futures or next_page < page_count:
+            first_unfinished = min(futures.values(), default=next_page)
+            while next_page < page_count and next_page < first_unfinished + window:
+                futures[executor.submit(_extract_page_in_worker, next_page)] = next_page
+                next_page += 1
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_index = futures.pop(future)
+                try:
+                    _, segments, stats = future.result()
+                    page_stats.append(stats)
+                    yield page_index, segments
+                except Exception as e:
+                    logger.error(f"Failed to process page {page_index + 1} of {file_path}: {e}")
+                    yield page_index, []
+
+def _caption_segments(images: List[tuple], page_num: int) -> List[str]:
+    """
+    Captions the extracted images of one page together and wraps each caption in the caption markers.
+
+    Args:
+        images (List[tuple]): The ("image", jpeg_bytes, label) segments of the page, the
+            Celery pipeline passes the path of the JPEG instead of its bytes.
+        page_num (int): The page the images were found on, for logging.
+
+    Returns:
+        List[str]: The caption texts in image order, placeholders where captioning failed.
+    """
+    try:
+        captions = google_calls.caption_images([image for _, image, _ in images])
+    except Exception as e:
+        logger.error(f"Error captioning {len(images)} images on page {page_num}: {e}")
+        # Insert placeholders if captioning fails
+        return [f"{CAPTION_START}Image caption unavailable{CAPTION_END}\n"] * len(images)
+
+    for (_, _, label), caption in zip(images, captions):
+        logger.info(f"Added caption for {label} on page {page_num}: {caption}")
+    return [f"{CAPTION_START}{caption}{CAPTION_END}\n" for caption in captions]
+
+def _iter_captioned_pages(extracted_pages: Iterable[tuple], file_path: str,
+                          reporter: progress.ProgressReporter, count_pages: bool) -> Iterator[str]:
+    """
+    Captions the images of extracted pages and yields the page texts in page order.
+
+    The images of each page are captioned as soon as the page arrives, in a bounded thread
+    pool of CAPTION_WORKERS threads, so captioning overlaps with the extraction of later pages.
+    A page is yielded once its captions are ready, or once CAPTION_PAGES_AHEAD later pages
+    wait behind it, so only a few pages are ever held at once.
+
+    Args:
+        extracted_pages (Iterable[tuple]): (page_index, segments) pairs, in any page order.
+        file_path (str): The path to the PDF file, for logging.
+        reporter (progress.ProgressReporter): Receives the images captioned, and the pages
+            extracted if count_pages is set.
+        count_pages (bool): Whether extracted_pages is the extraction itself, as opposed to pages extracted earlier.
+
+    Yields:
+        str: The text of each page with image captions inserted.
+    """
+    # Pages not yielded yet, by index. Each page is a list of strings and (captions future,
+    # image index) pairs, in page text order.
+    waiting = {}
+    next_index = 0
+
+    def is_ready(parts):
+        return all(part[0].done() for part in parts if isinstance(part, tuple))
+
+    def page_text(parts):
+        return "".join(part[0].result()[part[1]] if isinstance(part, tuple) else part for part in parts)
+
+    with ThreadPoolExecutor(max_workers=CAPTION_WORKERS) as caption_pool:
+        for page_index, segments in extracted_pages:
+            page_num = page_index + 1
+            # The images of a page are captioned together so they can share requests
+            images = [segment for segment in segments if segment[0] == "image"]
+            captions = None
+            if images:
+                reporter.increment(images_total=len(images))
+                captions = caption_pool.submit(_caption_segments, images, page_num)
+                captions.add_done_callback(lambda _, count=len(images): reporter.increment(images_captioned=count))
+            parts = []
+            image_index = 0
+            for segment in segments:
+                if segment[0] == "image":
+                    parts.append((captions, image_index))
+                    image_index += 1
+                else:
+                    parts.append(segment[1])
+            waiting[page_index] = parts
+            if count_pages:
+                reporter.increment(pages_done=1)
+            logger.info(f"Processed page {page_num} of {file_path}")
+
+            while next_index in waiting and (is_ready(waiting[next_index]) or len(waiting) > CAPTION_PAGES_AHEAD):
+                yield page_text(waiting.pop(next_index))
+                next_index += 1
+
+        # The remaining pages in order, pages missing from extracted_pages are left out
+        for page_index in sorted(waiting):
+            yield page_text(waiting.pop(page_index))
+
+def iter_pdf_text(file_path: str, reporter: progress.ProgressReporter = None) -> Iterator[str]:
+    """
+    Streams the text of a PDF, page by page, with image captions inserted.
+
+    Pages are extracted and OCR'd in a process pool while the images of already
+    extracted pages are captioned in a bounded thread pool of CAPTION_WORKERS threads.
+    Pages are yielded in page order as soon as they are complete, so the memory used
+    doesn't grow with the length of the document.
+
+    Args:
+        file_path (str): The path to the PDF file.
+        reporter (progress.ProgressReporter): Receives the pages extracted and images captioned.
+
+    Yields:
+        str: The text of each page.
+    """
+    reporter = reporter or progress.ProgressReporter()
+    logger.info(f"Starting processing of PDF: {file_path}")
+    try:
+        doc = fitz.open(file_path)
+    except Exception as e:
+        logger.error(f"Failed to open PDF file {file_path}: {e}")
+        return
+
+    image_dir = ensure_image_dir(BASE_PATH) if SAVE_EXTRACTED_IMAGES else None
+    page_stats = []
+    with doc:
+        reporter.update(pages_total=doc.page_count)
+        yield from _iter_captioned_pages(_iter_extracted_pages(doc, file_path, image_dir, page_stats),
+                                         file_path, reporter, count_pages=True)
 
-    logger.debug("Document chunking completed.")
-    return chunks
+    logger.info(f"Processed PDF: {file_path}")
+    logger.info(f"Extraction stats of {file_path}: {ocr_planner.summarize_page_stats(page_stats)}")
+    logger.info(f"HTTP connection reuse so far: {http_sessions.connection_stats()}")
 
-def process_pdf_with_captions(file_path: str, textracted_path: str) -> str:
+def process_pdf_with_captions(file_path: str, textracted_path: str, reporter: progress.ProgressReporter = None) -> str:
     """
     Processes a PDF file to extract text and images, generates captions for images,
     and inserts captions into the extracted text.
@@ -227,160 +728,93 @@ def process_pdf_with_captions(file_path: str, textracted_path: str) -> str:
     Args:
         file_path (str): The path to the PDF file.
         textracted_path (str): The base path for extracted content.
+        reporter (progress.ProgressReporter): Receives the pages extracted and images captioned.
 
     Returns:
-        str: The full text content with image captions inserted.
+        str: The full text content with image captions inserted, see iter_pdf_text to stream it instead.
     """
-    logger.info(f"Starting processing of PDF: {file_path}")
+    return "".join(iter_pdf_text(file_path, reporter))
+
+def iter_pdf_pages(file_path: str, reporter: progress.ProgressReporter = None) -> Iterator[tuple]:
+    """
+    The CPU-bound half of iter_pdf_text: extracts the segments of every page, without captioning.
+
+    Args:
+        file_path (str): The path to the PDF file.
+        reporter (progress.ProgressReporter): Receives the pages extracted.
+
+    Yields:
+        tuple: (page_index, segments) for every page as soon as it is extracted, in any page
+        order, see _extract_page_segments.
+    """
+    reporter = reporter or progress.ProgressReporter()
+    logger.info(f"Starting extraction of PDF: {file_path}")
     try:
         doc = fitz.open(file_path)
     except Exception as e:
         logger.error(f"Failed to open PDF file {file_path}: {e}")
-        return ""
-
-    full_text = ""
-    image_dir = ensure_image_dir(BASE_PATH)
-
-    for page_num, page in enumerate(doc, start=1):
-        logger.debug(f"Processing page {page_num}")
-        blocks = page.get_text("dict")["blocks"]
-        elements = []
-
-        for block in blocks:
-            block_type = block.get("type")
-            if block_type == 0:  # Text block
-                text = block.get("text", "").strip()
-                if text:
-                    elements.append({
-                        "type": "text",
-                        "y0": block["bbox"][1],
-                        "content": text
-                    })
-            elif block_type == 1:  # Image block
-                img = block.get("image")
-                if img is None:
-                    logger.warning(f"No image data found in image block on page {page_num}")
-                    continue
+        return
 
-                logger.debug(f"Image block on page {page_num}")
-                logger.debug(f"Type of image block: {type(img)}")
-
-                if isinstance(img, dict):
-                    xref = img.get("xref")
-                    if xref is None:
-                        logger.error(f"No 'xref' found in image block on page {page_num}")
-                        continue
-                    elements.append({
-                        "type": "image",
-                        "y0": block["bbox"][1],
-                        "xref": xref
-                    })
-                elif isinstance(img, bytes):
-                    # Handle bytes image data
-                    logger.debug(f"Image data (bytes) on page {page_num}: {img[:20]}...")  # Log first 20 bytes
-                    try:
-                        image = Image.open(io.BytesIO(img))
-                        # Save the image securely
-                        image_filename = f"{uuid.uuid4()}.jpeg"
-                        image_path = os.path.join(image_dir, image_filename)
-                        image.save(image_path, "JPEG")
-                        logger.debug(f"Saved image to {image_path}")
-
-                        # Generate caption
-                        caption = google_calls.caption_image(image_path)
-                        caption_text = f"{CAPTION_START}{caption}{CAPTION_END}"
-                        full_text += caption_text + "\n"
-                        logger.info(f"Added caption for image on page {page_num}: {caption}")
-
-                        # Perform OCR on the image
-                        ocr_text = pytesseract.image_to_string(image).strip()
-                        if ocr_text:
-                            full_text += ocr_text + "\n"
-                            logger.info(f"Added OCR text from image on page {page_num}: {ocr_text[:100]}...")
-                        else:
-                            logger.warning(f"No text extracted via OCR from image on page {page_num}")
-                    except Exception as e:
-                        logger.error(f"Failed to process image bytes on page {page_num}: {e}")
-                        full_text += f"{CAPTION_START}Image processing failed{CAPTION_END}\n"
-                else:
-                    logger.error(f"Unexpected image block format on page {page_num}: {type(img)}")
-            else:
-                logger.debug(f"Unknown block type {block_type} on page {page_num}")
+    image_dir = ensure_image_dir(BASE_PATH) if SAVE_EXTRACTED_IMAGES else None
+    page_stats = []
+    with doc:
+        reporter.update(pages_total=doc.page_count)
+        for page_index, segments in _iter_extracted_pages(doc, file_path, image_dir, page_stats):
+            yield page_index, segments
+            reporter.increment(pages_done=1)
+        logger.info(f"Extracted {doc.page_count} pages of PDF: {file_path}")
+    logger.info(f"Extraction stats of {file_path}: {ocr_planner.summarize_page_stats(page_stats)}")
+
+def extract_pdf_pages(file_path: str, reporter: progress.ProgressReporter = None) -> List[List[tuple]]:
+    """
+    Extracts the segments of every page of a PDF, without captioning, see iter_pdf_pages.
 
-        # Log the number of elements found on the page
-        num_text = sum(1 for el in elements if el["type"] == "text")
-        num_images = sum(1 for el in elements if el["type"] == "image")
-        logger.debug(f"Page {page_num}: Found {num_text} text blocks and {num_images} image blocks")
+    Args:
+        file_path (str): The path to the PDF file.
+        reporter (progress.ProgressReporter): Receives the pages extracted.
 
-        # If no text blocks, perform OCR on the entire page
-        if num_text == 0:
-            logger.debug(f"No text blocks found on page {page_num}. Performing OCR on entire page.")
-            try:
-                pix = page.get_pixmap()
-                img_data = pix.pil_tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
-                ocr_text = pytesseract.image_to_string(image).strip()
-                if ocr_text:
-                    full_text += ocr_text + "\n"
-                    logger.info(f"Added OCR text from entire page {page_num}: {ocr_text[:100]}...")
-                else:
-                    logger.warning(f"No text extracted via OCR from entire page {page_num}")
-            except Exception as e:
-                logger.error(f"Failed to perform OCR on entire page {page_num}: {e}")
+    Returns:
+        List[List[tuple]]: The segments of each page, in page order, see _extract_page_segments.
+    """
+    pages = {}
+    for page_index, segments in iter_pdf_pages(file_path, reporter):
+        pages[page_index] = segments
+    return [pages.get(page_index, []) for page_index in range(max(pages, default=-1) + 1)]
 
-        # Sort elements by their vertical position (y0)
-        elements.sort(key=lambda el: el["y0"])
+def iter_captioned_text(extracted_pages: Iterable[tuple], file_path: str,
+                        reporter: progress.ProgressReporter = None) -> Iterator[str]:
+    """
+    The network-bound half of iter_pdf_text: captions the images of extracted pages.
 
-        for element in elements:
-            if element["type"] == "text":
-                full_text += element["content"] + "\n"
-                logger.debug(f"Appended text block: {element['content'][:100]}...")
-            elif element["type"] == "image":
-                xref = element["xref"]
-                try:
-                    base_image = doc.extract_image(xref)
-                    image_bytes = base_image["image"]
-                except Exception as e:
-                    logger.error(f"Failed to extract image xref {xref} on page {page_num}: {e}")
-                    full_text += f"{CAPTION_START}Image extraction failed{CAPTION_END}\n"
-                    continue
+    Args:
+        extracted_pages (Iterable[tuple]): The (page_index, segments) pairs yielded by iter_pdf_pages.
+        file_path (str): The path to the PDF file, for logging.
+        reporter (progress.ProgressReporter): Receives the images captioned.
 
-                # Scale image
-                try:
-                    scaled_image_bytes = scale_image(image_bytes)
-                except Exception as e:
-                    logger.error(f"Scaling failed for image xref {xref} on page {page_num}: {e}")
-                    full_text += f"{CAPTION_START}Image scaling failed{CAPTION_END}\n"
-                    continue
-                image_filename = f"{uuid.uuid4()}.jpeg"
-                image_path = os.path.join(image_dir, image_filename)
-                try:
-                    with open(image_path, 'wb') as img_file:
-                        img_file.write(scaled_image_bytes)
-                    logger.debug(f"Saved scaled image to {image_path}")
-                except Exception as e:
-                    logger.error(f"Failed to save image {image_path} on page {page_num}: {e}")
-                    full_text += f"{CAPTION_START}Image saving failed{CAPTION_END}\n"
-                    continue
+    Yields:
+        str: The text of each page with image captions inserted, in page order.
+    """
+    reporter = reporter or progress.ProgressReporter()
+    yield from _iter_captioned_pages(extracted_pages, file_path, reporter, count_pages=False)
+    logger.info(f"Captioned PDF: {file_path}")
+    logger.info(f"HTTP connection reuse so far: {http_sessions.connection_stats()}")
 
-                # Generate caption
-                try:
-                    caption = google_calls.caption_image(image_path)
-                    caption_text = f"{CAPTION_START}{caption}{CAPTION_END}"
-                    full_text += caption_text + "\n"
-                    logger.info(f"Added caption for image xref {xref} on page {page_num}: {caption}")
-                except Exception as e:
-                    logger.error(f"Error captioning image xref {xref} on page {page_num}: {e}")
-                    # Insert a placeholder if captioning fails
-                    full_text += f"{CAPTION_START}Image caption unavailable{CAPTION_END}\n"
+def caption_pdf_pages(pages: List[List[tuple]], file_path: str, reporter: progress.ProgressReporter = None) -> str:
+    """
+    Captions the images of extracted pages, see iter_captioned_text.
 
-        logger.info(f"Processed page {page_num} of {file_path}")
+    Args:
+        pages (List[List[tuple]]): The page segments returned by extract_pdf_pages.
+        file_path (str): The path to the PDF file, for logging.
+        reporter (progress.ProgressReporter): Receives the images captioned.
 
-    logger.info(f"Processed PDF: {file_path}")
-    logger.debug(f"Full text content after processing:\n{full_text}")
-    return full_text
+    Returns:
+        str: The full text content with image captions inserted.
+    """
+    return "".join(iter_captioned_text(enumerate(pages), file_path, reporter))
 
-def embed_documents(file_paths: List[str], collection: chromadb.Collection, textracted_path: str) -> None:
+def embed_documents(file_paths: List[str], collection: chromadb.Collection, textracted_path: str,
+                    reporter: progress.ProgressReporter = None) -> dict:
     """
     Populates a ChromaDB collection with embeddings from an array of documents.
 
@@ -388,92 +822,209 @@ def embed_documents(file_paths: List[str], collection: chromadb.Collection, text
         file_paths (List[str]): A list of file paths to the documents.
         collection (chromadb.Collection): The ChromaDB collection to populate.
         textracted_path (str): The path to the textracted output.
+        reporter (progress.ProgressReporter): Receives the progress of every stage.
+
+    Returns:
+        dict: The number of chunks of each document, by file path.
+    """
+    reporter = reporter or progress.ProgressReporter()
+    # Each document is streamed into the chunker as it is extracted, while earlier chunks are being upserted
+    return embed_contents(((file_path, iter_text(file_path, textracted_path, reporter)) for file_path in file_paths),
+                   collection, reporter)
+
+def embed_contents(documents: Iterable[tuple], collection: chromadb.Collection,
+                   reporter: progress.ProgressReporter = None) -> dict:
+    """
+    Chunks and embeds already extracted documents into a ChromaDB collection.
+
+    Documents are indexed incrementally: chunk ids are derived from the chunk content, only
+    chunks that are not in the collection yet are embedded, and chunks of an earlier version
+    of the document that no longer exist are deleted once the new ones are stored.
+
+    Args:
+        documents (Iterable[tuple]): (file_path, content) pairs, the content as a string or as an
+            iterable of its consecutive parts, e.g. the pages yielded by iter_text.
+        collection (chromadb.Collection): The ChromaDB collection to populate.
+        reporter (progress.ProgressReporter): Receives the chunks to embed and embedded.
 
     Returns:
-        None
+        dict: The number of chunks of each document, by file path.
     """
+    reporter = reporter or progress.ProgressReporter()
     logger.info("Starting embedding of documents.")
-    all_chunks = []
-    all_ids = []
-    all_metadatas = []
+    stale_ids = set()
+    chunk_counts = {}
 
-    for file_path in file_paths:
-        file_extension = Path(file_path).suffix.lower()
+    on_batch = lambda count: reporter.increment(chunks_embedded=count)
+    with vector_db.BatchUpserter(collection, on_batch=on_batch) as upserter:
+        for file_path, content in documents:
+            document_stale_ids, chunk_counts[file_path] = _embed_content(file_path, content, upserter, reporter)
+            stale_ids |= document_stale_ids
 
-        # Security: Validate file extension
-        if file_extension not in ALLOWED_FILE_EXTENSIONS:
-            logger.warning(f"Skipping unsupported file type {file_extension} for file {file_path}.")
-            continue
+    if not upserter.upserted and not upserter.failed and not stale_ids:
+        logger.warning("No chunks to add to ChromaDB collection.")
 
-        # Security: Validate file size
-        try:
-            file_size = os.path.getsize(file_path)
-            if file_size > MAX_FILE_SIZE:
-                logger.warning(f"Skipping file {file_path} due to size {file_size} exceeding limit.")
-                continue
-        except Exception as e:
-            logger.error(f"Could not get file size for {file_path}: {e}")
-            continue
+    # Stale chunks are only removed after the new ones are stored, so searches never see a gap
+    if upserter.failed:
+        logger.warning(f"Keeping {len(stale_ids)} stale chunks because some batches failed.")
+    else:
+        vector_db.delete_ids(collection, stale_ids)
+    return chunk_counts
 
-        content = ""
+def make_chunk_id(file_path: str, chunk_hash: str) -> str:
+    """
+    Content-derived chunk id, an unchanged chunk keeps its id across re-uploads.
 
-        if file_extension in ['.txt', '.md']:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                logger.debug(f"Read content from text file: {file_path}")
-            except Exception as e:
-                logger.error(f"Failed to read text file {file_path}: {e}")
-                continue
-        elif file_extension == '.pdf':
-            content = process_pdf_with_captions(file_path, textracted_path)
-        else:
-            try:
-                # Implement your own file_to_markdown conversion if needed
-                converted_path = document_textractor.file_to_markdown(file_path, textracted_path)
-                with open(converted_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                logger.debug(f"Converted file to markdown and read content: {converted_path}")
-            except Exception as e:
-                logger.error(f"Skipping {file_path}: {str(e)}")
-                continue
+    Args:
+        file_path (str): The path to the document.
+        chunk_hash (str): The content hash of the chunk text.
 
-        if not content.strip():
-            logger.warning(f"No content extracted from {file_path}. Skipping chunking.")
-            continue
-        log_full_content(content, file_path)
-        logger.info(f"Content before chunking for {file_path}:\n{content[:100]}")
-        chunks = chunk_document(content)
+    Returns:
+        str: The chunk id.
+    """
+    return f"{Path(file_path).name}_{chunk_hash[:24]}"
 
-        if not chunks:
-            logger.warning(f"No chunks created from {file_path}. Skipping embedding.")
-            continue
+def validate_file(file_path: str) -> bool:
+    """
+    Checks that a document has an allowed file type and size.
 
-        # Log and verify chunks contain captions
-        for i, chunk in enumerate(chunks):
-            if CAPTION_START in chunk and CAPTION_END in chunk:
-                logger.info(f"Chunk {i} from {file_path} contains caption.")
-            else:
-                logger.info(f"Chunk {i} from {file_path} does not contain caption.")
+    Args:
+        file_path (str): The path to the document.
 
-        all_chunks.extend(chunks)
-        all_ids.extend([f"{Path(file_path).stem}_{i}" for i in range(len(chunks))])
-        all_metadatas.extend([{"source": file_path} for _ in chunks])
+    Returns:
+        bool: True if the document can be processed.
+    """
+    file_extension = Path(file_path).suffix.lower()
 
-    if not all_chunks:
-        logger.warning("No chunks to add to ChromaDB collection.")
+    # Security: Validate file extension
+    if file_extension not in ALLOWED_FILE_EXTENSIONS:
+        logger.warning(f"Skipping unsupported file type {file_extension} for file {file_path}.")
+        return False
+
+    # Security: Validate file size
+    try:
+        file_size = os.path.getsize(file_path)
+        if file_size > MAX_FILE_SIZE:
+            logger.warning(f"Skipping file {file_path} due to size {file_size} exceeding limit.")
+            return False
+    except Exception as e:
+        logger.error(f"Could not get file size for {file_path}: {e}")
+        return False
+    return True
+
+def iter_text(file_path: str, textracted_path: str, reporter: progress.ProgressReporter = None) -> Iterator[str]:
+    """
+    Streams the text content of a document, page by page for PDFs (with image captions)
+    and TEXT_READ_SIZE characters at a time for text files.
+
+    Args:
+        file_path (str): The path to the document.
+        textracted_path (str): The path to the textracted output.
+        reporter (progress.ProgressReporter): Receives the progress of PDF processing.
+
+    Yields:
+        str: Consecutive parts of the content, nothing if the document is invalid or extraction failed.
+    """
+    if not validate_file(file_path):
         return
 
-    logger.info(f"Adding {len(all_chunks)} chunks to ChromaDB collection.")
+    file_extension = Path(file_path).suffix.lower()
+
+    if file_extension in ['.txt', '.md']:
+        yield from read_text_file(file_path)
+    elif file_extension == '.pdf':
+        yield from iter_pdf_text(file_path, reporter)
+    else:
+        try:
+            # Implement your own file_to_markdown conversion if needed
+            converted_path = document_textractor.file_to_markdown(file_path, textracted_path)
+        except Exception as e:
+            logger.error(f"Skipping {file_path}: {str(e)}")
+            return
+        logger.debug(f"Converted file to markdown: {converted_path}")
+        yield from read_text_file(converted_path)
+
+def read_text_file(file_path: str) -> Iterator[str]:
+    """
+    Streams a UTF-8 text file TEXT_READ_SIZE characters at a time.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Yields:
+        str: Consecutive parts of the file, nothing if it can't be read.
+    """
     try:
-        collection.upsert(
-            documents=all_chunks,
-            ids=all_ids,
-            metadatas=all_metadatas
-        )
-        logger.info("Finished adding chunks to ChromaDB collection.")
+        with open(file_path, 'r', encoding='utf-8') as file:
+            while True:
+                part = file.read(TEXT_READ_SIZE)
+                if not part:
+                    break
+                yield part
+        logger.debug(f"Read content from text file: {file_path}")
     except Exception as e:
-        logger.error(f"Failed to add chunks to ChromaDB collection: {e}")
+        logger.error(f"Failed to read text file {file_path}: {e}")
+
+def extract_text(file_path: str, textracted_path: str, reporter: progress.ProgressReporter = None) -> str:
+    """
+    Extracts the text content of a document, with image captions for PDFs.
+
+    Args:
+        file_path (str): The path to the document.
+        textracted_path (str): The path to the textracted output.
+        reporter (progress.ProgressReporter): Receives the progress of PDF processing.
+
+    Returns:
+        str: The content, empty if the document is invalid or extraction failed, see iter_text to stream it instead.
+    """
+    return "".join(iter_text(file_path, textracted_path, reporter))
+
+def _embed_content(file_path: str, content: Union[str, Iterable[str]], upserter: vector_db.BatchUpserter,
+                   reporter: progress.ProgressReporter) -> Tuple[set, int]:
+    """
+    Chunks one document and queues its new chunks for embedding, as its content streams in.
+
+    Args:
+        file_path (str): The path to the document.
+        content (Union[str, Iterable[str]]): The extracted content of the document, or its consecutive parts.
+        upserter (vector_db.BatchUpserter): Where the chunks are sent.
+        reporter (progress.ProgressReporter): Receives the number of new chunks.
+
+    Returns:
+        Tuple[set, int]: The ids of stored chunks of this document that no longer exist in it,
+        and the number of chunks of the document.
+    """
+    parts = [content] if isinstance(content, str) else content
+    if LOG_FULL_CONTENT:
+        parts = log_full_content(parts, file_path)
+
+    existing_ids = vector_db.get_source_ids(upserter.collection, file_path)
+    seen_ids = set()
+    new_count = 0
+    chunk_count = 0
+    for chunk in iter_chunks(parts, anchored=True):
+        if chunk_count == 0:
+            logger.info(f"First chunk of {file_path}:\n{chunk[:100]}")
+        chunk_count += 1
+        chunk_hash = disk_cache.content_hash(chunk.encode("utf-8"))
+        chunk_id = make_chunk_id(file_path, chunk_hash)
+        if chunk_id in seen_ids:
+            continue
+        seen_ids.add(chunk_id)
+        if chunk_id not in existing_ids:
+            reporter.increment(chunks_total=1)
+            upserter.add(chunk, chunk_id, {"source": file_path, "chunk_hash": chunk_hash})
+            new_count += 1
+
+    if not chunk_count:
+        logger.warning(f"No chunks created from {file_path}. Skipping embedding.")
+        # Nothing was extracted, e.g. a failed extraction, the stored chunks are kept
+        return set(), 0
+    logger.info(f"Created {chunk_count} chunks from {file_path}.")
+
+    stale_ids = existing_ids - seen_ids
+    logger.info(f"{file_path}: {new_count} new chunks, {len(seen_ids) - new_count} unchanged, {len(stale_ids)} stale.")
+    return stale_ids, chunk_count
 
 def main():
     # Setup logging first
@@ -487,7 +1038,7 @@ def main():
     client = chromadb.PersistentClient(path="./chroma_db")
 
     # Create or get a collection
-    collection = client.get_or_create_collection(name="documents")
+    collection = client.get_or_create_collection(name="documents", embedding_function=embeddings.get_embedding_function())
 
     # Define paths
     textracted_path = "./textracted"
@@ -0,0 +1,89 @@
+import os
+import logging
+from functools import cached_property
+
+import numpy as np
+from chromadb.api.types import Documents, Embeddings
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+from . import disk_cache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))  # Texts per ONNX Runtime run
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # ONNX Runtime intra-op threads, 0 lets it decide
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("cache", "embedding_cache.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", 256 * 1024 * 1024))  # 256 MB, ~170k vectors
+
+# Global variable to store the Embedding Function so it doesn't get made more than once
+embedding_function = None
+
+class CachedMiniLM(ONNXMiniLM_L6_V2):
+    """
+    The MiniLM embedding function Chroma uses by default, with batching, threading and caching under our control.
+
+    Vectors are cached on disk by a hash of the text, so re-embedding an unchanged chunk or a
+    repeated query skips inference entirely. Texts that miss the cache are embedded in batches
+    of batch_size by an ONNX Runtime session limited to intra_op_threads threads.
+    """
+
+    def __init__(self, cache: disk_cache.DiskCache, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 intra_op_threads: int = EMBEDDING_THREADS, preferred_providers=None):
+        super().__init__(preferred_providers=preferred_providers)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.intra_op_threads = intra_op_threads
+
+    @cached_property
+    def model(self):
+        # Same session as ONNXMiniLM_L6_V2.model, plus the thread count and full graph optimizations
+        providers = self._preferred_providers or self.ort.get_available_providers()
+        so = self.ort.SessionOptions()
+        so.log_severity_level = 3
+        so.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_threads > 0:
+            so.intra_op_num_threads = self.intra_op_threads
+        logger.info(f"Loading {self.MODEL_NAME} with providers {providers} and {self.intra_op_threads or 'default'} intra-op threads")
+        return self.ort.InferenceSession(
+            os.path.join(self.DOWNLOAD_PATH, self.EXTRACTED_FOLDER_NAME, "model.onnx"),
+            providers=providers,
+            sess_options=so,
+        )
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [disk_cache.make_key("embedding", self.MODEL_NAME, text) for text in input]
+        vectors = [None] * len(input)
+        # Texts missing from the cache, identical texts are only embedded once
+        missing = {}
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is not None:
+                vectors[i] = np.frombuffer(cached, dtype=np.float32)
+            else:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            # Only download the model when it is actually used
+            self._download_model_if_not_exists()
+            texts = [input[indices[0]] for indices in missing.values()]
+            computed = self._forward(texts, batch_size=self.batch_size)
+            for (key, indices), vector in zip(missing.items(), computed):
+                self.cache.set(key, vector.tobytes())
+                for i in indices:
+                    vectors[i] = vector
+
+        logger.debug(f"Embedded {len(input)} texts, {len(input) - sum(len(i) for i in missing.values())} from cache")
+        return vectors
+
+def get_embedding_function() -> CachedMiniLM:
+    """
+    Getter for the embedding function shared by the collection, ingestion and search.
+
+    Returns:
+        CachedMiniLM: the embedding function.
+    """
+    global embedding_function
+    if embedding_function is None:
+        cache = disk_cache.DiskCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES)
+        embedding_function = CachedMiniLM(cache, preferred_providers=["CPUExecutionProvider"])
+    return embedding_function
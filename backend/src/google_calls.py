@@ -7,10 +7,19 @@ from google.auth.exceptions import DefaultCredentialsError
 from google.oauth2 import service_account
 from google.auth import default
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
 from PIL import Image
 import io
+import json
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Union
+from datetime import datetime, timedelta, timezone
+
+from . import disk_cache
+from . import http_sessions
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -24,6 +33,26 @@ LOCATION = os.getenv("GCP_LOCATION")
 ENDPOINT = f"{LOCATION}-aiplatform.googleapis.com"
 MODEL_ID = "meta/llama-3.2-90b-vision-instruct-maas"
 SECRETS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'secrets'))
+TOKEN_REFRESH_MARGIN = int(os.getenv("GCP_TOKEN_REFRESH_MARGIN", "300"))  # Seconds before expiry a token is refreshed
+VERTEX_ENDPOINT_URL = os.getenv(
+    "VERTEX_ENDPOINT_URL",
+    f"https://{ENDPOINT}/v1beta1/projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/openapi/chat/completions"
+)
+DEFAULT_CAPTION_PROMPT = "Describe this image in detail. What do you see?"
+# Images per captioning request. Llama 3.2 Vision is tuned for a single image per prompt,
+# so batching is opt-in; batches it can't answer fall back to one request per image.
+CAPTION_BATCH_SIZE = int(os.getenv("CAPTION_BATCH_SIZE", "1"))
+CAPTION_CONCURRENCY = int(os.getenv("CAPTION_CONCURRENCY", "4"))  # Captioning requests in flight per process
+CAPTION_RATE_LIMIT = float(os.getenv("CAPTION_RATE_LIMIT", "0"))  # Captioning requests started per second, 0 for no limit
+MAX_IMAGE_SIZE = (1000, 1000)  # Maximum width and height of the images sent for captioning
+JPEG_QUALITY = 85  # Quality of the images re-encoded for captioning
+
+# Global variable to store the credentials and their access token so they are only refreshed near expiry
+credentials = None
+credentials_lock = threading.Lock()
+
+# Global variable to store the limiter shared by all captioning requests
+request_limiter = None
 
 # Validate environment variables
 if not PROJECT_ID:
@@ -31,125 +60,356 @@ if not PROJECT_ID:
 if not LOCATION:
     raise ValueError("GCP_LOCATION environment variable is not set")
 
+def load_credentials():
+    """Loads the service-account credentials from the secrets directory, without fetching a token."""
+    secret_filename = os.getenv("GCP_SECRET_PATH")
+    if not secret_filename:
+        raise ValueError("GCP_SECRET_PATH environment variable is not set")
+
+    secret_path = os.path.join(SECRETS_DIR, secret_filename)
+
+    if not os.path.exists(secret_path):
+        raise FileNotFoundError(f"GCP secret file not found at {secret_path}")
+
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = secret_path
+
+    creds, _ = default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+    return creds
+
+def token_is_fresh(creds) -> bool:
+    """Whether the cached token stays valid for at least TOKEN_REFRESH_MARGIN more seconds."""
+    if creds is None or not creds.token or creds.expiry is None:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return creds.expiry - now > timedelta(seconds=TOKEN_REFRESH_MARGIN)
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 def get_access_token():
-    """Get and refresh the access token with retry logic."""
-    try:
-        secret_filename = os.getenv("GCP_SECRET_PATH")
-        if not secret_filename:
-            raise ValueError("GCP_SECRET_PATH environment variable is not set")
-        
-        secret_path = os.path.join(SECRETS_DIR, secret_filename)
-        
-        if not os.path.exists(secret_path):
-            raise FileNotFoundError(f"GCP secret file not found at {secret_path}")
-        
-        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = secret_path
-        
-        creds, _ = default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
-        
-        auth_req = google.auth.transport.requests.Request()
-        creds.refresh(auth_req)
-        
-        return creds.token
-    except (DefaultCredentialsError, ValueError, FileNotFoundError) as e:
-        logger.error(f"Error with credentials: {e}")
-        raise
+    """
+    Gets an access token, refreshing it only when it is missing or about to expire.
+
+    The credentials and their token are cached in the process and shared by all threads,
+    the lock makes sure concurrent captioning threads trigger a single refresh.
+    """
+    global credentials
+    with credentials_lock:
+        try:
+            if credentials is None:
+                credentials = load_credentials()
+            if not token_is_fresh(credentials):
+                auth_req = google.auth.transport.requests.Request(session=http_sessions.get_session("google-auth"))
+                credentials.refresh(auth_req)
+                logger.info(f"Refreshed GCP access token, valid until {credentials.expiry} UTC")
+            return credentials.token
+        except (DefaultCredentialsError, ValueError, FileNotFoundError) as e:
+            logger.error(f"Error with credentials: {e}")
+            raise
+
+def invalidate_access_token():
+    """Drops the cached token, e.g. after Vertex rejected it, so the next call refreshes it."""
+    with credentials_lock:
+        if credentials is not None:
+            credentials.token = None
+
+def prepare_image(image_bytes: bytes, image: Image.Image = None) -> bytes:
+    """
+    Turns an image into the JPEG sent to the model, decoding and resizing it at most once.
 
-def encode_image(image_path):
-    """Encode the image to base64 with size optimization."""
+    JPEGs that already fit in MAX_IMAGE_SIZE are sent as they are, without being decoded.
+    Larger JPEGs are decoded straight at a reduced scale (PIL draft mode) before the resize.
+
+    Args:
+        image_bytes (bytes): The image file contents, any format PIL reads.
+        image (Image.Image): image_bytes already decoded, e.g. for OCR, so it isn't decoded again.
+
+    Returns:
+        bytes: The image as a JPEG no larger than MAX_IMAGE_SIZE.
+    """
+    source = image if image is not None else Image.open(io.BytesIO(image_bytes))
     try:
-        with Image.open(image_path) as img:
-            # Resize image if it's too large (adjust dimensions as needed)
-            if img.width > 1000 or img.height > 1000:
-                img.thumbnail((1000, 1000))
-            
-            # Convert to RGB if it's not
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Save to bytes
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=85)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except Exception as e:
-        logger.error(f"Error encoding image: {e}")
-        raise
+        width, height = source.size
+        if (source.format == "JPEG" and source.mode in ("RGB", "L")
+                and width <= MAX_IMAGE_SIZE[0] and height <= MAX_IMAGE_SIZE[1]):
+            return image_bytes
+        if image is None:
+            source.draft("RGB", MAX_IMAGE_SIZE)
+        img = source if source.mode == "RGB" else source.convert("RGB")
+        scale = min(1.0, MAX_IMAGE_SIZE[0] / img.width, MAX_IMAGE_SIZE[1] / img.height)
+        if scale < 1.0:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=JPEG_QUALITY)
+        return buffer.getvalue()
+    finally:
+        if image is None:
+            source.close()
+
+class RequestLimiter:
+    """
+    Limits the captioning requests in flight and, optionally, how many start per second.
+
+    The concurrency limit is a semaphore, the rate limit a token bucket allowing short
+    bursts of up to `concurrency` requests. Used as a context manager around each request.
+    """
+
+    def __init__(self, concurrency: int, rate: float = 0):
+        self.semaphore = threading.BoundedSemaphore(max(1, concurrency))
+        self.rate = rate
+        self.capacity = max(1, concurrency)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _take_token(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        if self.rate > 0:
+            self._take_token()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.semaphore.release()
+
+def get_request_limiter() -> RequestLimiter:
+    """
+    Getter for the limiter shared by all captioning requests of this process.
+
+    Returns:
+        RequestLimiter: the limiter built from CAPTION_CONCURRENCY and CAPTION_RATE_LIMIT.
+    """
+    global request_limiter
+    if request_limiter is None:
+        request_limiter = RequestLimiter(CAPTION_CONCURRENCY, CAPTION_RATE_LIMIT)
+    return request_limiter
+
+def chat_completion(content: list, max_tokens: int) -> str:
+    """
+    Sends one chat-completions request to Vertex, within the concurrency and rate limits.
+
+    Args:
+        content (list): The content parts of the user message (images and text).
+        max_tokens (int): The maximum number of tokens to generate.
+
+    Returns:
+        str: The text of the first choice, or None if the response has no choices.
+    """
+    access_token = get_access_token()
+    if not access_token:
+        raise ValueError("Failed to obtain access token.")
+
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+
+    data = {
+        "model": MODEL_ID,
+        "stream": False,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.2,
+        "top_k": 40,
+        "top_p": 0.95,
+        "n": 1
+    }
+
+    with get_request_limiter():
+        response = http_sessions.get_session("vertex").post(VERTEX_ENDPOINT_URL, headers=headers, json=data, timeout=30)  # Added timeout
+    if response.status_code == 401:
+        # The token was revoked or expired early, refresh it on the retry
+        invalidate_access_token()
+    response.raise_for_status()  # Raises an HTTPError for bad responses
+
+    response_json = response.json()
+
+    if 'choices' in response_json:
+        return response_json['choices'][0]['message']['content']
+    else:
+        logger.error(f"Unexpected response format: {response_json}")
+        return None
+
+def image_part(image: bytes) -> dict:
+    """The chat-completions content part of an image, given its JPEG bytes, see prepare_image."""
+    return {"image_url": {"url": f"data:image/jpeg;base64,{base64.b64encode(image).decode('ascii')}"}, "type": "image_url"}
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def process_image(image_path: str, prompt: str) -> str:
-    """Processes an image using Google Cloud AI Platform with retry logic."""
+def process_image(image: bytes, prompt: str) -> str:
+    """Processes an image (JPEG bytes, see prepare_image) using Google Cloud AI Platform with retry logic."""
     try:
-        access_token = get_access_token()
-        if not access_token:
-            raise ValueError("Failed to obtain access token.")
-        
-        url = f"https://{ENDPOINT}/v1beta1/projects/{PROJECT_ID}/locations/{LOCATION}/endpoints/openapi/chat/completions"
-
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        base64_image = encode_image(image_path)
-
-        data = {
-            "model": MODEL_ID,
-            "stream": False,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}, "type": "image_url"},
-                        {"text": prompt, "type": "text"}
-                    ]
-                }
-            ],
-            "max_tokens": 256,
-            "temperature": 0.2,
-            "top_k": 40,
-            "top_p": 0.95,
-            "n": 1
-        }
-
-        response = requests.post(url, headers=headers, json=data, timeout=30)  # Added timeout
-        response.raise_for_status()  # Raises an HTTPError for bad responses
-        
-        response_json = response.json()
-
-        if 'choices' in response_json:
-            return response_json['choices'][0]['message']['content']
-        else:
-            logger.error(f"Unexpected response format: {response_json}")
-            return None
-
+        return chat_completion([image_part(image), {"text": prompt, "type": "text"}], max_tokens=256)
     except requests.exceptions.RequestException as e:
         logger.error(f"Error processing image: {e}")
         raise
 
+class BatchCaptionError(Exception):
+    """The model did not answer a batch captioning request with one caption per image."""
+
+# A malformed batch answer is not retried, the caller falls back to single requests instead
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10),
+       retry=retry_if_not_exception_type(BatchCaptionError))
+def process_images(images: List[bytes], prompt: str) -> List[str]:
+    """
+    Captions several images in one request, asking for a JSON array with one caption per image.
+
+    Args:
+        images (List[bytes]): The images as JPEG bytes, see prepare_image.
+        prompt (str): The captioning prompt for each image.
+
+    Returns:
+        List[str]: The captions, in image order.
+
+    Raises:
+        BatchCaptionError: If the answer is not a JSON array of one caption per image.
+    """
+    content = [image_part(image) for image in images]
+    content.append({
+        "text": f"{prompt}\nThere are {len(images)} images. Answer only with a JSON array of "
+                f"{len(images)} strings, the description of each image in the order given.",
+        "type": "text"
+    })
+    answer = chat_completion(content, max_tokens=256 * len(images))
+
+    try:
+        # Tolerate text around the array, e.g. a markdown code fence
+        captions = json.loads(answer[answer.index("["):answer.rindex("]") + 1])
+    except (AttributeError, ValueError) as e:
+        raise BatchCaptionError(f"Batch answer is not a JSON array: {e}")
+    if len(captions) != len(images) or not all(isinstance(caption, str) for caption in captions):
+        raise BatchCaptionError(f"Expected {len(images)} captions, got {captions!r:.200}")
+    return captions
+
+def _caption_batch(images: List[bytes], prompt: str) -> List[str]:
+    """
+    Captions a batch of images, falling back to one request per image if the batch request fails.
+
+    Returns:
+        List[str]: The captions, None where captioning failed.
+    """
+    if len(images) > 1:
+        try:
+            return process_images(images, prompt)
+        except Exception as e:
+            logger.warning(f"Batch captioning of {len(images)} images failed, captioning them one by one: {e}")
+
+    def caption_one(image: bytes):
+        try:
+            return process_image(image, prompt)
+        except Exception as e:
+            logger.error(f"Error captioning image: {e}")
+            return None
+
+    if len(images) == 1:
+        return [caption_one(images[0])]
+    with ThreadPoolExecutor(max_workers=min(len(images), CAPTION_CONCURRENCY)) as pool:
+        return list(pool.map(caption_one, images))
+
+def caption_images(images: List[Union[str, bytes]], custom_prompt: str = None) -> List[str]:
+    """
+    Captions several images, e.g. all the figures of a page, using as few requests as possible.
+
+    Cached captions are reused and identical images are captioned once. The remaining images
+    are sent CAPTION_BATCH_SIZE per request, batches run concurrently within the shared
+    concurrency and rate limits.
+
+    Args:
+        images: paths to images, probably only jpg and png, or JPEG bytes ready to send
+            (see prepare_image), e.g. the images extracted from a PDF
+        custom_prompt: prompt to use for captioning
+    Returns:
+        List[str] - one caption (or error message) per image, in order
+    """
+    prompt = custom_prompt if custom_prompt else DEFAULT_CAPTION_PROMPT
+    cache = disk_cache.get_image_cache()
+    captions = [None] * len(images)
+    # Images missing from the cache, by cache key, with their content and positions
+    missing = {}
+
+    for i, image in enumerate(images):
+        if isinstance(image, bytes):
+            content = image
+        elif not os.path.exists(image):
+            logger.error(f"Image file not found: {image}")
+            captions[i] = "Image file not found."
+            continue
+        else:
+            try:
+                with open(image, 'rb') as image_file:
+                    content = image_file.read()
+            except OSError as e:
+                # Unreadable, or removed since the check, the other images are still captioned
+                logger.error(f"Error reading image {image}: {e}")
+                captions[i] = "Failed to generate a caption."
+                continue
+        cache_key = disk_cache.make_key("caption", disk_cache.content_hash(content), prompt, MODEL_ID)
+        cached_caption = cache.get_text(cache_key)
+        if cached_caption is not None:
+            logger.info(f"Llama Vision caption cache hit for {describe_image(image)}")
+            captions[i] = cached_caption
+        elif cache_key in missing:
+            missing[cache_key][1].append(i)
+        else:
+            try:
+                # Files are converted only when they have to be sent
+                missing[cache_key] = (content if isinstance(image, bytes) else prepare_image(content), [i])
+            except Exception as e:
+                logger.error(f"Error preparing image {describe_image(image)}: {e}")
+                captions[i] = "Failed to generate a caption."
+
+    if missing:
+        keys = list(missing)
+        batches = [keys[i:i + max(1, CAPTION_BATCH_SIZE)] for i in range(0, len(keys), max(1, CAPTION_BATCH_SIZE))]
+        logger.info(f"Llama Vision captioning {len(keys)} images in {len(batches)} requests")
+        with ThreadPoolExecutor(max_workers=min(len(batches), CAPTION_CONCURRENCY)) as pool:
+            results = pool.map(lambda batch: _caption_batch([missing[key][0] for key in batch], prompt), batches)
+            for batch, batch_captions in zip(batches, results):
+                for key, caption in zip(batch, batch_captions):
+                    if caption:
+                        cache.set_text(key, caption)
+                    for i in missing[key][1]:
+                        captions[i] = caption if caption else "Failed to generate a caption."
+                        logger.info(f"Llama Vision Saw {describe_image(images[i])} as:\n {captions[i]}")
+
+    return captions
+
+def describe_image(image: Union[str, bytes]) -> str:
+    """How an image is named in the logs, its path or its size and content hash."""
+    if isinstance(image, bytes):
+        return f"image {disk_cache.content_hash(image)[:12]} ({len(image)} bytes)"
+    return image
+
 def caption_image(image_path: str, custom_prompt: str = None) -> str:
     """
     Captions an image using LLama 3.2 Vision MaaS from GCP
 
+    Captions are cached by image content hash, prompt and model id, so an image that
+    was already captioned (e.g. a logo repeated on every page) skips the request.
+
     Args:
         image_path: an absolute path to an image, probably only jpg and png
         prompt: prompt to use for captioning
     Returns:
         str - the caption you requested
     """
-    if not os.path.exists(image_path):
-        logger.error(f"Image file not found: {image_path}")
-        return "Image file not found."
     logger.info(f"Llama Vision Got image {image_path}")
-    # Prepare the prompt
-    default_prompt = "Describe this image in detail. What do you see?"
-    prompt = custom_prompt if custom_prompt else default_prompt
-
     try:
-        # Process the image
-        caption = process_image(image_path, prompt)
-        logger.info(f"Llama Vision Saw {image_path} as:\n {caption}")
-        return caption if caption else "Failed to generate a caption."
+        return caption_images([image_path], custom_prompt)[0]
     except Exception as e:
         logger.error(f"Error in caption_image: {e}")
         return f"An error occurred while processing the image: {str(e)}"
@@ -0,0 +1,104 @@
+import os
+import socket
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+logger = logging.getLogger(__name__)
+
+# Connections kept open per host for each upstream, at least as many as the requests in flight to it
+HTTP_POOL_SIZES = {
+    "ollama": int(os.getenv("OLLAMA_POOL_SIZE", "10")),
+    "vertex": int(os.getenv("VERTEX_POOL_SIZE", "8")),
+}
+HTTP_DEFAULT_POOL_SIZE = int(os.getenv("HTTP_DEFAULT_POOL_SIZE", "4"))
+# TCP keepalive: seconds idle before the first probe, seconds between probes, probes before giving up.
+# Keeps long generations and idle pooled connections from being dropped by NATs and proxies.
+TCP_KEEPALIVE_IDLE = int(os.getenv("TCP_KEEPALIVE_IDLE", "60"))
+TCP_KEEPALIVE_INTERVAL = int(os.getenv("TCP_KEEPALIVE_INTERVAL", "15"))
+TCP_KEEPALIVE_COUNT = int(os.getenv("TCP_KEEPALIVE_COUNT", "4"))
+
+# Global variable to store the sessions of this process, keyed by upstream name
+sessions = {}
+sessions_pid = None
+sessions_lock = threading.Lock()
+
+def keepalive_socket_options() -> list:
+    """
+    Socket options enabling TCP keepalive, skipping the ones the platform doesn't have.
+
+    Returns:
+        list: (level, option, value) tuples for urllib3 connections.
+    """
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in (("TCP_KEEPIDLE", TCP_KEEPALIVE_IDLE),
+                        ("TCP_KEEPINTVL", TCP_KEEPALIVE_INTERVAL),
+                        ("TCP_KEEPCNT", TCP_KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+class KeepAliveAdapter(HTTPAdapter):
+    """An HTTPAdapter whose pooled connections use TCP keepalive."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = keepalive_socket_options()
+        super().init_poolmanager(*args, **kwargs)
+
+def get_session(upstream: str) -> requests.Session:
+    """
+    Getter for the pooled, keep-alive session used for all requests to an upstream.
+
+    Sessions are shared by the threads of a process, so connections (and TLS handshakes)
+    are reused across requests. Forked processes get their own sessions.
+
+    Args:
+        upstream (str): The upstream name, e.g. "ollama" or "vertex", selecting its pool size.
+
+    Returns:
+        requests.Session: the session for the upstream.
+    """
+    global sessions, sessions_pid
+    with sessions_lock:
+        if sessions_pid != os.getpid():
+            sessions = {}
+            sessions_pid = os.getpid()
+        session = sessions.get(upstream)
+        if session is None:
+            pool_size = HTTP_POOL_SIZES.get(upstream, HTTP_DEFAULT_POOL_SIZE)
+            adapter = KeepAliveAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            sessions[upstream] = session
+            logger.info(f"Created HTTP session for {upstream} with {pool_size} connections per host")
+        return session
+
+def connection_stats() -> dict:
+    """
+    Connection reuse of each upstream session in this process, from the urllib3 pool counters.
+
+    Returns:
+        dict: per upstream, the requests sent, connections opened and the share of requests
+        that reused an open connection.
+    """
+    stats = {}
+    with sessions_lock:
+        current = dict(sessions) if sessions_pid == os.getpid() else {}
+    for upstream, session in current.items():
+        pools = session.get_adapter("https://").poolmanager.pools
+        requests_sent = connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        stats[upstream] = {
+            "requests": requests_sent,
+            "connections": connections,
+            "reuse_rate": round(1 - connections / requests_sent, 3) if requests_sent else None,
+        }
+    return stats
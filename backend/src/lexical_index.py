@@ -0,0 +1,329 @@
+import os
+import re
+import sqlite3
+import logging
+import threading
+import time
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join("cache", "lexical_index.sqlite3"))
+LEXICAL_MAX_TERMS = int(os.getenv("LEXICAL_MAX_TERMS", "16"))  # Query terms kept, the rest are ignored
+# Terms found in more than this share of the chunks (and in more than LEXICAL_PRUNE_MIN_DF chunks) are left out
+# of queries, their BM25 weight is low and ranking every chunk they match is what makes a query slow
+LEXICAL_MAX_DF_RATIO = float(os.getenv("LEXICAL_MAX_DF_RATIO", "0.1"))
+LEXICAL_PRUNE_MIN_DF = int(os.getenv("LEXICAL_PRUNE_MIN_DF", "1000"))
+LEXICAL_STATS_TTL = float(os.getenv("LEXICAL_STATS_TTL", "60"))  # Seconds the chunk and term counts are cached
+
+QUERY_TERM_PATTERN = re.compile(r"\w+")
+# Words that match most chunks, they only make lexical queries slower without changing the ranking much
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or the this to was what when where "
+    "which who why with you".split()
+)
+
+# Global variable to store the lexical index so it doesn't get made more than once
+lexical_index = None
+
+def query_terms(query: str, max_terms: int = LEXICAL_MAX_TERMS) -> List[str]:
+    """
+    Splits a free text query into its distinct search terms, without stop words.
+
+    Args:
+        query (str): The search query.
+        max_terms (int): The number of distinct terms to keep.
+
+    Returns:
+        List[str]: The lowercase terms, in query order.
+    """
+    terms = []
+    for term in QUERY_TERM_PATTERN.findall(query.lower()):
+        if term not in STOP_WORDS and term not in terms:
+            terms.append(term)
+    if not terms:
+        # A query made only of stop words, search them rather than nothing
+        terms = list(dict.fromkeys(QUERY_TERM_PATTERN.findall(query.lower())))
+    return terms[:max_terms]
+
+def build_match_query(terms: List[str]) -> Optional[str]:
+    """
+    Builds an FTS5 MATCH expression matching any of the terms.
+
+    Every term is quoted, so operators and punctuation in the query (e.g. "C++", "AND", "x-y")
+    are searched as text instead of being parsed as FTS5 syntax.
+
+    Args:
+        terms (List[str]): The search terms, see query_terms.
+
+    Returns:
+        Optional[str]: The MATCH expression, None if there are no terms.
+    """
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+class LexicalIndex:
+    """
+    A BM25 inverted index of the chunks stored in Chroma, kept in SQLite FTS5.
+
+    Chunks are added and deleted by id alongside the Chroma collection. The chunk id and
+    source live in a regular table indexed on both, the text in an FTS5 table with the
+    same rowid, so deletes by id or by source don't scan the index. Like DiskCache, each
+    thread of each process opens its own connection.
+
+    Queries leave out terms most chunks contain (see LEXICAL_MAX_DF_RATIO), so they stay
+    fast on large indexes. The term counts this needs are cached for LEXICAL_STATS_TTL seconds.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connection()
+        with connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    rowid INTEGER PRIMARY KEY,
+                    id TEXT NOT NULL UNIQUE,
+                    source TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(document, tokenize='porter unicode61');
+                -- Holds a row while a rebuild reads Chroma, the ids and sources deleted or re-added
+                -- meanwhile go to rebuild_changes so the rebuild doesn't bring back stale chunks
+                CREATE TABLE IF NOT EXISTS rebuild_state (started_at REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS rebuild_changes (
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (kind, value)
+                );
+            """)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not be shared across threads or forked processes
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict]) -> None:
+        """
+        Indexes chunks, chunks already indexed under the same id are replaced.
+
+        Args:
+            ids (List[str]): The chunk ids.
+            documents (List[str]): The chunk texts.
+            metadatas (List[dict]): The chunk metadata, with the document path under "source".
+        """
+        connection = self._connection()
+        with connection:
+            self._delete(connection, "id", ids)
+            for id, document, metadata in zip(ids, documents, metadatas):
+                rowid = connection.execute(
+                    "INSERT INTO chunks (id, source) VALUES (?, ?)", (id, metadata.get("source", ""))
+                ).lastrowid
+                connection.execute("INSERT INTO chunks_fts (rowid, document) VALUES (?, ?)", (rowid, document))
+        self._clear_stats()
+
+    def delete_ids(self, ids: Iterable[str]) -> None:
+        """
+        Removes chunks from the index.
+
+        Args:
+            ids (Iterable[str]): The chunk ids.
+        """
+        connection = self._connection()
+        with connection:
+            self._delete(connection, "id", list(ids))
+        self._clear_stats()
+
+    def delete_source(self, source: str) -> None:
+        """
+        Removes every chunk of a document from the index.
+
+        Args:
+            source (str): The path of the document.
+        """
+        connection = self._connection()
+        with connection:
+            self._delete(connection, "source", [source])
+        self._clear_stats()
+
+    def _delete(self, connection: sqlite3.Connection, column: str, values: List[str]) -> None:
+        # SQLite limits the number of parameters of a statement
+        for i in range(0, len(values), 500):
+            batch = values[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            rowids = [(row[0],) for row in connection.execute(
+                f"SELECT rowid FROM chunks WHERE {column} IN ({placeholders})", batch
+            )]
+            connection.executemany("DELETE FROM chunks_fts WHERE rowid = ?", rowids)
+            connection.executemany("DELETE FROM chunks WHERE rowid = ?", rowids)
+            connection.executemany(
+                "INSERT OR IGNORE INTO rebuild_changes (kind, value) SELECT ?, ? WHERE EXISTS (SELECT 1 FROM rebuild_state)",
+                [(column, value) for value in batch]
+            )
+
+    def search(self, query: str, n_results: int = 5) -> dict:
+        """
+        Finds the chunks that best match the terms of a query, ranked by BM25.
+
+        Args:
+            query (str): The search query.
+            n_results (int): The number of chunks to return.
+
+        Returns:
+            dict: Lists of ids, documents, metadatas and BM25 scores (lower is better), best match first.
+        """
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'scores': []}
+        terms = self.selective_terms(query_terms(query))
+        match = build_match_query(terms)
+        if match is None:
+            return results
+        rows = self._connection().execute(
+            """
+            SELECT chunks.id, chunks.source, chunks_fts.document, chunks_fts.rank
+            FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid
+            WHERE chunks_fts MATCH ? ORDER BY chunks_fts.rank LIMIT ?
+            """,
+            (match, n_results)
+        ).fetchall()
+        for id, source, document, score in rows:
+            results['ids'].append(id)
+            results['documents'].append(document)
+            results['metadatas'].append({"source": source})
+            results['scores'].append(score)
+        return results
+
+    def selective_terms(self, terms: List[str]) -> List[str]:
+        """
+        Leaves out the terms found in too many chunks, see LEXICAL_MAX_DF_RATIO.
+
+        Args:
+            terms (List[str]): The query terms.
+
+        Returns:
+            List[str]: The terms worth searching, empty if they are all too common.
+        """
+        max_df = max(LEXICAL_PRUNE_MIN_DF, LEXICAL_MAX_DF_RATIO * self._cached("", self.count))
+        selective = []
+        for term in terms:
+            if self._cached(term, lambda: self.document_frequency(term)) <= max_df:
+                selective.append(term)
+            else:
+                logger.debug(f"Leaving out common term {term!r} from the lexical query")
+        return selective
+
+    def document_frequency(self, term: str) -> int:
+        """The number of chunks containing a term, stemmed like the indexed text."""
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM chunks_fts WHERE chunks_fts MATCH ?", (build_match_query([term]),)
+        ).fetchone()[0]
+
+    def count(self) -> int:
+        """The number of indexed chunks."""
+        return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _cached(self, key: str, compute) -> int:
+        now = time.monotonic()
+        with self._stats_lock:
+            entry = self._stats.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+        value = compute()
+        with self._stats_lock:
+            if len(self._stats) > 10000:
+                self._stats.clear()
+            self._stats[key] = (value, now + LEXICAL_STATS_TTL)
+        return value
+
+    def _clear_stats(self) -> None:
+        # Other processes' writes are only seen once the cached counts expire
+        with self._stats_lock:
+            self._stats.clear()
+
+    def rebuild(self, collection, batch_size: int = 1000) -> int:
+        """
+        Replaces the index content with the chunks stored in a Chroma collection.
+
+        The chunks are first read into a temporary table, then swapped in with a single
+        transaction, so searches keep seeing the previous index until the new one is complete.
+        Chunks indexed, deleted or whose source is deleted while the collection is being read
+        are recorded in rebuild_changes, the swap keeps what ingestion indexed meanwhile and
+        leaves out what was deleted, even if it was read from Chroma before.
+
+        Args:
+            collection: the Chroma collection
+            batch_size (int): Chunks read from Chroma per request.
+
+        Returns:
+            int: The number of chunks read from the collection.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM rebuild_changes")
+            connection.execute("DELETE FROM rebuild_state")
+            connection.execute("INSERT INTO rebuild_state (started_at) VALUES (?)", (time.time(),))
+        connection.execute("DROP TABLE IF EXISTS temp.rebuilt_chunks")
+        connection.execute("CREATE TEMP TABLE rebuilt_chunks (id TEXT PRIMARY KEY, source TEXT NOT NULL, document TEXT)")
+        try:
+            offset = 0
+            while True:
+                batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+                if not batch["ids"]:
+                    break
+                with connection:
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO temp.rebuilt_chunks (id, source, document) VALUES (?, ?, ?)",
+                        [
+                            (id, (metadata or {}).get("source", ""), document)
+                            for id, document, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"])
+                        ]
+                    )
+                offset += len(batch["ids"])
+
+            with connection:
+                # Chunks indexed during the rebuild are the only ones kept from the old index
+                changed_ids = "SELECT value FROM rebuild_changes WHERE kind = 'id'"
+                connection.execute(f"""
+                    DELETE FROM chunks_fts WHERE rowid IN (SELECT rowid FROM chunks WHERE id NOT IN ({changed_ids}))
+                """)
+                connection.execute(f"DELETE FROM chunks WHERE id NOT IN ({changed_ids})")
+                rows = connection.execute(f"""
+                    SELECT id, source, document FROM temp.rebuilt_chunks
+                    WHERE id NOT IN ({changed_ids})
+                    AND source NOT IN (SELECT value FROM rebuild_changes WHERE kind = 'source')
+                """)
+                for id, source, document in rows:
+                    rowid = connection.execute("INSERT INTO chunks (id, source) VALUES (?, ?)", (id, source)).lastrowid
+                    connection.execute("INSERT INTO chunks_fts (rowid, document) VALUES (?, ?)", (rowid, document))
+        finally:
+            with connection:
+                connection.execute("DELETE FROM rebuild_changes")
+                connection.execute("DELETE FROM rebuild_state")
+            connection.execute("DROP TABLE IF EXISTS temp.rebuilt_chunks")
+        self._clear_stats()
+        logger.info(f"Rebuilt the lexical index with {offset} chunks")
+        return offset
+
+def get_lexical_index() -> LexicalIndex:
+    """
+    Getter for the lexical index shared by ingestion, deletion and search.
+
+    Returns:
+        LexicalIndex: the lexical index.
+    """
+    global lexical_index
+    if lexical_index is None:
+        lexical_index = LexicalIndex(LEXICAL_INDEX_PATH)
+    return lexical_index
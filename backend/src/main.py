@@ -4,7 +4,9 @@ import logging
 import traceback
 import sys
 import time
-from flask import Flask, request, jsonify, Blueprint, current_app
+import uuid
+import json
+from flask import Flask, Response, request, jsonify, Blueprint, current_app
 from flask_cors import CORS
 from celery import Celery, Task
 import redis
@@ -13,7 +15,11 @@ import redis
 from . import document_chunker as chunker
 from . import vector_db
 from . import ollama_calls as ollama
-from .tasks import process_file
+from . import disk_cache
+from . import http_sessions
+from . import progress
+from . import catalogue
+from .tasks import ingest_file
 from . import make_celery
 from werkzeug.utils import secure_filename
 
@@ -31,18 +37,27 @@ logging.getLogger("gunicorn").setLevel(logging.WARNING)
 @bp.route('/status', methods=['GET'])
 def get_status():
     """
-    Endpoint to check the status of the backend.
+    Endpoint to check the status of the backend: readiness and timings of each startup step,
+    the cached Ollama health, probe latencies and HTTP connection reuse.
     """
+    warmup = current_app.warmup
     return jsonify({
-        'nltk_ready': current_app.nltk_ready,
-        'chroma_ready': current_app.chroma_ready,
-        'error': current_app.initialization_error
+        'nltk_ready': warmup.is_ready('nltk'),
+        'chroma_ready': warmup.is_ready('chroma'),
+        'embeddings_ready': warmup.is_ready('embeddings'),
+        'warmup': warmup.status(),
+        'ollama': ollama.health_monitor.snapshot(),
+        'http_connections': http_sessions.connection_stats(),
+        'error': warmup.error()
     })
 
 @bp.route('/upload', methods=['POST'])
 def upload_file():
     """
     Uploads a file and processes it asynchronously.
+
+    Re-uploading a file with the same name and different content replaces it, only the
+    chunks that changed are re-embedded. An identical re-upload is rejected.
     """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
@@ -55,58 +70,110 @@ def upload_file():
         filename = secure_filename(file.filename)
         file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
 
-        collection = vector_db.get_collection()
-        if os.path.exists(file_path) and len(collection.get(where={"source": file_path})['ids']):
+        # Duplicates are found by name and content hash in the catalogue, without reading the stored file
+        file_hash = disk_cache.file_hash(file.stream)
+        file.stream.seek(0)
+        documents = catalogue.get_catalogue()
+        if documents.is_duplicate(filename, file_hash):
             return jsonify({"error": "File already exists."}), 400
 
         file.save(file_path)
 
-        # Enqueue the task
-        task = process_file.delay(file_path, current_app.config["TEXTRACTED_PATH"])
+        # Enqueue the ingestion pipeline, tracked as a single task id
+        job_id = str(uuid.uuid4())
+        documents.add(filename, file_path, file_hash, os.path.getsize(file_path), job_id=job_id)
+        ingest_file(file_path, current_app.config["TEXTRACTED_PATH"], job_id)
 
-        return jsonify({'message': 'File received and is being processed', 'task_id': task.id}), 202
+        return jsonify({'message': 'File received and is being processed', 'task_id': job_id}), 202
 
 @bp.route('/task_status/<task_id>')
 def task_status(task_id):
     """
-    Retrieves the status of a Celery task.
+    Retrieves the status of a Celery task, with the progress of the ingestion pipeline if it reports any.
+
+    Returns:
+        json: {'state', 'status'} plus 'progress' (pages, images and chunks done and total,
+        and the ETA of the current stage in seconds) and 'error' on failure.
     """
     task = current_app.celery.AsyncResult(task_id)
+    info = task.info
     if task.state == 'PENDING':
         response = {
             'state': task.state,
             'status': 'Pending...'
         }
-    elif task.state == 'STARTED':
-        response = {
-            'state': task.state,
-            'status': task.info.get('status', '')
-        }
-    elif task.state == 'SUCCESS':
-        response = {
-            'state': task.state,
-            'status': task.info.get('status', '')
-        }
     elif task.state == 'FAILURE':
+        # The meta of a failed task is the exception it raised
         response = {
             'state': task.state,
-            'status': str(task.info.get('status', '')),
-            'traceback': str(task.info)
+            'status': 'Processing failed',
+            'error': str(info)
         }
     else:
         response = {
             'state': task.state,
-            'status': task.info.get('status', '')
+            'status': info.get('status', '') if isinstance(info, dict) else ''
         }
+
+    task_progress = progress.get_progress(task_id)
+    if task_progress:
+        response['progress'] = task_progress
+        if task.state not in ('SUCCESS', 'FAILURE'):
+            response['status'] = task_progress['status']
     return jsonify(response)
 
+@bp.route('/task_events/<task_id>')
+def task_events(task_id):
+    """
+    Streams the progress of an ingestion job as Server-Sent Events, instead of polling /task_status.
+
+    Each event's data is the progress JSON of /task_status. The stream ends after the event
+    whose state is SUCCESS or FAILURE. A comment is sent when nothing happened for a while,
+    which keeps the connection open and rechecks the task in case it ended without reporting.
+    """
+    celery_app = current_app.celery
+
+    def generate():
+        events = progress.iter_progress(task_id)
+        try:
+            # Subscribe before reading the current state so no update falls in between
+            next(events)
+            current = progress.get_progress(task_id)
+            if current:
+                yield f"data: {json.dumps(current)}\n\n"
+                if current['state'] in ('SUCCESS', 'FAILURE'):
+                    return
+
+            for event in events:
+                if event is not None:
+                    yield f"data: {json.dumps(event)}\n\n"
+                    if event['state'] in ('SUCCESS', 'FAILURE'):
+                        return
+                else:
+                    task = celery_app.AsyncResult(task_id)
+                    if task.state in ('SUCCESS', 'FAILURE'):
+                        yield f"data: {json.dumps({'state': task.state, 'status': task.state.capitalize()})}\n\n"
+                        return
+                    yield ": keep-alive\n\n"
+        except redis.RedisError as e:
+            logger.warning(f"Progress stream of {task_id} failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'error': 'Progress updates unavailable'})}\n\n"
+        finally:
+            events.close()
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @bp.route('/search', methods=['POST'])
 def search_wrapper():
     """
     Search through submitted files to find the best matches for the given query. This is a wrapper to vector_db.search_documents()
 
-    This function handles all POST requests to the '/search' endpoint.
+    This function handles all POST requests to the '/search' endpoint. Send "mode": "vector" in the
+    request body to skip the lexical index, the default is SEARCH_MODE.
 
     Args:
         None
@@ -117,27 +184,45 @@ def search_wrapper():
     query = request.json.get('query')
     if not query:
         return jsonify({'error': 'No query provided'}), 400
-    return vector_db.search_documents(query)
+    mode = request.json.get('mode')
+    if mode not in (None, 'hybrid', 'vector'):
+        return jsonify({'error': 'mode must be hybrid or vector'}), 400
+    return vector_db.search_documents(query, mode=mode)
 
 @bp.route('/documents', methods=['GET'])
 def list_documents():
     """
     Retrieve all documents and return it back to the frontend in json format to be displayed on the screen.
 
-    This function handles all GET requests to '/documents' endpoint.
+    This function handles all GET requests to '/documents' endpoint. Documents are read from the
+    document catalogue. Without parameters it returns the names of all documents. With page,
+    per_page, sort (one of catalogue.SORT_COLUMNS) or order (asc or desc) it returns a page of
+    documents with their hash, size, page and chunk counts, ingestion status and timings.
 
     Args:
         None
     Returns:
         tuple: a json file that contains data and http code
-        if successful: sends a json of the files submitted with the http code 200.
-        if backend not ready: ({error: Backend is fully initialized yet}, 503).
+        if successful: sends a json of the files submitted with the http code 200, or
+        {'documents', 'total', 'page', 'per_page', 'sort', 'order'} when paginated.
+        if a parameter is not valid: ({error: ...}, 400).
 
     Raises:
         None
     """
-    files = os.listdir(current_app.config['UPLOAD_FOLDER'])
-    return jsonify(files)
+    documents = catalogue.get_catalogue()
+    if not any(arg in request.args for arg in ('page', 'per_page', 'sort', 'order')):
+        return jsonify(documents.filenames())
+
+    sort = request.args.get('sort', 'filename')
+    order = request.args.get('order', 'asc')
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', catalogue.CATALOGUE_PAGE_SIZE))
+        rows, total = documents.list_documents(page, per_page, sort, order)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'documents': rows, 'total': total, 'page': page, 'per_page': per_page, 'sort': sort, 'order': order})
 
 @bp.route('/documents/<filename>', methods=['DELETE'])
 def delete_document(filename):
@@ -164,10 +249,11 @@ def delete_document(filename):
     if os.path.exists(file_path):
         # Remove document chunks from Chroma
         collection = vector_db.get_collection()
-        collection.delete(where={"source": file_path})
+        vector_db.delete_source(collection, file_path)
 
         # Remove from backend/upload/
         os.remove(file_path)
+        catalogue.get_catalogue().delete(filename)
         
         split_filename = os.path.splitext(filename)
         if (split_filename[1] == ".pdf"):
@@ -184,13 +270,13 @@ def delete_document(filename):
 @bp.route('/get_models', methods=['GET'])
 def get_models_wrapper():
     """
-    Add pydocs here :p
+    Lists the models Ollama has installed. Pass ?warm=<model> to also load that model in the background.
     """
     if (not ollama.ollama_health_check()):
         logger.info("Ollama is not running")
         return jsonify({'error': 'Ollama is not running, please make sure ollama is running on your local machine'}), 503
     
-    return ollama.get_models()
+    return ollama.get_models(request.args.get('warm'))
 
 
 @bp.route('/chat', methods=['POST'])
@@ -198,23 +284,28 @@ def chat_wrapper():
     """
     chat an LLM response from the prompt in the request body and chunks from documents already uploaded.
 
+    Send "stream": true in the request body to receive the answer token by token as
+    Server-Sent Events (text/event-stream) instead of one JSON message.
+
     Args:
         None
 
     Returns:
-        tuple: A tuple containing a JSON response and an HTTP status code.
+        tuple: A tuple containing a JSON response (or an event stream) and an HTTP status code.
     Raises:
         None
     """
 
     if (not ollama.ollama_health_check()):
         logger.info("Ollama is not running")
-        return jsonify({'error': 'Ollama is not running, please make sure ollama is running on your local machine'}, 503)
+        return jsonify({'error': 'Ollama is not running, please make sure ollama is running on your local machine'}), 503
     
     prompt = request.json.get('prompt')
 
     model = request.json.get('model')
 
+    stream = bool(request.json.get('stream', False))
+
     if not prompt:
         return jsonify({'error': 'No prompt given'}), 400
 
@@ -226,6 +317,8 @@ def chat_wrapper():
             return jsonify({'error': 'Search failed'}), http_code
         
         # Call chat with the search results and prompt
+        if stream:
+            return ollama.chat_stream(search_results, prompt, model)
         return ollama.chat(search_results, prompt, model)
     except Exception as e:
         print("Exception chat")
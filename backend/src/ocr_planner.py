@@ -0,0 +1,253 @@
+import os
+import time
+import logging
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from . import disk_cache
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_VERSION = "tesseract-eng-2"  # Bump to invalidate cached OCR results
+OCR_PLAN_DPI = int(os.getenv("OCR_PLAN_DPI", "72"))  # Resolution pages are rendered at to find their text
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "100"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+OCR_TARGET_LINE_PX = int(os.getenv("OCR_TARGET_LINE_PX", "32"))  # Text line height Tesseract reads best at
+OCR_TESSERACT_CONFIG = os.getenv("OCR_TESSERACT_CONFIG", "--psm 6")  # Regions are single blocks of text
+INK_THRESHOLD = 160  # Gray levels below this count as ink
+MIN_LINE_PX = 3  # Lines of ink thinner than this at the plan resolution are rules or noise
+MAX_LINE_PT = 48  # Lines taller than this are figures, not text
+MIN_LINE_DENSITY = 0.03  # Share of ink in a text line, below is noise
+MAX_LINE_DENSITY = 0.6  # Share of ink in a text line, above is a photo or a filled shape
+
+def find_text_regions(gray: np.ndarray, max_line_px: int) -> Tuple[List[tuple], float]:
+    """
+    Finds the blocks of text in a grayscale image with projection profiles.
+
+    Rows containing ink are grouped into lines, lines that look like text (thin enough, neither
+    too sparse nor too dense) are grouped into blocks, and blocks are split into columns at
+    vertical gaps wider than two line heights. Figures, photos and blank space are left out.
+
+    Args:
+        gray (np.ndarray): The image, 2D uint8, dark text on a light background.
+        max_line_px (int): Lines of ink taller than this are not text.
+
+    Returns:
+        Tuple[List[tuple], float]: The (x0, y0, x1, y1) pixel boxes of the text blocks, and
+        the median text line height in pixels (0 if there is no text).
+    """
+    ink = gray < INK_THRESHOLD
+    height, width = ink.shape
+    row_has_ink = ink.sum(axis=1) > max(1, width // 500)
+
+    # Runs of rows with ink are lines
+    lines = []
+    start = None
+    for y, has_ink in enumerate(np.append(row_has_ink, False)):
+        if has_ink and start is None:
+            start = y
+        elif not has_ink and start is not None:
+            lines.append((start, y))
+            start = None
+
+    text_lines = []
+    for y0, y1 in lines:
+        columns = np.flatnonzero(ink[y0:y1].any(axis=0))
+        x0, x1 = int(columns[0]), int(columns[-1]) + 1
+        density = ink[y0:y1, x0:x1].mean()
+        if MIN_LINE_PX <= y1 - y0 <= max_line_px and MIN_LINE_DENSITY <= density <= MAX_LINE_DENSITY:
+            text_lines.append((y0, y1))
+    if not text_lines:
+        return [], 0.0
+
+    line_height = float(np.median([y1 - y0 for y0, y1 in text_lines]))
+    # Consecutive text lines less than two line heights apart are a block
+    blocks = [list(text_lines[0])]
+    for y0, y1 in text_lines[1:]:
+        if y0 - blocks[-1][1] <= 2 * line_height:
+            blocks[-1][1] = y1
+        else:
+            blocks.append([y0, y1])
+
+    regions = []
+    gap = max(2, int(2 * line_height))
+    for y0, y1 in blocks:
+        column_has_ink = np.append(ink[y0:y1].any(axis=0), False)
+        x_start = None
+        x_end = None
+        for x, has_ink in enumerate(column_has_ink):
+            if has_ink:
+                if x_start is None:
+                    x_start = x
+                x_end = x + 1
+            elif x_start is not None and (x - x_end >= gap or x == width):
+                regions.append((x_start, y0, x_end, y1))
+                x_start = None
+    return regions, line_height
+
+def run_tesseract(image: Image.Image) -> str:
+    """
+    Runs Tesseract on one block of text.
+
+    Args:
+        image (Image.Image): The block, ideally with OCR_TARGET_LINE_PX high text lines.
+
+    Returns:
+        str: The stripped OCR text.
+    """
+    return pytesseract.image_to_string(image, config=OCR_TESSERACT_CONFIG).strip()
+
+def _ocr_cached(image: Image.Image, cache_parts: tuple) -> str:
+    cache = disk_cache.get_image_cache()
+    cache_key = disk_cache.make_key("ocr", OCR_CACHE_VERSION, OCR_TESSERACT_CONFIG, *cache_parts)
+    text = cache.get_text(cache_key)
+    if text is None:
+        text = run_tesseract(image)
+        cache.set_text(cache_key, text)
+    else:
+        logger.debug("OCR cache hit")
+    return text
+
+def _gray_array(pix: fitz.Pixmap) -> np.ndarray:
+    # Rows may be padded to pix.stride. The samples are copied once, a view on samples_mv
+    # would keep the pixmap from being freed.
+    return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+
+def page_dpi(line_height_pt: float) -> int:
+    """
+    The resolution that makes text lines of a page about OCR_TARGET_LINE_PX high.
+
+    Args:
+        line_height_pt (float): The median text line height of the page in points.
+
+    Returns:
+        int: The DPI, between OCR_MIN_DPI and OCR_MAX_DPI.
+    """
+    dpi = OCR_TARGET_LINE_PX * 72 / max(line_height_pt, 1.0)
+    return int(min(OCR_MAX_DPI, max(OCR_MIN_DPI, dpi)))
+
+def ocr_page(page: fitz.Page, stats: dict) -> str:
+    """
+    OCRs the text blocks of a page without text layer, e.g. a scanned page.
+
+    The page is rendered once in grayscale at OCR_PLAN_DPI to find its text blocks and their
+    line height, then each block alone is rendered at the DPI that suits its text size and
+    passed to Tesseract straight from the pixmap, without going through an encoded image.
+    Pages without text-like content are not OCR'd at all.
+
+    Args:
+        page (fitz.Page): The page.
+        stats (dict): Receives the DPI, the number of regions, the share of the page OCR'd and
+            the plan, render and OCR times in milliseconds.
+
+    Returns:
+        str: The OCR text of the blocks in reading order, possibly empty.
+    """
+    start = time.perf_counter()
+    plan_pix = page.get_pixmap(dpi=OCR_PLAN_DPI, colorspace=fitz.csGRAY)
+    regions, line_height = find_text_regions(_gray_array(plan_pix), MAX_LINE_PT * OCR_PLAN_DPI // 72)
+    stats['plan_ms'] = stats.get('plan_ms', 0) + (time.perf_counter() - start) * 1000
+    stats['regions'] = stats.get('regions', 0) + len(regions)
+    if not regions:
+        stats['ocr_skipped'] = True
+        return ""
+
+    dpi = page_dpi(line_height * 72 / OCR_PLAN_DPI)
+    stats['dpi'] = dpi
+    scale = 72 / OCR_PLAN_DPI
+    pad = line_height / 2
+    plan_area = plan_pix.width * plan_pix.height
+    stats['coverage'] = round(sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions) / plan_area, 3)
+
+    texts = []
+    for x0, y0, x1, y1 in regions:
+        clip = fitz.Rect(
+            page.rect.x0 + (x0 - pad) * scale, page.rect.y0 + (y0 - pad) * scale,
+            page.rect.x0 + (x1 + pad) * scale, page.rect.y0 + (y1 + pad) * scale,
+        ) & page.rect
+        render_start = time.perf_counter()
+        pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, clip=clip)
+        samples = pix.samples
+        image = Image.frombuffer("L", (pix.width, pix.height), samples, "raw", "L", pix.stride, 1)
+        ocr_start = time.perf_counter()
+        stats['render_ms'] = stats.get('render_ms', 0) + (ocr_start - render_start) * 1000
+        text = _ocr_cached(image, (disk_cache.content_hash(samples), pix.width, pix.height))
+        stats['ocr_ms'] = stats.get('ocr_ms', 0) + (time.perf_counter() - ocr_start) * 1000
+        if text:
+            texts.append(text)
+    return "\n".join(texts)
+
+def ocr_image(image: Image.Image, cache_parts: tuple, stats: dict) -> str:
+    """
+    OCRs the text blocks of an embedded image, images without text are not OCR'd at all.
+
+    The image is converted to grayscale once. Text blocks are found on a copy at about the
+    plan resolution and each block is cropped from the full image, scaled so its text lines
+    are about OCR_TARGET_LINE_PX high.
+
+    Args:
+        image (Image.Image): The decoded image.
+        cache_parts (tuple): What identifies the image content, e.g. its content hash.
+        stats (dict): Receives the number of images OCR'd and skipped and the time spent.
+
+    Returns:
+        str: The OCR text of the blocks in reading order, possibly empty.
+    """
+    start = time.perf_counter()
+    gray = image.convert("L")
+    plan = gray.copy()
+    # About the size of a page at the plan resolution
+    plan.thumbnail((OCR_PLAN_DPI * 11, OCR_PLAN_DPI * 11))
+    plan_scale = gray.width / plan.width
+    regions, line_height = find_text_regions(np.asarray(plan), max(MIN_LINE_PX, plan.height // 4))
+    stats['plan_ms'] = stats.get('plan_ms', 0) + (time.perf_counter() - start) * 1000
+    if not regions:
+        stats['images_skipped'] = stats.get('images_skipped', 0) + 1
+        return ""
+    stats['images_ocr'] = stats.get('images_ocr', 0) + 1
+
+    # Scale from the plan copy to the image Tesseract sees, at most 3x up
+    factor = min(3.0, OCR_TARGET_LINE_PX / (line_height * plan_scale)) if line_height else 1.0
+    pad = line_height / 2
+    texts = []
+    ocr_start = time.perf_counter()
+    for index, (x0, y0, x1, y1) in enumerate(regions):
+        box = (
+            max(0, int((x0 - pad) * plan_scale)), max(0, int((y0 - pad) * plan_scale)),
+            min(gray.width, int((x1 + pad) * plan_scale)), min(gray.height, int((y1 + pad) * plan_scale)),
+        )
+        region = gray.crop(box)
+        if abs(factor - 1.0) > 0.25:
+            region = region.resize((max(1, int(region.width * factor)), max(1, int(region.height * factor))), Image.LANCZOS)
+        text = _ocr_cached(region, (*cache_parts, index, box))
+        if text:
+            texts.append(text)
+    stats['ocr_ms'] = stats.get('ocr_ms', 0) + (time.perf_counter() - ocr_start) * 1000
+    return "\n".join(texts)
+
+def summarize_page_stats(page_stats: List[dict]) -> dict:
+    """
+    Totals the per-page stats of a document, for the extraction log.
+
+    Args:
+        page_stats (List[dict]): The stats of each page, see ocr_page and ocr_image.
+
+    Returns:
+        dict: The number of pages by kind, images OCR'd and skipped, and the time spent in each stage.
+    """
+    summary = {
+        'pages': len(page_stats),
+        'pages_ocr': sum(1 for stats in page_stats if stats.get('regions')),
+        'pages_ocr_skipped': sum(1 for stats in page_stats if stats.get('ocr_skipped')),
+        'images_ocr': sum(stats.get('images_ocr', 0) for stats in page_stats),
+        'images_ocr_skipped': sum(stats.get('images_skipped', 0) for stats in page_stats),
+    }
+    for key in ('total_ms', 'plan_ms', 'render_ms', 'ocr_ms'):
+        summary[key] = round(sum(stats.get(key, 0) for stats in page_stats), 1)
+    slowest = sorted(page_stats, key=lambda stats: stats.get('total_ms', 0), reverse=True)[:3]
+    summary['slowest_pages'] = [(stats['page'], round(stats.get('total_ms', 0), 1)) for stats in slowest]
+    return summary
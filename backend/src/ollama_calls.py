@@ -3,14 +3,36 @@ import re
 import logging
 import requests
 import time
+import threading
+from collections import deque
 from flask import jsonify
 import json
+from flask import Response
+
+from . import http_sessions
+from . import prompt_builder
 
 logger = logging.getLogger(__name__)
 
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'localhost:11434')
 ollama_base_url = f'http://{OLLAMA_HOST}'
 
+# Timeouts in seconds. Streaming chats only bound the connect and the gap between
+# two chunks, so a long generation is never cut off as long as tokens keep coming.
+OLLAMA_CHAT_TIMEOUT = float(os.getenv('OLLAMA_CHAT_TIMEOUT', '30'))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv('OLLAMA_CONNECT_TIMEOUT', '5'))
+OLLAMA_STREAM_READ_TIMEOUT = float(os.getenv('OLLAMA_STREAM_READ_TIMEOUT', '300'))
+
+# Background health monitor: probe interval and timeout in seconds, failures in a row
+# before the circuit opens, and seconds before an open circuit lets requests through again.
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv('OLLAMA_HEALTH_TIMEOUT', '3'))
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv('OLLAMA_FAILURE_THRESHOLD', '3'))
+OLLAMA_RESET_TIMEOUT = float(os.getenv('OLLAMA_RESET_TIMEOUT', '30'))
+OLLAMA_MODELS_TTL = float(os.getenv('OLLAMA_MODELS_TTL', '60'))  # Seconds before the model catalogue is refreshed
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')  # How long Ollama keeps the model loaded, e.g. 30m, 3600 or -1 for ever
+OLLAMA_WARM_TIMEOUT = float(os.getenv('OLLAMA_WARM_TIMEOUT', '300'))  # Loading a big model from disk can take minutes
+
 
 if os.path.exists('/.dockerenv'):
     # Set the base URL for Ollama package
@@ -30,56 +52,362 @@ if os.path.exists('/.dockerenv'):
     else:
         logger.info(f"Did not find a valid localhost:port pattern in OLLAMA_HOST: '{OLLAMA_HOST}'")
 
+class HealthMonitor:
+    """
+    Keeps track of whether Ollama is reachable, so requests don't have to probe it themselves.
+
+    A background thread probes Ollama every interval seconds and records the probe latency.
+    Chat requests also report connection failures, 5xx answers and successes. After failure_threshold
+    failures in a row the circuit opens and ollama_health_check fails fast. After
+    reset_timeout seconds the circuit goes half-open: requests are let through again, the
+    next success closes the circuit and the next failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, url: str, interval: float = OLLAMA_HEALTH_INTERVAL, timeout: float = OLLAMA_HEALTH_TIMEOUT,
+                 failure_threshold: int = OLLAMA_FAILURE_THRESHOLD, reset_timeout: float = OLLAMA_RESET_TIMEOUT):
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_check = None
+        self.last_error = None
+        self.probes = 0
+        self.failed_probes = 0
+        self.latencies = deque(maxlen=100)  # Seconds, of the most recent successful probes
+
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    def start(self) -> None:
+        """Starts the background probe thread, once per process (forked workers need their own)."""
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name="ollama-health", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            if self.probe() and model_catalogue.is_stale():
+                # Keep the model catalogue warm while Ollama is up
+                model_catalogue.refresh_in_background()
+            time.sleep(self.interval)
+
+    def probe(self) -> bool:
+        """
+        Sends one GET request to the Ollama root endpoint and records the outcome.
+
+        Returns:
+            bool: True if Ollama answered with a 200.
+        """
+        start = time.perf_counter()
+        try:
+            response = http_sessions.get_session("ollama").get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            with self._lock:
+                self.probes += 1
+                self.failed_probes += 1
+                self.last_check = time.time()
+            self.record_failure(e)
+            return False
+
+        with self._lock:
+            self.probes += 1
+            self.last_check = time.time()
+            self.latencies.append(time.perf_counter() - start)
+        self.record_success()
+        return True
+
+    def record_success(self) -> None:
+        """Records that Ollama answered, closing the circuit."""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Ollama is reachable again, closing the circuit")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.last_error = None
+
+    def record_failure(self, error) -> None:
+        """Records that Ollama could not be reached or failed with a 5xx, opening the circuit after too many failures in a row."""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                logger.warning(f"Ollama failed {self.consecutive_failures} times in a row, opening the circuit: {error}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def is_available(self) -> bool:
+        """
+        Tells whether requests should be sent to Ollama, without any network call.
+
+        Returns:
+            bool: False while the circuit is open, True otherwise.
+        """
+        self.start()
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+            return self.state != self.OPEN
+
+    def snapshot(self) -> dict:
+        """
+        The monitor state and probe latency metrics, for the /status endpoint.
+
+        Returns:
+            dict: the circuit state, failure counts and latencies in milliseconds.
+        """
+        self.start()
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                'available': self.state != self.OPEN,
+                'circuit': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'last_check': self.last_check,
+                'last_error': self.last_error,
+                'probes': self.probes,
+                'failed_probes': self.failed_probes,
+                'latency_ms': {
+                    'last': round(self.latencies[-1] * 1000, 1),
+                    'p50': round(latencies[len(latencies) // 2] * 1000, 1),
+                    'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                } if latencies else None,
+            }
+
+health_monitor = HealthMonitor(ollama_base_url)
+
 def ollama_health_check():
     """
-    Check if Ollama is running by sending a GET request to the root endpoint.
+    Check if Ollama is running, from the status cached by the background health monitor.
 
     Args:
         None
 
     Returns:
-        bool: True if Ollama is running and accessible, False otherwise.
+        bool: False if Ollama failed repeatedly and the circuit is open, True otherwise.
 
     """
+    return health_monitor.is_available()
+    
+class ModelCatalogue:
+    """
+    A cached copy of the models Ollama has installed, with their size and parameter metadata.
+
+    The catalogue is fetched once, then served from memory. Once it is older than ttl seconds
+    it is still served, and a background thread fetches a fresh copy (stale-while-revalidate).
+    The health monitor also refreshes it, so /get_models never waits on Ollama once warm.
+    """
+
+    def __init__(self, url: str, ttl: float = OLLAMA_MODELS_TTL):
+        self.url = url
+        self.ttl = ttl
+        self.models = None
+        self.fetched_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def fetch(self) -> list:
+        """
+        Fetches the models from Ollama's /api/tags and caches them.
+
+        Returns:
+            list: one dict per model with its name, size in bytes, parameter size, quantization and family.
+        """
+        response = http_sessions.get_session("ollama").get(f"{self.url}/api/tags", timeout=OLLAMA_HEALTH_TIMEOUT)
+        response.raise_for_status()
+        models = []
+        for model in response.json().get('models') or []:
+            details = model.get('details') or {}
+            models.append({
+                'name': model['name'],
+                'size': model.get('size'),
+                'parameter_size': details.get('parameter_size'),
+                'quantization_level': details.get('quantization_level'),
+                'family': details.get('family'),
+                'modified_at': model.get('modified_at'),
+            })
+        with self._lock:
+            self.models = models
+            self.fetched_at = time.monotonic()
+        logger.info(f"Fetched {len(models)} models from Ollama")
+        return models
+
+    def is_stale(self) -> bool:
+        with self._lock:
+            return self.fetched_at is None or time.monotonic() - self.fetched_at >= self.ttl
+
+    def refresh_in_background(self) -> None:
+        """Fetches a fresh copy on a background thread, unless one is already being fetched."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.fetch()
+            except Exception as e:
+                logger.warning(f"Could not refresh the model catalogue: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="ollama-models", daemon=True).start()
+
+    def get(self) -> list:
+        """
+        The cached models, fetching them only if there is no copy yet.
+
+        Returns:
+            list: the models, see fetch.
+        """
+        with self._lock:
+            models = self.models
+        if models is None:
+            return self.fetch()
+        if self.is_stale():
+            self.refresh_in_background()
+        return models
+
+model_catalogue = ModelCatalogue(ollama_base_url)
+
+def keep_alive():
+    """
+    OLLAMA_KEEP_ALIVE as Ollama expects it, a number of seconds or a duration string.
+
+    Returns:
+        int or str: the keep_alive value for Ollama requests.
+    """
     try:
-        response = requests.get(f"{ollama_base_url}", timeout=3)
+        return int(OLLAMA_KEEP_ALIVE)
+    except ValueError:
+        return OLLAMA_KEEP_ALIVE
 
-    except Exception as e:
-        logger.error(f"Error: {e}")
-        return False
-    if response.status_code == 200:
-        return True
-    
-def get_models():
+# Models being loaded by warm_model_in_background, so a model isn't loaded twice at once
+warming_models = set()
+warming_lock = threading.Lock()
+
+def warm_model(model: str) -> None:
     """
-    Gets the models available on your local machine.
+    Loads a model into Ollama's memory with the keep_alive and num_ctx of the chat requests,
+    so the first question of a session doesn't wait for the model to load.
 
     Args:
-        None
+        model (str): The Ollama model name.
+    """
+    start_time = time.time()
+    # A generate request without a prompt only loads the model
+    response = http_sessions.get_session("ollama").post(
+        f"{ollama_base_url}/api/generate",
+        json={
+            "model": model,
+            "keep_alive": keep_alive(),
+            "options": {"num_ctx": prompt_builder.context_window(model)},
+        },
+        timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_WARM_TIMEOUT)
+    )
+    response.raise_for_status()
+    logger.info(f"Loaded {model} in {time.time() - start_time:.2f} seconds")
+
+def warm_model_in_background(model: str) -> bool:
+    """
+    Runs warm_model on a background thread, unless the model is already being loaded.
+
+    Args:
+        model (str): The Ollama model name.
 
     Returns:
-        tuple - a json and a status code
-        if successful: ({'models': String[]}, 200)
+        bool: True if a load was started.
     """
+    with warming_lock:
+        if model in warming_models:
+            return False
+        warming_models.add(model)
 
-    models = []
+    def warm():
+        try:
+            warm_model(model)
+        except Exception as e:
+            logger.warning(f"Could not load {model}: {e}")
+        finally:
+            with warming_lock:
+                warming_models.discard(model)
 
-    try:
-        response = requests.get(f"{ollama_base_url}/api/tags")
+    threading.Thread(target=warm, name="ollama-warm", daemon=True).start()
+    return True
 
-        result = response.json()
-        # Parsing through json to get model names only.
+def get_models(warm=None):
+    """
+    Gets the models available on your local machine, from the cached model catalogue.
 
-        for model in result.get('models'):
-            models.append(model['name'])
+    Args:
+        warm: optional model name to load into memory in the background
 
-        return jsonify({'models': models}), 200
+    Returns:
+        tuple - a json and a status code
+        if successful: ({'models': String[], 'details': dict[], 'warming': String or None}, 200)
+    """
+
+    try:
+        models = model_catalogue.get()
+        names = [model['name'] for model in models]
+        warming = None
+        if warm in names:
+            warm_model_in_background(warm)
+            warming = warm
+        return jsonify({'models': names, 'details': models, 'warming': warming}), 200
 
     except Exception as e:
         logger.info(f"Error at get_models: {e}")
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
     
 
+def build_chat_payload(search_results, prompt, model, stream=False):
+    """
+    Builds the Ollama api/chat payload from the search results and the user prompt.
+
+    The sources are deduplicated and fitted into the context budget of the model by prompt_builder.
+
+    Args:
+        search_results: dictionary returned by vector_db.search_documents
+        prompt: string
+        model: string
+        stream: bool, whether Ollama should stream the response as NDJSON
+
+    Returns:
+        tuple - the request payload and the prompt stats from prompt_builder.build_context
+    """
+    # Extract only the documents from search_results (assume it's a list of one list)
+    documents = search_results.get('documents', [[]])
+    documents = documents[0] if documents and isinstance(documents[0], list) else []
+    ids = search_results.get('ids', [[]])
+    ids = ids[0] if ids and isinstance(ids[0], list) and len(ids[0]) == len(documents) else None
+
+    messages, stats = prompt_builder.build_messages(documents, prompt, model, ids)
+
+    payload = {
+        "model": model, # why was this llama3.2? thought we were using llama3.2:3b
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": keep_alive(),
+        # DELETED OPTIONS WITH TEMPATURE
+        # num_ctx must be the same on every request, Ollama reloads the model when it changes
+        "options": {"num_ctx": prompt_builder.context_window(model)},
+    }
+    return payload, stats
+
 def chat(search_results, prompt, model):
     """
     Calls Ollama endpoint api/chat with text chunk + prompt given by user.
@@ -97,50 +425,23 @@ def chat(search_results, prompt, model):
         
     """
     logger.info("Starting chat function")
-    logger.info(f"Search results: {search_results}")
     logger.info(f"Prompt: {prompt}")
     
-    # Extract only the documents from search_results (assume it's a list of one list)
-    documents = search_results.get('documents', [[]])
-
-    # Since documents is usually one list, let's access that directly and join with separators
-    if documents and isinstance(documents[0], list):
-        context = '\n\n---\n\n'.join(documents[0])  # Separate each document clearly
-    else:
-        context = ''
-    
-    logger.info(f"Constructed context: {context}")
-    
     try:
         
         # Prepare the request payload
-        payload = {
-            "model": model, # why was this llama3.2? thought we were using llama3.2:3b
-            "messages": [
-                {
-                    "role": "system",
-                    "content": f"Read the sources and respond to the prompt given by the user. Sources: {context}"
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "stream": False,
-            # DELETED OPTIONS WITH TEMPATURE
-        }
-
-        logger.info(f"Payload sent to Ollama: {json.dumps(payload, indent=2)}")
+        payload, prompt_stats = build_chat_payload(search_results, prompt, model)
+
         logger.info("Sending request to Ollama")
         logger.info(f"Ollama base url {ollama_base_url}")
         start_time = time.time()
 
         # Send POST request to Ollama with a longer timeout
-        response = requests.post(
+        response = http_sessions.get_session("ollama").post(
             f'{ollama_base_url}/api/chat',
             json=payload,
             headers={"Content-Type": "application/json"},
-            timeout=30
+            timeout=OLLAMA_CHAT_TIMEOUT
         )
 
         end_time = time.time()
@@ -148,10 +449,12 @@ def chat(search_results, prompt, model):
 
         # Check if the request was successful
         response.raise_for_status()
+        health_monitor.record_success()
 
         # Parse the JSON response
         result = response.json()
-        logger.info(f"Ollama full response: {json.dumps(result, indent=2)}")
+        prompt_stats['prompt_eval_count'] = result.get('prompt_eval_count')
+        logger.info(f"Ollama evaluated {result.get('prompt_eval_count')} prompt tokens, estimated {prompt_stats['prefill_tokens']}")
 
         # Extract the 'message' field
         chatted_message = result.get('message')
@@ -160,16 +463,24 @@ def chat(search_results, prompt, model):
             logger.info("No 'message' field found in Ollama response.")
             return jsonify({'error': 'No message from Ollama.'}), 500
 
-        logger.info(f"Extracted message: {chatted_message['content']}")
+        logger.debug(f"Extracted message: {chatted_message['content']}")
 
-        return jsonify({'message': chatted_message['content']}), 200 # do we want to do this instead? check the frontend to see the format. All i did was indexed it to only get the content.
+        return jsonify({'message': chatted_message['content'], 'prompt': prompt_stats}), 200 # do we want to do this instead? check the frontend to see the format. All i did was indexed it to only get the content.
 
+    except requests.exceptions.ConnectionError as e:
+        # Ollama is down, let the health monitor fail the next requests fast
+        logger.info(f"Could not connect to Ollama: {e}")
+        health_monitor.record_failure(e)
+        return jsonify({'error': 'Ollama is not running, please make sure ollama is running on your local machine'}), 503
     except requests.exceptions.Timeout:
         logger.info("Request to Ollama timed out")
         return jsonify({'error': 'Ollama request timed out. The model might be taking too long to chat a response.'}), 504
     except requests.exceptions.HTTPError as e:
         # More detailed HTTP error handling
         logger.info(f"Ollama HTTP error: {e.response.status_code} - {e.response.text}")
+        if e.response.status_code >= 500:
+            # Ollama answered but can't serve chats, e.g. the model doesn't fit in memory
+            health_monitor.record_failure(e)
         return jsonify({'error': f'Ollama HTTP error: {e.response.status_code}'}), e.response.status_code
     except requests.exceptions.RequestException as e:
         logger.info(f"Ollama request failed: {e}")
@@ -182,3 +493,111 @@ def chat(search_results, prompt, model):
         # Catch-all for any other exceptions
         logger.info(f"Unexpected error: {e}")
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+
+def _sse(data, event=None):
+    """Formats a single Server-Sent Event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def chat_stream(search_results, prompt, model):
+    """
+    Calls Ollama endpoint api/chat in stream mode and proxies the NDJSON stream to the client as Server-Sent Events.
+
+    Every token delta is sent as soon as Ollama produces it as `data: {"message": "<delta>"}`.
+    The stream ends with an `event: done` carrying Ollama's timing stats, or an `event: error` if
+    the generation fails midway. Only the connect and the gap between two chunks are bounded by
+    timeouts, so long generations are no longer cut off.
+
+    Args:
+        search_results: dictionary
+        prompt: string
+        model: string
+
+    Return:
+        if successful: a text/event-stream Response with the http code 200
+        if ollama timeout: return ({'error': 'Ollama request timed out. The model might be taking too long to chat a response.'}), 504)
+        if HTTPerror: return ({'error': 'Ollama HTTP error: <code>'}), <code>)
+        if RequestException: return ({'error': 'Error generating response: <error>'}), 500)
+    """
+    logger.info("Starting streaming chat function")
+    logger.info(f"Prompt: {prompt}")
+
+    payload, prompt_stats = build_chat_payload(search_results, prompt, model, stream=True)
+    start_time = time.time()
+
+    # Open the upstream stream before answering so connection and HTTP errors
+    # still surface as regular JSON errors with a proper status code.
+    try:
+        upstream = http_sessions.get_session("ollama").post(
+            f'{ollama_base_url}/api/chat',
+            json=payload,
+            headers={"Content-Type": "application/json"},
+            timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_STREAM_READ_TIMEOUT),
+            stream=True
+        )
+        upstream.raise_for_status()
+        health_monitor.record_success()
+    except requests.exceptions.ConnectionError as e:
+        # Ollama is down, let the health monitor fail the next requests fast
+        logger.info(f"Could not connect to Ollama: {e}")
+        health_monitor.record_failure(e)
+        return jsonify({'error': 'Ollama is not running, please make sure ollama is running on your local machine'}), 503
+    except requests.exceptions.Timeout:
+        logger.info("Request to Ollama timed out")
+        return jsonify({'error': 'Ollama request timed out. The model might be taking too long to chat a response.'}), 504
+    except requests.exceptions.HTTPError as e:
+        logger.info(f"Ollama HTTP error: {e.response.status_code} - {e.response.text}")
+        # Give the streamed connection back to the pool, its body is never read
+        upstream.close()
+        if e.response.status_code >= 500:
+            health_monitor.record_failure(e)
+        return jsonify({'error': f'Ollama HTTP error: {e.response.status_code}'}), e.response.status_code
+    except requests.exceptions.RequestException as e:
+        logger.info(f"Ollama request failed: {e}")
+        return jsonify({'error': f'Error generating response: {str(e)}'}), 500
+
+    def generate():
+        first_token_time = None
+        try:
+            for line in upstream.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    logger.info(f"Ollama stream error: {chunk['error']}")
+                    yield _sse({'error': chunk['error']}, event='error')
+                    return
+
+                content = chunk.get('message', {}).get('content', '')
+                if content:
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        logger.info(f"Time to first token: {first_token_time - start_time:.2f} seconds")
+                    yield _sse({'message': content})
+
+                if chunk.get('done'):
+                    logger.info(f"Streaming chat completed in {time.time() - start_time:.2f} seconds, Ollama evaluated "
+                                f"{chunk.get('prompt_eval_count')} prompt tokens, estimated {prompt_stats['prefill_tokens']}")
+                    yield _sse({
+                        'done': True,
+                        'total_duration': chunk.get('total_duration'),
+                        'prompt_eval_count': chunk.get('prompt_eval_count'),
+                        'eval_count': chunk.get('eval_count'),
+                        'prompt': prompt_stats
+                    }, event='done')
+                    return
+        except requests.exceptions.Timeout:
+            logger.info("Ollama stream stalled")
+            yield _sse({'error': 'Ollama stopped sending tokens. The model might be overloaded.'}, event='error')
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.info(f"Ollama stream failed: {e}")
+            yield _sse({'error': f'Error generating response: {str(e)}'}, event='error')
+        finally:
+            # Also runs when the client disconnects, so Ollama stops generating for nobody.
+            upstream.close()
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    ), 200
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Iterator, Optional
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "0.5"))  # Minimum seconds between two published updates
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", 24 * 60 * 60))  # Seconds the progress of a job is kept
+PROGRESS_KEY_PREFIX = "study-buddy:progress:"
+PROGRESS_CHANNEL_PREFIX = "study-buddy:progress-events:"
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# What is counted in each stage of the ingestion pipeline, for the status text and the ETA
+STAGES = {
+    "extract": ("Extracting pages", "pages_done", "pages_total"),
+    "caption": ("Captioning images", "images_captioned", "images_total"),
+    "embed": ("Embedding chunks", "chunks_embedded", "chunks_total"),
+}
+
+# Global variable to store the Redis client so it doesn't get made more than once
+redis_client = None
+
+def get_redis_client():
+    global redis_client
+    if redis_client is None:
+        redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=5, socket_connect_timeout=1)
+    return redis_client
+
+def progress_key(job_id: str) -> str:
+    return PROGRESS_KEY_PREFIX + job_id
+
+def progress_channel(job_id: str) -> str:
+    return PROGRESS_CHANNEL_PREFIX + job_id
+
+class ProgressReporter:
+    """
+    Collects the progress of an ingestion job and publishes it to Redis at a throttled rate.
+
+    Every update is merged into the job state, but the state is only written (to the key
+    read by /task_status) and published (to the channel streamed by /task_events) at most
+    once per interval seconds, plus on every stage change and at the end. Pipeline stages
+    running in different tasks pick up the state left by the previous stage.
+
+    A reporter without a job id only keeps the state in memory, for callers that don't track progress.
+    """
+
+    def __init__(self, job_id: Optional[str] = None, interval: float = PROGRESS_INTERVAL):
+        self.job_id = job_id
+        self.interval = interval
+        self.state = {
+            "state": "STARTED",
+            "stage": None,
+            "status": "Processing started",
+            "pages_done": 0,
+            "pages_total": None,
+            "images_captioned": 0,
+            "images_total": 0,
+            "chunks_embedded": 0,
+            "chunks_total": 0,
+            "eta_seconds": None,
+            "error": None,
+        }
+        if job_id:
+            self.state.update(get_progress(job_id) or {})
+        self._lock = threading.Lock()
+        self._stage_started = time.monotonic()
+        self._last_publish = 0.0
+
+    def stage(self, name: str) -> None:
+        """Starts a pipeline stage, one of STAGES."""
+        with self._lock:
+            self.state["stage"] = name
+            self._stage_started = time.monotonic()
+        self.update(force=True)
+
+    def update(self, force: bool = False, **fields) -> None:
+        """Sets fields of the state, publishing it if the last update is old enough."""
+        with self._lock:
+            self.state.update(fields)
+        self._maybe_publish(force)
+
+    def increment(self, **fields) -> None:
+        """Adds to counters of the state, publishing it if the last update is old enough."""
+        with self._lock:
+            for field, amount in fields.items():
+                self.state[field] = (self.state.get(field) or 0) + amount
+        self._maybe_publish(False)
+
+    def finish(self, status: str = "Task completed") -> None:
+        """Marks the job as done."""
+        self.update(force=True, state="SUCCESS", status=status, eta_seconds=0)
+
+    def fail(self, error) -> None:
+        """Marks the job as failed."""
+        self.update(force=True, state="FAILURE", status="Processing failed", error=str(error), eta_seconds=None)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.state)
+
+    def _maybe_publish(self, force: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_publish < self.interval:
+                return
+            self._last_publish = now
+            if self.state["state"] == "STARTED" and self.state["stage"] in STAGES:
+                label, done_field, total_field = STAGES[self.state["stage"]]
+                done, total = self.state[done_field] or 0, self.state[total_field]
+                self.state["status"] = f"{label} ({done}/{total})" if total else label
+                # Rate of the current stage so far, later stages are not known yet
+                elapsed = now - self._stage_started
+                self.state["eta_seconds"] = round(elapsed * (total - done) / done, 1) if done and total else None
+            message = json.dumps(self.state)
+
+        if not self.job_id:
+            return
+        try:
+            client = get_redis_client()
+            client.set(progress_key(self.job_id), message, ex=PROGRESS_TTL)
+            client.publish(progress_channel(self.job_id), message)
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish the progress of {self.job_id}: {e}")
+
+def get_progress(job_id: str) -> Optional[dict]:
+    """
+    The last published progress of a job.
+
+    Args:
+        job_id (str): The job id returned by /upload.
+
+    Returns:
+        Optional[dict]: The progress state, None if there is none or Redis is unavailable.
+    """
+    try:
+        message = get_redis_client().get(progress_key(job_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not read the progress of {job_id}: {e}")
+        return None
+    return json.loads(message) if message else None
+
+def iter_progress(job_id: str, heartbeat: float = 15) -> Iterator[Optional[dict]]:
+    """
+    Follows the progress updates of a job as they are published.
+
+    Args:
+        job_id (str): The job id returned by /upload.
+        heartbeat (float): Seconds after which None is yielded if nothing was published,
+            so the caller can keep its connection alive and check on the job.
+
+    Yields:
+        Optional[dict]: None once subscribed, so the caller can read the current state without
+        missing an update, then each progress state, or None after heartbeat seconds without one.
+    """
+    pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(progress_channel(job_id))
+    try:
+        yield None
+        while True:
+            message = pubsub.get_message(timeout=heartbeat)
+            yield json.loads(message["data"]) if message else None
+    finally:
+        pubsub.close()
@@ -0,0 +1,208 @@
+import os
+import math
+import logging
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The system message never changes so Ollama can reuse its KV cache from one chat to the next,
+# everything that varies goes after it in the user message
+SYSTEM_PROMPT = "Read the sources and respond to the prompt given by the user."
+USER_TEMPLATE = "Sources:\n{sources}\n\nPrompt: {prompt}"
+SOURCE_SEPARATOR = "\n\n---\n\n"
+
+CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3.5"))  # Conservative for english text with llama tokenizers
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("OLLAMA_NUM_CTX", "2048"))  # Sent to Ollama as num_ctx
+# Per model num_ctx, e.g. "llama3.2:3b=8192,mistral=4096", a name without a tag matches every tag
+MODEL_CONTEXT_WINDOWS = os.getenv("MODEL_CONTEXT_WINDOWS", "")
+ANSWER_RESERVE_TOKENS = int(os.getenv("ANSWER_RESERVE_TOKENS", "512"))  # Left free for the generated answer
+MIN_OVERLAP_CHARS = int(os.getenv("PROMPT_MIN_OVERLAP_CHARS", "20"))  # Shorter shared text is left alone
+MAX_OVERLAP_CHARS = int(os.getenv("PROMPT_MAX_OVERLAP_CHARS", "400"))  # At least the chunker's overlap
+# Chosen chunks are grouped by rank in groups of this many, ordered by id within a group, see build_context
+RANK_BUCKET_SIZE = int(os.getenv("PROMPT_RANK_BUCKET_SIZE", "3"))
+
+def parse_context_windows(value: str) -> dict:
+    """
+    Parses MODEL_CONTEXT_WINDOWS.
+
+    Args:
+        value (str): Comma separated model=tokens pairs.
+
+    Returns:
+        dict: The context window in tokens of each model.
+    """
+    windows = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        model, tokens = item.rsplit("=", 1)
+        try:
+            windows[model.strip()] = int(tokens)
+        except ValueError:
+            logger.warning(f"Ignoring invalid context window {item!r}")
+    return windows
+
+context_windows = parse_context_windows(MODEL_CONTEXT_WINDOWS)
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token count estimate from the length of the text, no tokenizer needed.
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def context_window(model: str) -> int:
+    """
+    The context window of a model, from MODEL_CONTEXT_WINDOWS or DEFAULT_CONTEXT_WINDOW.
+
+    Args:
+        model (str): The Ollama model name, e.g. llama3.2:3b.
+
+    Returns:
+        int: The context window in tokens.
+    """
+    model = model or ""
+    if model in context_windows:
+        return context_windows[model]
+    return context_windows.get(model.split(":")[0], DEFAULT_CONTEXT_WINDOW)
+
+def overlap_length(previous: str, current: str) -> int:
+    """
+    Length of the longest end of previous that current starts with, e.g. the overlap
+    between two consecutive chunks of the same document.
+
+    Args:
+        previous (str): The text that comes first.
+        current (str): The text that may repeat the end of previous.
+
+    Returns:
+        int: The number of overlapping characters, 0 if shorter than MIN_OVERLAP_CHARS.
+    """
+    for length in range(min(len(previous), len(current), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(current[:length]):
+            return length
+    return 0
+
+def deduplicate_chunks(chunks: List[str]) -> Tuple[List[str], int]:
+    """
+    Removes repeated text from retrieved chunks, keeping their order.
+
+    Chunks contained in an earlier one are dropped, and text a chunk shares with the start
+    or the end of an earlier one (the overlap chunk_document adds) is cut from it.
+
+    Args:
+        chunks (List[str]): The chunks, best match first.
+
+    Returns:
+        Tuple[List[str], int]: The remaining chunks and the number of characters removed.
+    """
+    kept, removed = _deduplicate(chunks)
+    return [text for _, text in kept], removed
+
+def _deduplicate(chunks: List[str]) -> Tuple[List[Tuple[int, str]], int]:
+    # Same as deduplicate_chunks, with the index of each remaining chunk
+    kept = []
+    removed = 0
+    for index, chunk in enumerate(chunks):
+        text = chunk.strip()
+        original = len(text)
+        if any(text in other for _, other in kept):
+            removed += original
+            continue
+        for _, other in kept:
+            # An earlier chunk ends with our start, or starts with our end
+            cut = overlap_length(other, text)
+            if cut:
+                text = text[cut:].lstrip()
+            cut = overlap_length(text, other)
+            if cut:
+                text = text[:-cut].rstrip()
+        removed += original - len(text)
+        if text:
+            kept.append((index, text))
+    return kept, removed
+
+def build_context(documents: List[str], prompt: str, model: str, ids: List[str] = None) -> Tuple[str, dict]:
+    """
+    Fits the best retrieved chunks into the token budget of the model.
+
+    The budget is the context window minus the instructions, the user prompt and
+    ANSWER_RESERVE_TOKENS. Chunks are deduplicated, then added best match first, a chunk
+    that doesn't fit is skipped so a smaller one after it can still be used. The chosen
+    chunks stay best match first by groups of RANK_BUCKET_SIZE, and are ordered by id
+    within a group. Ids are content hashes, so that order means nothing by itself, but
+    searches whose top chunks only swap places within a group make the same prompt text,
+    which Ollama can reuse, while the best matches still come first.
+
+    Args:
+        documents (List[str]): The retrieved chunks, best match first.
+        prompt (str): The user prompt.
+        model (str): The Ollama model name.
+        ids (List[str]): The chunk ids, in the same order as documents.
+
+    Returns:
+        Tuple[str, dict]: The sources joined with SOURCE_SEPARATOR, and the prompt stats
+        (budget, estimated prefill tokens, chunks used and dropped, characters deduplicated).
+    """
+    window = context_window(model)
+    fixed_tokens = estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(USER_TEMPLATE.format(sources="", prompt=prompt))
+    budget = max(0, window - ANSWER_RESERVE_TOKENS - fixed_tokens)
+    chunks, duplicate_chars = _deduplicate(documents)
+
+    selected = []
+    used_tokens = 0
+    separator_tokens = estimate_tokens(SOURCE_SEPARATOR)
+    for index, chunk in chunks:
+        tokens = estimate_tokens(chunk) + (separator_tokens if selected else 0)
+        if used_tokens + tokens <= budget:
+            selected.append((index, chunk))
+            used_tokens += tokens
+        elif not selected and budget > 0:
+            # The best match alone is too big, keep as much of it as fits rather than nothing
+            selected.append((index, chunk[:int(budget * CHARS_PER_TOKEN)]))
+            used_tokens = budget
+    if ids:
+        bucket_size = max(1, RANK_BUCKET_SIZE)
+        rank_buckets = {index: rank // bucket_size for rank, (index, _) in enumerate(selected)}
+        selected.sort(key=lambda item: (rank_buckets[item[0]], ids[item[0]]))
+
+    stats = {
+        'model': model,
+        'context_window': window,
+        'budget_tokens': budget,
+        'context_tokens': used_tokens,
+        'prefill_tokens': fixed_tokens + used_tokens,
+        'chunks_retrieved': len(documents),
+        'chunks_used': len(selected),
+        'duplicate_chars': duplicate_chars,
+    }
+    logger.info(
+        f"Prompt for {model}: ~{stats['prefill_tokens']} prefill tokens, {len(selected)}/{len(documents)} chunks "
+        f"in a {budget} token budget, {duplicate_chars} duplicate chars removed"
+    )
+    return SOURCE_SEPARATOR.join(chunk for _, chunk in selected), stats
+
+def build_messages(documents: List[str], prompt: str, model: str, ids: List[str] = None) -> Tuple[list, dict]:
+    """
+    Builds the chat messages: the static SYSTEM_PROMPT first, then the sources and the prompt.
+
+    Args:
+        documents (List[str]): The retrieved chunks, best match first.
+        prompt (str): The user prompt.
+        model (str): The Ollama model name.
+        ids (List[str]): The chunk ids, in the same order as documents.
+
+    Returns:
+        Tuple[list, dict]: The messages for Ollama's api/chat and the prompt stats, see build_context.
+    """
+    context, stats = build_context(documents, prompt, model, ids)
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_TEMPLATE.format(sources=context, prompt=prompt)},
+    ]
+    return messages, stats
@@ -0,0 +1,229 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from functools import cached_property
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Directory holding model.onnx and tokenizer.json of a cross-encoder, e.g. an ONNX export of
+# cross-encoder/ms-marco-MiniLM-L-6-v2. Reranking is off while it is not set.
+RERANKER_MODEL_PATH = os.getenv("RERANKER_MODEL_PATH", "")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # Candidates fetched and scored per search
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "256"))  # Tokens per query and chunk pair
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))  # Past this the vector order is used
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", "0"))  # ONNX Runtime intra-op threads, 0 lets it decide
+# Scoring runs in flight per process, past this searches keep the retrieval order instead of queuing
+RERANK_MAX_IN_FLIGHT = int(os.getenv("RERANK_MAX_IN_FLIGHT", "2"))
+
+# Global variable to store the reranker so it doesn't get made more than once
+reranker = None
+
+class CrossEncoderReranker:
+    """
+    Scores query and chunk pairs with an ONNX cross-encoder, all candidates in a single batched run.
+
+    Pairs are padded to the longest pair of the batch rather than to max_length, which is most
+    of the cost on short chunks. Scoring runs on a worker thread so a search never waits more
+    than budget_ms for it, past the budget the candidates keep their retrieval order. A run that
+    overshot its budget still holds its worker until it ends, so at most max_in_flight runs are
+    started and searches that find them all busy skip reranking rather than queue behind them.
+
+    Under gevent (the default gunicorn workers) threading is monkey patched and executor threads
+    are greenlets, which CPU-bound scoring never lets the timeout interrupt. Scoring then runs
+    on the hub's pool of native threads instead.
+    """
+
+    def __init__(self, model_path: str, max_length: int = RERANK_MAX_LENGTH, budget_ms: float = RERANK_BUDGET_MS,
+                 intra_op_threads: int = RERANK_THREADS, max_in_flight: int = RERANK_MAX_IN_FLIGHT):
+        self.model_path = model_path
+        self.max_length = max_length
+        self.budget_ms = budget_ms
+        self.intra_op_threads = intra_op_threads
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        # Shared by the searches and the native threads that score under gevent, see _native_lock
+        self._in_flight_lock = _native_lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="reranker")
+
+    @cached_property
+    def tokenizer(self):
+        from tokenizers import Tokenizer
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_path, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=self.max_length)
+        tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        return tokenizer
+
+    @cached_property
+    def session(self):
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        so.log_severity_level = 3
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_threads > 0:
+            so.intra_op_num_threads = self.intra_op_threads
+        logger.info(f"Loading the reranker from {self.model_path}")
+        return ort.InferenceSession(
+            os.path.join(self.model_path, "model.onnx"), providers=["CPUExecutionProvider"], sess_options=so
+        )
+
+    def forward(self, query: str, documents: List[str]):
+        """
+        Runs the model once on every query and document pair.
+
+        Args:
+            query (str): The search query.
+            documents (List[str]): The candidate chunks.
+
+        Returns:
+            The raw model outputs.
+        """
+        encoded = self.tokenizer.encode_batch([(query, document) for document in documents])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encoded], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encoded], dtype=np.int64),
+        }
+        names = {model_input.name for model_input in self.session.get_inputs()}
+        return self.session.run(None, {name: value for name, value in inputs.items() if name in names})
+
+    def score(self, query: str, documents: List[str]) -> np.ndarray:
+        """
+        Scores how well each document answers the query.
+
+        Args:
+            query (str): The search query.
+            documents (List[str]): The candidate chunks.
+
+        Returns:
+            np.ndarray: One relevance score per document, higher is better.
+        """
+        logits = np.asarray(self.forward(query, documents)[0])
+        if logits.ndim == 2 and logits.shape[1] > 1:
+            # Two class models, the second class is "relevant"
+            logits = logits[:, 1]
+        return logits.reshape(-1)
+
+    def rerank(self, query: str, results: dict, n_results: int) -> Tuple[dict, dict]:
+        """
+        Reorders search results by cross-encoder score and keeps the best n_results.
+
+        Args:
+            query (str): The search query.
+            results (dict): Search results shaped like a Chroma query result, lists of one list.
+            n_results (int): The number of chunks to keep.
+
+        Returns:
+            Tuple[dict, dict]: The results with a rerank_scores list (None when the retrieval
+            order was kept), and stats on the run (candidates, milliseconds, fallback reason).
+        """
+        documents = results.get('documents', [[]])[0]
+        stats = {'candidates': len(documents), 'ms': None, 'fallback': None}
+        if not documents:
+            return results, stats
+
+        start = time.perf_counter()
+        if not self._acquire():
+            stats['fallback'] = f"all {self.max_in_flight} scoring runs in flight"
+        else:
+            try:
+                scores = self._score_within_budget(query, documents)
+                stats['ms'] = round((time.perf_counter() - start) * 1000, 1)
+            except TimeoutError:
+                stats['fallback'] = f"over the {self.budget_ms:.0f} ms budget"
+            except Exception as e:
+                stats['fallback'] = f"{type(e).__name__}: {e}"
+
+        if stats['fallback']:
+            logger.warning(f"Reranking {len(documents)} candidates skipped, {stats['fallback']}")
+            order = list(range(min(n_results, len(documents))))
+            scores = None
+        else:
+            logger.debug(f"Reranked {len(documents)} candidates in {stats['ms']} ms")
+            order = [int(i) for i in np.argsort(-scores, kind="stable")[:n_results]]
+
+        reranked = {
+            key: [[value[0][i] for i in order]]
+            for key, value in results.items()
+            if isinstance(value, list) and value and isinstance(value[0], list) and len(value[0]) == len(documents)
+        }
+        reranked['rerank_scores'] = [[float(scores[i]) for i in order]] if scores is not None else None
+        return reranked, stats
+
+    def _acquire(self) -> bool:
+        with self._in_flight_lock:
+            if self._in_flight >= self.max_in_flight:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _release(self) -> None:
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _score_job(self, query: str, documents: List[str]) -> np.ndarray:
+        # Holds the in-flight slot until scoring really ends, even after the search stopped waiting
+        try:
+            return self.score(query, documents)
+        finally:
+            self._release()
+
+    def _score_within_budget(self, query: str, documents: List[str]) -> np.ndarray:
+        """
+        Scores the documents on a native thread, raising TimeoutError past budget_ms.
+
+        The in-flight slot taken by the caller is released when the run ends, or right away if
+        it is cancelled before starting.
+        """
+        timeout = self.budget_ms / 1000
+        if _threading_is_patched():
+            from gevent import Timeout, get_hub
+            job = get_hub().threadpool.spawn(self._score_job, query, documents)
+            try:
+                return job.get(timeout=timeout)
+            except Timeout:
+                raise TimeoutError()
+
+        future = self._executor.submit(self._score_job, query, documents)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if future.cancel():
+                self._release()
+            raise
+
+def _threading_is_patched() -> bool:
+    """Whether gevent monkey patched threading, so executor threads are greenlets."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+def _native_lock():
+    """
+    A lock of the OS rather than a gevent lock when threading is monkey patched.
+
+    gevent locks only work between greenlets of one hub, the hub's pool threads that release
+    the in-flight slots are not greenlets.
+    """
+    if _threading_is_patched():
+        from gevent import monkey
+        return monkey.get_original("threading", "Lock")()
+    return threading.Lock()
+
+def get_reranker():
+    """
+    Getter for the cross-encoder reranker.
+
+    Returns:
+        CrossEncoderReranker: the reranker, or None if RERANKER_MODEL_PATH is not set.
+    """
+    global reranker
+    if reranker is None and RERANKER_MODEL_PATH:
+        reranker = CrossEncoderReranker(RERANKER_MODEL_PATH)
+    return reranker
@@ -1,36 +1,245 @@
-from celery import shared_task
+import os
+import json
+import time
+import shutil
+import sqlite3
 import logging
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from celery import chain, shared_task
 from . import vector_db
+from . import progress
+from . import catalogue
+from . import disk_cache
 from . import document_chunker as chunker
 
 logger = logging.getLogger(__name__)
 
+# Each stage of the ingestion pipeline runs on the queue of its workload type,
+# see the celery programs in supervisord.conf for the pool of each queue.
+TASK_ROUTES = {
+    'src.tasks.extract_pdf': {'queue': 'ocr'},  # CPU-bound: rasterization, Tesseract
+    'src.tasks.caption_pdf': {'queue': 'caption'},  # Network-bound: Vertex requests
+    'src.tasks.embed_file': {'queue': 'embed'},  # ONNX embeddings and Chroma upserts
+}
+
+def intermediate_path(textracted_path: str, file_path: str, suffix: str) -> str:
+    """Where a pipeline stage leaves its output for the next one."""
+    return os.path.join(textracted_path, f"{Path(file_path).name}.{suffix}")
+
+def dump_segments(pages: Iterable[tuple], path: str, image_dir: str) -> int:
+    """
+    Writes extracted pages as they come, one JSON line per page.
+
+    Images are written once each to image_dir, named by their content hash, and the lines only
+    hold their path. The caption stage reads them when it sends them, and the caption cache
+    finds them under the same hash.
+
+    Args:
+        pages (Iterable[tuple]): (page_index, segments) pairs, see chunker.iter_pdf_pages.
+        path (str): Where to write them.
+        image_dir (str): Where to write the images of the pages.
+
+    Returns:
+        int: The number of pages written.
+    """
+    os.makedirs(image_dir, exist_ok=True)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for page_index, segments in pages:
+            count += 1
+            json.dump([page_index, [
+                [kind, save_image(image_dir, value), *rest] if kind == "image" else [kind, value, *rest]
+                for kind, value, *rest in segments
+            ]], f)
+            f.write("\n")
+    return count
+
+def save_image(image_dir: str, jpeg_bytes: bytes) -> str:
+    """Writes an extracted image to image_dir unless it is already there, and returns its path."""
+    image_path = os.path.join(image_dir, f"{disk_cache.content_hash(jpeg_bytes)}.jpeg")
+    if not os.path.exists(image_path):
+        with open(image_path, 'wb') as f:
+            f.write(jpeg_bytes)
+    return image_path
+
+def load_segments(path: str) -> Iterator[tuple]:
+    """Reads the pages written by dump_segments, one at a time, with the paths of their images."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            page_index, segments = json.loads(line)
+            yield page_index, [tuple(segment) for segment in segments]
+
+def read_text(path: str) -> Iterator[str]:
+    """Reads the text left by a pipeline stage, chunker.TEXT_READ_SIZE characters at a time."""
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            part = f.read(chunker.TEXT_READ_SIZE)
+            if not part:
+                break
+            yield part
+
+def ingest_file(file_path: str, textracted_path: str, job_id: str) -> str:
+    """
+    Enqueues the ingestion pipeline of an uploaded file.
+
+    PDFs go through extract_pdf, caption_pdf and embed_file on their own queues, other
+    documents go straight to embed_file, so they are searchable in seconds even while a
+    large PDF is being OCR'd. The last task of the pipeline gets job_id as its task id,
+    earlier stages report their progress and failures under it.
+
+    Args:
+        file_path: Path to the uploaded file.
+        textracted_path: Path to the textracted directory.
+        job_id: The task id to track the whole pipeline with.
+
+    Returns:
+        str: The job id.
+    """
+    if Path(file_path).suffix.lower() == '.pdf':
+        chain(
+            extract_pdf.s(file_path, textracted_path, job_id),
+            caption_pdf.s(file_path, textracted_path, job_id),
+            embed_file.s(file_path, textracted_path, job_id).set(task_id=job_id),
+        ).apply_async()
+    else:
+        embed_file.apply_async((None, file_path, textracted_path, job_id), task_id=job_id)
+    return job_id
+
+def record_document(file_path: str, stage: str = None, seconds: float = None, **fields) -> None:
+    """
+    Records the ingestion status, counts and stage timings of a document in the catalogue.
+
+    The catalogue is bookkeeping, an error writing to it is logged and doesn't fail the ingestion.
+
+    Args:
+        file_path: Path to the uploaded file.
+        stage: The stage that took seconds, if any.
+        seconds: How long the stage took.
+        **fields: The columns to set, see catalogue.UPDATABLE_COLUMNS.
+    """
+    filename = Path(file_path).name
+    try:
+        documents = catalogue.get_catalogue()
+        documents.update(filename, **fields)
+        if stage:
+            documents.add_timing(filename, stage, seconds)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not update the catalogue entry of {filename}: {e}")
+
+def start_stage(task, job_id: str, stage: str) -> progress.ProgressReporter:
+    """
+    Marks the pipeline of job_id as being in a stage, and returns the reporter for its progress.
+
+    Args:
+        task: The running task.
+        job_id: The task id of the pipeline.
+        stage: One of progress.STAGES.
+
+    Returns:
+        progress.ProgressReporter: The reporter, resuming the progress of the previous stages.
+    """
+    reporter = progress.ProgressReporter(job_id)
+    reporter.stage(stage)
+    task.update_state(task_id=job_id, state='STARTED', meta={'status': reporter.snapshot()['status'], 'stage': stage})
+    return reporter
+
+def fail_job(task, job_id: str, reporter: progress.ProgressReporter, error: Exception, file_path: str) -> None:
+    """Marks the pipeline of job_id and its document as failed, the stages after the failed one never run."""
+    record_document(file_path, status='failed', error=str(error), finished_at=time.time())
+    if reporter:
+        reporter.fail(error)
+    if task.request.id != job_id:
+        task.backend.mark_as_failure(job_id, error)
+
+@shared_task(bind=True)
+def extract_pdf(self, file_path, textracted_path, job_id):
+    """
+    Extracts the text, images and OCR output of every page of a PDF.
+
+    Returns:
+        str: The path to the extracted page segments, as JSON lines.
+    """
+    reporter = None
+    start = time.perf_counter()
+    try:
+        record_document(file_path, status='processing', started_at=time.time())
+        reporter = start_stage(self, job_id, 'extract')
+        pages = chunker.iter_pdf_pages(file_path, reporter) if chunker.validate_file(file_path) else []
+
+        segments_path = intermediate_path(textracted_path, file_path, 'segments.jsonl')
+        image_dir = intermediate_path(textracted_path, file_path, 'images')
+        page_count = dump_segments(pages, segments_path, image_dir)
+        record_document(file_path, 'extract', time.perf_counter() - start, pages=page_count)
+        return segments_path
+    except Exception as e:
+        logger.error(f"Error extracting file {file_path}: {str(e)}")
+        fail_job(self, job_id, reporter, e, file_path)
+        raise e
+
 @shared_task(bind=True)
-def process_file(self, file_path, textracted_path):
+def caption_pdf(self, segments_path, file_path, textracted_path, job_id):
     """
-    Processes the file and embeds it into the database.
+    Captions the extracted images of a PDF and assembles its text.
+
+    Returns:
+        str: The path to the captioned text.
+    """
+    reporter = None
+    start = time.perf_counter()
+    try:
+        reporter = start_stage(self, job_id, 'caption')
+        text_path = intermediate_path(textracted_path, file_path, 'captioned.txt')
+        with open(text_path, 'w', encoding='utf-8') as f:
+            for page_text in chunker.iter_captioned_text(load_segments(segments_path), file_path, reporter):
+                f.write(page_text)
+        os.remove(segments_path)
+        shutil.rmtree(intermediate_path(textracted_path, file_path, 'images'), ignore_errors=True)
+        record_document(file_path, 'caption', time.perf_counter() - start)
+        return text_path
+    except Exception as e:
+        logger.error(f"Error captioning file {file_path}: {str(e)}")
+        fail_job(self, job_id, reporter, e, file_path)
+        raise e
+
+@shared_task(bind=True)
+def embed_file(self, text_path, file_path, textracted_path, job_id):
+    """
+    Chunks and embeds a document into the database.
 
     Args:
         self: The task instance.
+        text_path: Path to the text extracted by the previous stages, None to extract it here.
         file_path: Path to the uploaded file.
         textracted_path: Path to the textracted directory.
+        job_id: The task id of the pipeline, the id of this task.
     """
+    reporter = None
+    start = time.perf_counter()
     try:
-        logger.info(f"Starting to process file: {file_path}")
+        logger.info(f"Starting to embed file: {file_path}")
 
-        # Update task state
-        self.update_state(state='STARTED', meta={'status': 'Processing started'})
+        if text_path is None:
+            record_document(file_path, status='processing', started_at=time.time())
+            content = chunker.iter_text(file_path, textracted_path)
+        else:
+            content = read_text(text_path)
 
+        reporter = start_stage(self, job_id, 'embed')
         collection = vector_db.get_collection()
-        chunker.embed_documents([file_path], collection, textracted_path)
-
-        self.update_state(state='SUCCESS', meta={'status': 'Processing started'})
+        chunk_counts = chunker.embed_contents([(file_path, content)], collection, reporter)
+        if text_path is not None:
+            os.remove(text_path)
+        record_document(file_path, 'embed', time.perf_counter() - start, status='ready',
+                        chunks=chunk_counts.get(file_path, 0), finished_at=time.time())
 
         logger.info(f"Successfully processed file: {file_path}")
+        reporter.finish()
 
         return {'status': 'Task completed'}
 
     except Exception as e:
         logger.error(f"Error processing file {file_path}: {str(e)}")
-        self.update_state(state='FAILURE', meta={'status': 'Processing started'})
-        raise e
\ No newline at end of file
+        fail_job(self, job_id, reporter, e, file_path)
+        raise e
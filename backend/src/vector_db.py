@@ -1,16 +1,37 @@
 import chromadb
 from flask import request, jsonify, current_app
-from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
 from chromadb.config import Settings
+from tenacity import retry, stop_after_attempt, wait_exponential
+import os
+import queue
 import logging
+import threading
 import time
+import redis
+from collections import OrderedDict
+
+from . import embeddings
+from . import lexical_index
+from . import reranker
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "64"))  # Chunks embedded and upserted per request
+UPSERT_MAX_PENDING_BATCHES = int(os.getenv("UPSERT_MAX_PENDING_BATCHES", "2"))  # Full batches waiting before producers block
+UPSERT_RETRIES = int(os.getenv("UPSERT_RETRIES", "3"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))  # Cached query results and query embeddings
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "300"))  # Seconds a cached query result stays valid
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+COLLECTION_VERSION_KEY = "study-buddy:collection_version"
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid")  # "hybrid" fuses vector and BM25 results, "vector" only uses Chroma
+RRF_K = int(os.getenv("RRF_K", "60"))  # Reciprocal rank fusion constant, higher flattens the rank differences
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))  # Candidates fetched from each side per requested result
+
 # Global variables to store the Embedding Function and Chroma Client so they don't get made more than once
 chroma_client = None
 embedding_function = None
+redis_client = None
 
 # HELPER METHODS
 
@@ -43,7 +64,7 @@ def get_collection():
     global embedding_function
     logger.info("CALLED GET_COLLECTION")
     client = get_chroma_client()
-    embedding_function = embedding_function or ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+    embedding_function = embedding_function or embeddings.get_embedding_function()
     logger.info("trying to get collection 'documents'")
     collection = client.get_or_create_collection(name="documents", embedding_function=embedding_function)
     return collection
@@ -64,21 +85,341 @@ def initialize_chroma():
     # Now get or create your collection
     collection = get_collection()
 
+class BatchUpserter:
+    """
+    Embeds and upserts chunks into a collection in fixed-size batches while they are being produced.
+
+    Batches are sent by a background thread. add() blocks while max_pending full batches are
+    waiting, so a fast producer is held back by a slow Chroma and peak memory depends on the
+    batch size, not on the number of chunks. A failing batch is retried with exponential
+    backoff and then skipped, the other batches still go through. on_batch, if given, is
+    called with the number of chunks of each batch once it is stored, its errors are logged.
+    If the thread still stops, add() and close() raise instead of waiting on it forever.
+
+    Use it as a context manager, leaving the block flushes the last batch and waits for all of them.
+    """
+
+    def __init__(self, collection, batch_size=UPSERT_BATCH_SIZE, max_pending=UPSERT_MAX_PENDING_BATCHES, on_batch=None):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.upserted = 0
+        self.failed = 0
+        self._documents = []
+        self._ids = []
+        self._metadatas = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="batch-upserter", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, document, id, metadata):
+        """
+        Queues one chunk, sending the current batch once it is full.
+
+        Args:
+            document: string, the chunk text
+            id: string, the chunk id
+            metadata: dictionary, the chunk metadata
+        """
+        self._documents.append(document)
+        self._ids.append(id)
+        self._metadatas.append(metadata)
+        if len(self._ids) >= self.batch_size:
+            self._flush()
+
+    def close(self):
+        """Sends the last partial batch and waits until every batch has been upserted."""
+        self._flush()
+        self._put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError(f"The upsert thread stopped after {self.upserted} chunks") from self._error
+        if self.failed:
+            logger.error(f"Upserted {self.upserted} chunks, {self.failed} chunks failed.")
+        else:
+            logger.info(f"Upserted {self.upserted} chunks.")
+
+    def _flush(self):
+        if self._ids:
+            # Blocks while the queue is full, which is the backpressure on the producer
+            self._put((self._documents, self._ids, self._metadatas))
+            self._documents, self._ids, self._metadatas = [], [], []
+
+    def _put(self, item):
+        # Waits in steps so a producer notices the thread stopped instead of blocking on a queue nobody reads
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError(f"The upsert thread stopped after {self.upserted} chunks") from self._error
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        try:
+            self._consume()
+        except BaseException as e:
+            self._error = e
+            logger.exception(f"The upsert thread stopped: {e}")
+
+    def _consume(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            documents, ids, metadatas = batch
+            try:
+                self._upsert(documents, ids, metadatas)
+                self.upserted += len(ids)
+                logger.debug(f"Upserted batch of {len(ids)} chunks.")
+            except Exception as e:
+                self.failed += len(ids)
+                logger.error(f"Failed to upsert batch of {len(ids)} chunks starting at {ids[0]}: {e}")
+                continue
+            try:
+                lexical_index.get_lexical_index().add(ids, documents, metadatas)
+            except Exception as e:
+                # Vector search still finds these chunks, hybrid search just misses their terms
+                logger.error(f"Failed to add batch of {len(ids)} chunks starting at {ids[0]} to the lexical index: {e}")
+            if self.on_batch:
+                try:
+                    self.on_batch(len(ids))
+                except Exception as e:
+                    logger.error(f"Failed to report a batch of {len(ids)} upserted chunks: {e}")
+
+    @retry(stop=stop_after_attempt(UPSERT_RETRIES), wait=wait_exponential(multiplier=1, min=1, max=10), reraise=True)
+    def _upsert(self, documents, ids, metadatas):
+        self.collection.upsert(documents=documents, ids=ids, metadatas=metadatas)
+        bump_collection_version()
+
+def get_source_ids(collection, source):
+    """
+    Gets the ids of every chunk stored for a document.
+
+    Args:
+        collection: the collection
+        source: string, the path of the document
+
+    Returns:
+        set - the chunk ids
+    """
+    return set(collection.get(where={"source": source}, include=[])["ids"])
+
+def delete_ids(collection, ids, batch_size=UPSERT_BATCH_SIZE):
+    """
+    Deletes chunks by id in batches.
+
+    Args:
+        collection: the collection
+        ids: iterable of chunk ids
+        batch_size: int, ids per delete request
+    """
+    ids = list(ids)
+    for i in range(0, len(ids), batch_size):
+        collection.delete(ids=ids[i:i + batch_size])
+    if ids:
+        lexical_index.get_lexical_index().delete_ids(ids)
+        logger.info(f"Deleted {len(ids)} chunks.")
+        bump_collection_version()
+
+def delete_source(collection, source):
+    """
+    Deletes every chunk of a document from the collection and the lexical index.
+
+    Args:
+        collection: the collection
+        source: string, the path of the document
+    """
+    collection.delete(where={"source": source})
+    lexical_index.get_lexical_index().delete_source(source)
+    bump_collection_version()
+
+class TTLCache:
+    """
+    A thread-safe in-memory LRU cache whose entries also expire after ttl seconds (never if ttl is None).
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Query results are only valid for the collection version they were computed on,
+# query embeddings don't depend on the collection and never go stale.
+query_result_cache = TTLCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+query_embedding_cache = TTLCache(QUERY_CACHE_SIZE)
+
+def get_redis_client():
+    global redis_client
+    if redis_client is None:
+        redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return redis_client
+
+def get_collection_version():
+    """
+    Gets the collection version counter, shared by the web workers and the Celery workers through Redis.
+
+    Returns:
+        int - the current version, or None if Redis is unavailable (query results are then not cached)
+    """
+    try:
+        return int(get_redis_client().get(COLLECTION_VERSION_KEY) or 0)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read the collection version: {e}")
+        return None
+
+def bump_collection_version():
+    """
+    Invalidates every cached query result, call it whenever chunks are added to or deleted from the collection.
+    """
+    query_result_cache.clear()
+    try:
+        get_redis_client().incr(COLLECTION_VERSION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump the collection version: {e}")
+
+def get_query_embedding(query):
+    """
+    Embeds a search query, repeated queries are served from memory.
+
+    Args:
+        query: string
+
+    Returns:
+        the embedding of the query
+    """
+    embedding = query_embedding_cache.get(query)
+    if embedding is None:
+        embedding = embeddings.get_embedding_function()([query])[0]
+        query_embedding_cache.set(query, embedding)
+    return embedding
+
+def fuse_results(vector_results, lexical_results, n_results, k=RRF_K):
+    """
+    Merges vector and lexical results with reciprocal rank fusion.
+
+    Every chunk scores the sum of 1 / (k + rank) over the result lists it appears in, so chunks
+    ranked well by both searches come first without comparing distances to BM25 scores.
+
+    Args:
+        vector_results: the Chroma query result for one query
+        lexical_results: the lexical_index.LexicalIndex.search result
+        n_results: int, the number of chunks to keep
+        k: int, the fusion constant
+
+    Returns:
+        dictionary - ids, documents, metadatas, distances (None for lexical only matches)
+        and scores, as lists of one list like a Chroma query result
+    """
+    chunks = {}
+    vector_ids = vector_results.get('ids', [[]])[0]
+    for rank, id in enumerate(vector_ids):
+        chunks[id] = {
+            'document': vector_results['documents'][0][rank],
+            'metadata': vector_results['metadatas'][0][rank] if vector_results.get('metadatas') else None,
+            'distance': vector_results['distances'][0][rank] if vector_results.get('distances') else None,
+            'score': 1 / (k + rank + 1),
+        }
+    for rank, id in enumerate(lexical_results['ids']):
+        chunk = chunks.setdefault(id, {
+            'document': lexical_results['documents'][rank],
+            'metadata': lexical_results['metadatas'][rank],
+            'distance': None,
+            'score': 0,
+        })
+        chunk['score'] += 1 / (k + rank + 1)
+
+    ranked = sorted(chunks.items(), key=lambda item: item[1]['score'], reverse=True)[:n_results]
+    return {
+        'ids': [[id for id, _ in ranked]],
+        'documents': [[chunk['document'] for _, chunk in ranked]],
+        'metadatas': [[chunk['metadata'] for _, chunk in ranked]],
+        'distances': [[chunk['distance'] for _, chunk in ranked]],
+        'scores': [[chunk['score'] for _, chunk in ranked]],
+    }
+
 # API ENDPOINT FUNCTION
 
-def search_documents(query):
+def search_documents(query, n_results=5, mode=None):
     """
     Search through submitted files to find the best matches for the given query.
+
+    In hybrid mode (the SEARCH_MODE default) the vector search and the BM25 lexical index
+    each return HYBRID_CANDIDATES candidates per result, fused with reciprocal rank fusion,
+    so exact terms like course codes and formula names rank well too. With a reranker
+    configured (see reranker.RERANKER_MODEL_PATH), RERANK_CANDIDATES chunks are retrieved
+    and the cross-encoder picks the best n_results of them.
+
+    Results are cached per query until the collection changes (see bump_collection_version)
+    or QUERY_CACHE_TTL expires, the returned results must not be modified.
     """
     if not query:
         return jsonify({'error': 'No query given.'}), 400
+    mode = mode or SEARCH_MODE
     logger.debug(f"Searching documents with query: {query}")
+    version = get_collection_version()
+    cache_key = (query, n_results, mode, version)
+    if version is not None:
+        results = query_result_cache.get(cache_key)
+        if results is not None:
+            logger.debug("Query result cache hit")
+            return results, 200
+
     collection = get_collection()
+    cross_encoder = reranker.get_reranker()
+    retrieved = max(n_results, reranker.RERANK_CANDIDATES) if cross_encoder else n_results
     try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=5
-        )
+        if mode == "hybrid":
+            candidates = retrieved * HYBRID_CANDIDATES
+            vector_results = collection.query(query_embeddings=[get_query_embedding(query)], n_results=candidates)
+            try:
+                lexical_results = lexical_index.get_lexical_index().search(query, candidates)
+            except Exception as e:
+                logger.warning(f"Lexical search failed, using vector results only: {e}")
+                lexical_results = {'ids': [], 'documents': [], 'metadatas': [], 'scores': []}
+            results = fuse_results(vector_results, lexical_results, retrieved)
+        else:
+            results = collection.query(
+                query_embeddings=[get_query_embedding(query)],
+                n_results=retrieved
+            )
+        if cross_encoder:
+            results, _ = cross_encoder.rerank(query, results, n_results)
+        if version is not None:
+            query_result_cache.set(cache_key, results)
         return results, 200
     except Exception as e:
         logger.error(f"ERROR: {str(e)}")
@@ -0,0 +1,148 @@
+import os
+import time
+import fcntl
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# With FAST_START, create_app returns right away and the steps below run on a background
+# thread, /status reports when each one is ready. Without it they run inside create_app.
+FAST_START = os.getenv("FAST_START", "true").lower() in ("1", "true", "yes")
+WARMUP_STEPS = [step.strip() for step in os.getenv("WARMUP_STEPS", "nltk,embeddings,chroma,lexical,reranker,catalogue").split(",") if step.strip()]
+
+def warm_nltk():
+    """Makes sure the punkt_tab data is there, downloading it only if it is missing, and loads the tokenizer."""
+    import nltk
+    try:
+        nltk.data.find('tokenizers/punkt_tab')
+    except LookupError:
+        nltk.download('punkt_tab', quiet=True)
+    from . import document_chunker
+    document_chunker.get_sentence_tokenizer()
+
+def warm_embeddings():
+    """Downloads the embedding model if needed and loads its ONNX session and tokenizer."""
+    from . import embeddings
+    embedding_function = embeddings.get_embedding_function()
+    embedding_function._download_model_if_not_exists()
+    embedding_function.tokenizer
+    embedding_function.model
+
+def warm_chroma():
+    """Connects to Chroma and makes sure the collection exists."""
+    from . import vector_db
+    vector_db.initialize_chroma()
+
+def warm_lexical():
+    """
+    Opens the lexical index, and rebuilds it from Chroma if it doesn't hold the same number of chunks.
+
+    Every gunicorn and Celery process warms up, a file lock next to the index makes sure only one
+    of them rebuilds it. The others go on with the index as it is.
+    """
+    from . import vector_db, lexical_index
+    index = lexical_index.get_lexical_index()
+    collection = vector_db.get_collection()
+    if index.count() == collection.count():
+        return
+    with open(f"{index.path}.rebuild.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("Another process is rebuilding the lexical index")
+            return
+        # The process that held the lock may have just rebuilt it
+        if index.count() != collection.count():
+            index.rebuild(collection)
+            vector_db.bump_collection_version()
+
+def warm_reranker():
+    """Loads the cross-encoder, if one is configured, so the first searches don't run out of budget loading it."""
+    from . import reranker
+    cross_encoder = reranker.get_reranker()
+    if cross_encoder:
+        cross_encoder.score("warmup", ["warmup"])
+
+def warm_catalogue():
+    """Opens the document catalogue and adds the uploads it doesn't know about yet, e.g. from before it existed."""
+    from flask import current_app
+    from . import catalogue, disk_cache
+    catalogue.get_catalogue().sync(current_app.config['UPLOAD_FOLDER'], disk_cache.file_hash)
+
+STEPS = {
+    "nltk": warm_nltk,
+    "embeddings": warm_embeddings,
+    "chroma": warm_chroma,
+    "lexical": warm_lexical,
+    "reranker": warm_reranker,
+    "catalogue": warm_catalogue,
+}
+
+class Warmup:
+    """
+    Runs the slow startup steps (NLTK data, the embedding model, the Chroma connection, the lexical index, the reranker,
+    the document catalogue) once, and keeps track of which ones are ready, how long they took and why they failed.
+    """
+
+    def __init__(self, app, steps=None):
+        self.app = app
+        self.steps = steps if steps is not None else WARMUP_STEPS
+        self.created = time.perf_counter()
+        self.results = {step: {'ready': False, 'seconds': None, 'error': None} for step in self.steps}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        """Runs the steps on a background thread."""
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def run(self) -> None:
+        """Runs the steps in order, a failed step doesn't stop the next ones."""
+        with self.app.app_context():
+            for step in self.steps:
+                start = time.perf_counter()
+                try:
+                    STEPS[step]()
+                    error = None
+                    logger.info(f"Warmup step {step} ready in {time.perf_counter() - start:.2f}s")
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    logger.error(f"Warmup step {step} failed: {error}")
+                with self._lock:
+                    self.results[step] = {
+                        'ready': error is None,
+                        'seconds': round(time.perf_counter() - start, 3),
+                        'error': error,
+                    }
+
+    def wait(self, timeout: float = None) -> bool:
+        """Waits for the background steps to finish, returns whether they all succeeded."""
+        if self._thread:
+            self._thread.join(timeout)
+        return self.all_ready()
+
+    def is_ready(self, step: str) -> bool:
+        """Whether a step succeeded, steps that were not configured count as ready."""
+        with self._lock:
+            return self.results.get(step, {'ready': True})['ready']
+
+    def all_ready(self) -> bool:
+        with self._lock:
+            return all(result['ready'] for result in self.results.values())
+
+    def error(self):
+        """The errors of the failed steps, None if there are none."""
+        with self._lock:
+            errors = [f"{step}: {result['error']}" for step, result in self.results.items() if result['error']]
+        return "; ".join(errors) or None
+
+    def status(self) -> dict:
+        """The state and duration of each step, for the /status endpoint."""
+        with self._lock:
+            return {
+                'fast_start': self._thread is not None,
+                'seconds_since_start': round(time.perf_counter() - self.created, 3),
+                'steps': {step: dict(result) for step, result in self.results.items()},
+            }
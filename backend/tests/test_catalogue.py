@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src import catalogue
+from src import disk_cache
+
+class DocumentCatalogueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.catalogue = catalogue.DocumentCatalogue(os.path.join(self.temp_dir, 'catalogue.sqlite3'))
+        for i, (filename, size) in enumerate([('bio.pdf', 300), ('cs.pdf', 100), ('notes.txt', 200)]):
+            self.catalogue.add(filename, f'uploads/{filename}', f'hash{i}', size, job_id=f'job-{i}')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_progress_and_timings_are_recorded(self):
+        self.catalogue.update('bio.pdf', status='ready', pages=12, chunks=40)
+        self.catalogue.add_timing('bio.pdf', 'extract', 1.5)
+        self.catalogue.add_timing('bio.pdf', 'embed', 0.25)
+
+        document = self.catalogue.get('bio.pdf')
+        self.assertEqual((document['status'], document['pages'], document['chunks']), ('ready', 12, 40))
+        self.assertEqual(document['timings'], {'extract': 1.5, 'embed': 0.25})
+        self.assertIsNone(self.catalogue.get('missing.pdf'))
+        with self.assertRaises(ValueError):
+            self.catalogue.update('bio.pdf', hash='other')
+
+    def test_duplicates_are_same_name_and_content(self):
+        self.assertTrue(self.catalogue.is_duplicate('bio.pdf', 'hash0'))
+        self.assertFalse(self.catalogue.is_duplicate('bio.pdf', 'changed'))
+        self.assertFalse(self.catalogue.is_duplicate('new.pdf', 'hash0'))
+
+        # A failed ingestion can be retried with the same file
+        self.catalogue.update('bio.pdf', status='failed', error='Chroma is down')
+        self.assertFalse(self.catalogue.is_duplicate('bio.pdf', 'hash0'))
+
+    def test_pages_are_sorted(self):
+        documents, total = self.catalogue.list_documents(page=1, per_page=2, sort='size', order='desc')
+        self.assertEqual([document['filename'] for document in documents], ['bio.pdf', 'notes.txt'])
+        self.assertEqual(total, 3)
+
+        documents, _ = self.catalogue.list_documents(page=2, per_page=2, sort='size', order='desc')
+        self.assertEqual([document['filename'] for document in documents], ['cs.pdf'])
+
+        with self.assertRaises(ValueError):
+            self.catalogue.list_documents(sort='hash; DROP TABLE documents')
+
+    def test_pages_are_read_without_sorting(self):
+        connection = self.catalogue._connection()
+        statements = []
+        connection.set_trace_callback(statements.append)
+        for sort in catalogue.SORT_COLUMNS:
+            for order in ('asc', 'desc'):
+                self.catalogue.list_documents(sort=sort, order=order)
+        connection.set_trace_callback(None)
+
+        plans = [connection.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+                 for statement in statements if 'ORDER BY' in statement]
+        self.assertEqual(len(plans), 2 * len(catalogue.SORT_COLUMNS))
+        for plan in plans:
+            self.assertNotIn('TEMP B-TREE', ' '.join(row[-1] for row in plan))
+
+    def test_sync_adds_and_removes_uploads(self):
+        upload_folder = os.path.join(self.temp_dir, 'uploads')
+        os.makedirs(upload_folder)
+        for filename in ('bio.pdf', 'old.md'):
+            with open(os.path.join(upload_folder, filename), 'wb') as f:
+                f.write(b'content')
+
+        added, removed = self.catalogue.sync(upload_folder, disk_cache.file_hash)
+
+        self.assertEqual((added, removed), (1, 2))
+        self.assertEqual(self.catalogue.filenames(), ['bio.pdf', 'old.md'])
+        self.assertEqual(self.catalogue.get('old.md')['status'], 'ready')
+        self.assertEqual(self.catalogue.get('bio.pdf')['hash'], 'hash0')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.disk_cache import DiskCache, content_hash, make_key
+
+class DiskCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'cache', 'test.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_set_and_get(self):
+        cache = DiskCache(self.path, max_bytes=1024)
+        cache.set('key', b'value')
+        cache.set_text('text', 'caption')
+
+        self.assertEqual(cache.get('key'), b'value')
+        self.assertEqual(cache.get_text('text'), 'caption')
+        self.assertIsNone(cache.get('missing'))
+
+    def test_persists_across_instances(self):
+        DiskCache(self.path, max_bytes=1024).set_text('key', 'value')
+
+        self.assertEqual(DiskCache(self.path, max_bytes=1024).get_text('key'), 'value')
+
+    def test_evicts_least_recently_used(self):
+        cache = DiskCache(self.path, max_bytes=100)
+        cache.set('a', b'x' * 40)
+        cache.set('b', b'x' * 40)
+        cache.get('a')  # 'b' is now the least recently used entry
+        cache.set('c', b'x' * 40)
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_overwrite_keeps_size_accounting(self):
+        cache = DiskCache(self.path, max_bytes=100)
+        for _ in range(10):
+            cache.set('a', b'x' * 60)
+
+        self.assertEqual(cache.get('a'), b'x' * 60)
+
+    def test_keys_depend_on_every_part(self):
+        digest = content_hash(b'image bytes')
+
+        self.assertEqual(make_key('caption', digest, 'prompt'), make_key('caption', digest, 'prompt'))
+        self.assertNotEqual(make_key('caption', digest, 'prompt'), make_key('caption', digest, 'other prompt'))
+        self.assertNotEqual(make_key('caption', digest), make_key('ocr', digest))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import fitz
+from PIL import Image
+
+from src.document_chunker import chunk_document, count_tokens, iter_chunks, embed_documents, CAPTION_START, CAPTION_END
+from src import document_chunker
+
+class ChunkDocumentTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sentences = [f"This is sentence number {i} of the test document." for i in range(100)]
+        self.content = " ".join(self.sentences)
+
+    def test_chunks_respect_size(self):
+        chunks = chunk_document(self.content, chunk_size=200, overlap=60)
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 200)
+            self.assertEqual(chunk, chunk.strip())
+
+    def test_every_sentence_is_kept(self):
+        chunks = chunk_document(self.content, chunk_size=200, overlap=60)
+
+        joined = " ".join(chunks)
+        for sentence in self.sentences:
+            self.assertIn(sentence, joined)
+
+    def test_overlap_is_made_of_whole_sentences(self):
+        chunks = chunk_document(self.content, chunk_size=200, overlap=60)
+
+        for previous, current in zip(chunks, chunks[1:]):
+            first_sentence = current.split(". ")[0] + "."
+            self.assertIn(first_sentence, previous)
+
+    def test_captions_are_kept_whole(self):
+        caption = f"{CAPTION_START}A diagram of a cell. It shows the nucleus.{CAPTION_END}"
+        content = f"{self.content} {caption} {self.content}"
+
+        chunks = chunk_document(content, chunk_size=200, overlap=60)
+
+        self.assertIn(caption, chunks)
+        for chunk in chunks:
+            self.assertEqual(CAPTION_START in chunk, CAPTION_END in chunk)
+
+    def test_token_unit(self):
+        chunks = chunk_document(self.content, chunk_size=40, overlap=10, unit="tokens")
+
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            self.assertLessEqual(count_tokens(chunk), 40)
+
+    def test_invalid_unit(self):
+        with self.assertRaises(ValueError):
+            chunk_document(self.content, unit="pages")
+
+    def test_anchored_chunks_survive_an_insertion(self):
+        sentences = [f"Sentence {i} talks about topic {i * 7 % 13} in some detail." for i in range(400)]
+        edited = sentences[:50] + ["A brand new sentence was inserted here by the author."] + sentences[50:]
+
+        original_chunks = chunk_document(" ".join(sentences), anchored=True)
+        edited_chunks = chunk_document(" ".join(edited), anchored=True)
+
+        changed = set(edited_chunks) - set(original_chunks)
+        self.assertLessEqual(len(changed), 3)
+
+class IterChunksTestCase(unittest.TestCase):
+    def test_streamed_parts_chunk_like_the_whole(self):
+        caption = f"{CAPTION_START}A diagram of a cell. It shows the nucleus.{CAPTION_END}"
+        content = " ".join(f"Page {i // 10} says fact {i} about cells." for i in range(300))
+        content = content[:4000] + f" {caption} " + content[4000:]
+        # Pages cut mid-word, mid-sentence and mid-caption
+        parts = [content[i:i + 257] for i in range(0, len(content), 257)]
+
+        for anchored in (False, True):
+            chunks = iter_chunks(iter(parts), chunk_size=300, overlap=80, anchored=anchored)
+            self.assertEqual(list(chunks), chunk_document(content, chunk_size=300, overlap=80, anchored=anchored))
+
+    def test_chunks_are_yielded_before_the_end(self):
+        def parts():
+            yield " ".join(f"Sentence {i} of the first page." for i in range(100))
+            raise RuntimeError("the second page is never read")
+
+        chunks = iter_chunks(parts(), chunk_size=200, overlap=50)
+
+        self.assertTrue(next(chunks).startswith("Sentence 0"))
+
+class IterCaptionedPagesTestCase(unittest.TestCase):
+    @patch('src.document_chunker._caption_segments', side_effect=lambda images, page_num: [f"<{page_num}>"] * len(images))
+    def test_pages_come_out_in_order(self, mock_caption):
+        extracted = [(2, [("text", "c ")]), (0, [("image", b"jpeg", "figure"), ("text", "a ")]), (1, [("text", "b ")])]
+
+        pages = document_chunker._iter_captioned_pages(iter(extracted), "book.pdf", MagicMock(), count_pages=False)
+
+        self.assertEqual(list(pages), ["<1>a ", "b ", "c "])
+
+class ExtractPageSegmentsTestCase(unittest.TestCase):
+    @patch('src.document_chunker.ocr_planner.ocr_page')
+    def test_text_layer_is_extracted_without_ocr(self, mock_ocr_page):
+        doc = fitz.open()
+        page = doc.new_page()
+        page.insert_text((72, 72), "Mitosis is cell division.")
+        page.insert_text((72, 400), "Meiosis makes gametes.")
+        stats = {}
+
+        with doc:
+            segments = document_chunker._extract_page_segments(doc, 0, tempfile.gettempdir(), stats)
+
+        self.assertEqual(segments, [("text", "Mitosis is cell division.\n"), ("text", "Meiosis makes gametes.\n")])
+        mock_ocr_page.assert_not_called()
+        self.assertEqual(stats['page'], 1)
+        self.assertIn('total_ms', stats)
+
+    @patch('src.document_chunker.ocr_planner.ocr_image', return_value="")
+    def test_images_stay_in_memory_unless_saved(self, mock_ocr_image):
+        buffer = io.BytesIO()
+        Image.new("RGB", (1600, 800), "red").save(buffer, format="PNG")
+        doc = fitz.open()
+        page = doc.new_page()
+        page.insert_text((72, 72), "Figure 1")
+        page.insert_image(fitz.Rect(72, 100, 472, 300), stream=buffer.getvalue())
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+
+        with doc:
+            in_memory = document_chunker._extract_page_segments(doc, 0, None)
+            saved = document_chunker._extract_page_segments(doc, 0, temp_dir)
+
+        images = [segment for segment in in_memory if segment[0] == "image"]
+        self.assertEqual(len(images), 1)
+        with Image.open(io.BytesIO(images[0][1])) as image:
+            self.assertEqual((image.format, image.size), ("JPEG", (1000, 500)))
+        self.assertEqual(saved, in_memory)
+        self.assertEqual(len(os.listdir(temp_dir)), 1)
+
+class IterExtractedPagesTestCase(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        self.pdf_path = os.path.join(temp_dir, 'book.pdf')
+        with fitz.open() as doc:
+            for i in range(6):
+                doc.new_page().insert_text((72, 72), f"Page {i + 1} text.")
+            doc.save(self.pdf_path)
+
+    @patch('src.document_chunker.ocr_planner.ocr_page')
+    @patch('src.document_chunker.PDF_PAGE_WORKERS', 2)
+    def test_worker_pool_keeps_every_page(self, mock_ocr_page):
+        pages = document_chunker.extract_pdf_pages(self.pdf_path)
+
+        self.assertEqual(pages, [[("text", f"Page {i + 1} text.\n")] for i in range(6)])
+
+    @patch('src.document_chunker.ocr_planner.ocr_page')
+    @patch('src.document_chunker.PDF_PAGE_WORKERS', 2)
+    def test_failing_page_does_not_drop_the_others(self, mock_ocr_page):
+        extract_page_segments = document_chunker._extract_page_segments
+
+        def failing_third_page(doc, page_index, image_dir, stats=None):
+            if page_index == 2:
+                raise RuntimeError("corrupt page")
+            return extract_page_segments(doc, page_index, image_dir, stats)
+
+        # The worker processes are forked, so they see the patched function too
+        with patch('src.document_chunker._extract_page_segments', side_effect=failing_third_page):
+            pages = document_chunker.extract_pdf_pages(self.pdf_path)
+
+        self.assertEqual(pages[2], [])
+        self.assertEqual([page for i, page in enumerate(pages) if i != 2],
+                         [[("text", f"Page {i + 1} text.\n")] for i in range(6) if i != 2])
+
+class EmbedDocumentsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_dir, 'notes.txt')
+        with open(self.file_path, 'w') as f:
+            f.write(" ".join(f"Fact number {i} is worth remembering." for i in range(200)))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    @patch('src.document_chunker.log_full_content')
+    @patch('src.vector_db.bump_collection_version')
+    @patch('src.vector_db.lexical_index.get_lexical_index')
+    def test_only_changed_chunks_are_embedded(self, mock_get_index, mock_bump, mock_log):
+        collection = MagicMock()
+        collection.get.return_value = {'ids': []}
+        embed_documents([self.file_path], collection, self.temp_dir)
+        stored_ids = [id for call in collection.upsert.call_args_list for id in call.kwargs['ids']]
+        self.assertGreater(len(stored_ids), 1)
+
+        # Re-ingest with every chunk stored plus one stale chunk of an older version
+        collection.reset_mock()
+        collection.get.return_value = {'ids': stored_ids + ['notes.txt_stale']}
+        embed_documents([self.file_path], collection, self.temp_dir)
+
+        collection.upsert.assert_not_called()
+        collection.delete.assert_called_once_with(ids=['notes.txt_stale'])
+        mock_get_index.return_value.delete_ids.assert_called_once_with(['notes.txt_stale'])
+
+if __name__ == '__main__':
+    unittest.main()
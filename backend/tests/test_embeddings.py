@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from src import disk_cache
+from src import embeddings
+
+def fake_forward(texts, batch_size=32):
+    # One distinct vector per text, so results can be matched back to their input
+    return np.array([[len(text), ord(text[0])] for text in texts], dtype=np.float32)
+
+@patch.object(embeddings.CachedMiniLM, '_download_model_if_not_exists')
+class CachedMiniLMTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        cache = disk_cache.DiskCache(os.path.join(self.temp_dir, 'embeddings.sqlite3'), 1024 * 1024)
+        self.embedder = embeddings.CachedMiniLM(cache, batch_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_cache_hits_skip_inference(self, mock_download):
+        with patch.object(self.embedder, '_forward', side_effect=fake_forward) as mock_forward:
+            first = self.embedder(['mitosis', 'osmosis'])
+            second = self.embedder(['mitosis', 'osmosis'])
+
+        mock_forward.assert_called_once()
+        np.testing.assert_array_equal(first, second)
+
+    def test_duplicates_are_embedded_once(self, mock_download):
+        with patch.object(self.embedder, '_forward', side_effect=fake_forward) as mock_forward:
+            vectors = self.embedder(['mitosis', 'osmosis', 'mitosis'])
+
+        self.assertEqual(mock_forward.call_args.args[0], ['mitosis', 'osmosis'])
+        np.testing.assert_array_equal(vectors[0], vectors[2])
+
+    def test_order_is_kept_across_hits_and_misses(self, mock_download):
+        texts = ['alpha', 'beta', 'gamma', 'delta']
+        with patch.object(self.embedder, '_forward', side_effect=fake_forward) as mock_forward:
+            self.embedder(['gamma', 'alpha'])
+            vectors = self.embedder(texts)
+
+        self.assertEqual(mock_forward.call_args.args[0], ['beta', 'delta'])
+        np.testing.assert_array_equal(np.array(vectors), fake_forward(texts))
+
+    def test_inference_runs_in_batches(self, mock_download):
+        def encode(text):
+            return SimpleNamespace(ids=[1, 2, 3], attention_mask=[1, 1, 1])
+
+        model = MagicMock()
+        model.run.side_effect = lambda outputs, inputs: [np.ones((len(inputs['input_ids']), 3, 4), dtype=np.float32)]
+        # Both are cached properties, set them so no model files are needed
+        self.embedder.__dict__['tokenizer'] = MagicMock(encode=encode)
+        self.embedder.__dict__['model'] = model
+
+        vectors = self.embedder([f"chunk {i}" for i in range(5)])
+
+        batch_sizes = [len(call.args[1]['input_ids']) for call in model.run.call_args_list]
+        self.assertEqual(batch_sizes, [2, 2, 1])
+        self.assertEqual(len(vectors), 5)
+
+if __name__ == '__main__':
+    unittest.main()
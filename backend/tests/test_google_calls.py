@@ -0,0 +1,184 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import threading
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+os.environ.setdefault("GCP_PROJECT_ID", "test-project")
+os.environ.setdefault("GCP_LOCATION", "us-central1")
+
+from PIL import Image
+
+from src import disk_cache
+from src import google_calls
+
+def make_credentials(expires_in: timedelta):
+    creds = MagicMock()
+    creds.token = None
+    creds.expiry = None
+
+    def refresh(request):
+        creds.token = "token"
+        # google-auth keeps expiry as a naive UTC datetime
+        creds.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + expires_in
+    creds.refresh.side_effect = refresh
+    return creds
+
+class AccessTokenTestCase(unittest.TestCase):
+    def setUp(self):
+        google_calls.credentials = None
+
+    def tearDown(self):
+        google_calls.credentials = None
+
+    @patch('src.google_calls.load_credentials')
+    def test_token_is_refreshed_once_and_shared(self, mock_load):
+        creds = make_credentials(timedelta(hours=1))
+        mock_load.return_value = creds
+
+        threads = [threading.Thread(target=google_calls.get_access_token) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(google_calls.get_access_token(), "token")
+        mock_load.assert_called_once()
+        creds.refresh.assert_called_once()
+
+    @patch('src.google_calls.load_credentials')
+    def test_token_is_refreshed_near_expiry(self, mock_load):
+        creds = make_credentials(timedelta(seconds=google_calls.TOKEN_REFRESH_MARGIN - 60))
+        mock_load.return_value = creds
+
+        google_calls.get_access_token()
+        google_calls.get_access_token()
+
+        self.assertEqual(creds.refresh.call_count, 2)
+
+    @patch('src.google_calls.load_credentials')
+    def test_invalidated_token_is_refreshed(self, mock_load):
+        creds = make_credentials(timedelta(hours=1))
+        mock_load.return_value = creds
+
+        google_calls.get_access_token()
+        google_calls.invalidate_access_token()
+        google_calls.get_access_token()
+
+        self.assertEqual(creds.refresh.call_count, 2)
+
+@patch('src.google_calls.CAPTION_BATCH_SIZE', 3)
+class CaptionImagesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.image_paths = []
+        for i, color in enumerate(['red', 'green', 'blue', 'red']):
+            path = os.path.join(self.temp_dir, f'{i}.jpeg')
+            Image.new('RGB', (20, 20), color).save(path)
+            self.image_paths.append(path)
+        self.cache_patcher = patch('src.google_calls.disk_cache.get_image_cache',
+                                   return_value=disk_cache.DiskCache(os.path.join(self.temp_dir, 'cache.sqlite3'), 1024 * 1024))
+        self.cache_patcher.start()
+
+    def tearDown(self):
+        self.cache_patcher.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    @patch('src.google_calls.chat_completion', return_value='["a red square", "a green square", "a blue square"]')
+    def test_distinct_images_share_one_request(self, mock_completion):
+        captions = google_calls.caption_images(self.image_paths)
+
+        self.assertEqual(captions, ["a red square", "a green square", "a blue square", "a red square"])
+        mock_completion.assert_called_once()
+
+        # Captioned images are cached
+        google_calls.caption_images(self.image_paths)
+        mock_completion.assert_called_once()
+
+    @patch('src.google_calls.chat_completion', side_effect=['Sorry, I can only see one image.', 'red', 'green', 'blue'])
+    def test_malformed_batch_falls_back_to_single_requests(self, mock_completion):
+        captions = google_calls.caption_images(self.image_paths[:3])
+
+        self.assertEqual(sorted(captions), ['blue', 'green', 'red'])
+        self.assertEqual(mock_completion.call_count, 4)
+
+    @patch('src.google_calls.chat_completion', return_value='a red square')
+    def test_image_bytes_are_sent_as_they_are(self, mock_completion):
+        with open(self.image_paths[0], 'rb') as f:
+            image = f.read()
+
+        captions = google_calls.caption_images([image])
+
+        self.assertEqual(captions, ["a red square"])
+        content = mock_completion.call_args.args[0]
+        self.assertIn(google_calls.base64.b64encode(image).decode('ascii'), content[0]["image_url"]["url"])
+
+    @patch('src.google_calls.chat_completion', return_value='a red square')
+    def test_unreadable_images_get_the_fallback(self, mock_completion):
+        unreadable = os.path.join(self.temp_dir, 'folder.jpeg')
+        os.mkdir(unreadable)
+
+        captions = google_calls.caption_images([unreadable, self.image_paths[0]])
+
+        self.assertEqual(captions, ["Failed to generate a caption.", "a red square"])
+        self.assertEqual(google_calls.caption_image(unreadable), "Failed to generate a caption.")
+        self.assertEqual(google_calls.caption_image(os.path.join(self.temp_dir, 'missing.jpeg')), "Image file not found.")
+
+def encode(image: Image.Image, format: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+class PrepareImageTestCase(unittest.TestCase):
+    def test_small_jpegs_pass_through(self):
+        image_bytes = encode(Image.new('RGB', (200, 100), 'red'), 'JPEG')
+
+        self.assertIs(google_calls.prepare_image(image_bytes), image_bytes)
+
+    def test_large_images_are_resized_once_to_jpeg(self):
+        image_bytes = encode(Image.new('RGBA', (3000, 1500), 'blue'), 'PNG')
+
+        with Image.open(io.BytesIO(google_calls.prepare_image(image_bytes))) as prepared:
+            self.assertEqual(prepared.format, 'JPEG')
+            self.assertEqual(prepared.size, (1000, 500))
+
+    def test_decoded_image_is_reused(self):
+        image_bytes = encode(Image.new('RGB', (2000, 2000), 'green'), 'JPEG')
+        image = Image.open(io.BytesIO(image_bytes))
+        image.load()
+
+        with patch('src.google_calls.Image.open') as mock_open:
+            prepared = google_calls.prepare_image(image_bytes, image)
+
+        mock_open.assert_not_called()
+        self.assertEqual(Image.open(io.BytesIO(prepared)).size, (1000, 1000))
+
+class RequestLimiterTestCase(unittest.TestCase):
+    def test_limits_requests_in_flight(self):
+        limiter = google_calls.RequestLimiter(concurrency=2)
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+
+        def request():
+            with limiter:
+                with lock:
+                    in_flight.append(1)
+                    peak.append(len(in_flight))
+                threading.Event().wait(0.01)
+                with lock:
+                    in_flight.pop()
+
+        threads = [threading.Thread(target=request) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(max(peak), 2)
+
+if __name__ == '__main__':
+    unittest.main()
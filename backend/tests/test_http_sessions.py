@@ -0,0 +1,48 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import http_sessions
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+class HttpSessionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        http_sessions.sessions_pid = None
+
+    def tearDown(self):
+        for session in http_sessions.sessions.values():
+            session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_session_is_shared_per_upstream(self):
+        self.assertIs(http_sessions.get_session("ollama"), http_sessions.get_session("ollama"))
+        self.assertIsNot(http_sessions.get_session("ollama"), http_sessions.get_session("vertex"))
+
+    def test_connections_are_reused(self):
+        session = http_sessions.get_session("ollama")
+        for _ in range(5):
+            session.get(self.url, timeout=5).raise_for_status()
+
+        stats = http_sessions.connection_stats()["ollama"]
+        self.assertEqual(stats["requests"], 5)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reuse_rate"], 0.8)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from src import lexical_index
+
+class LexicalIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = lexical_index.LexicalIndex(os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.index.add(
+            ['bio.pdf_a', 'bio.pdf_b', 'cs.pdf_a'],
+            [
+                'Mitosis is the division of a cell nucleus.',
+                'Photosynthesis turns light into chemical energy.',
+                'CS101 covers recursion and the C++ standard library.',
+            ],
+            [{'source': 'bio.pdf'}, {'source': 'bio.pdf'}, {'source': 'cs.pdf'}]
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_exact_terms_are_found(self):
+        results = self.index.search('What is CS101 about?')
+
+        self.assertEqual(results['ids'], ['cs.pdf_a'])
+        self.assertEqual(results['metadatas'], [{'source': 'cs.pdf'}])
+
+    def test_query_syntax_is_searched_as_text(self):
+        self.assertEqual(self.index.search('C++ AND "recursion')['ids'], ['cs.pdf_a'])
+        self.assertEqual(self.index.search('?!')['ids'], [])
+
+    def test_stemmed_terms_match(self):
+        self.assertEqual(self.index.search('dividing cells')['ids'][0], 'bio.pdf_a')
+
+    def test_deletes_stay_in_sync(self):
+        self.index.delete_ids(['bio.pdf_a'])
+        self.assertEqual(self.index.search('mitosis')['ids'], [])
+
+        self.index.delete_source('cs.pdf')
+        self.assertEqual(self.index.search('recursion')['ids'], [])
+        self.assertEqual(self.index.count(), 1)
+
+    def test_re_adding_an_id_replaces_it(self):
+        self.index.add(['bio.pdf_a'], ['Meiosis makes gametes.'], [{'source': 'bio.pdf'}])
+
+        self.assertEqual(self.index.count(), 3)
+        self.assertEqual(self.index.search('mitosis')['ids'], [])
+        self.assertEqual(self.index.search('meiosis')['ids'], ['bio.pdf_a'])
+
+    def test_rebuild_from_collection(self):
+        collection = MagicMock()
+        collection.get.side_effect = [
+            {'ids': ['new.txt_a'], 'documents': ['Osmosis moves water.'], 'metadatas': [{'source': 'new.txt'}]},
+            {'ids': [], 'documents': [], 'metadatas': []},
+        ]
+
+        self.assertEqual(self.index.rebuild(collection), 1)
+        self.assertEqual(self.index.count(), 1)
+        self.assertEqual(self.index.search('osmosis')['ids'], ['new.txt_a'])
+
+    def test_rebuild_swaps_the_index_at_once(self):
+        seen_while_reading = []
+
+        def get(**kwargs):
+            # Searches still see the old index, ingestion keeps adding to it
+            seen_while_reading.append(self.index.search('mitosis')['ids'])
+            if kwargs['offset']:
+                return {'ids': [], 'documents': [], 'metadatas': []}
+            self.index.add(['late.txt_a'], ['Meiosis halves the chromosomes.'], [{'source': 'late.txt'}])
+            return {'ids': ['new.txt_a'], 'documents': ['Osmosis moves water.'], 'metadatas': [None]}
+
+        collection = MagicMock()
+        collection.get.side_effect = get
+
+        self.assertEqual(self.index.rebuild(collection), 1)
+        self.assertEqual(seen_while_reading, [['bio.pdf_a'], ['bio.pdf_a']])
+        self.assertEqual(self.index.count(), 2)
+        self.assertEqual(self.index.search('mitosis')['ids'], [])
+        self.assertEqual(self.index.search('osmosis')['ids'], ['new.txt_a'])
+        self.assertEqual(self.index.search('meiosis')['ids'], ['late.txt_a'])
+
+    def test_chunks_deleted_during_a_rebuild_stay_deleted(self):
+        pages = [
+            {'ids': ['bio.pdf_a', 'bio.pdf_b'], 'documents': ['Mitosis is the division of a cell nucleus.',
+                                                            'Photosynthesis turns light into chemical energy.'],
+             'metadatas': [{'source': 'bio.pdf'}, {'source': 'bio.pdf'}]},
+            {'ids': ['cs.pdf_a', 'bio.pdf_c'], 'documents': ['CS101 covers recursion and the C++ standard library.',
+                                                           'Meiosis halves the chromosomes.'],
+             'metadatas': [{'source': 'cs.pdf'}, {'source': 'bio.pdf'}]},
+            {'ids': [], 'documents': [], 'metadatas': []},
+        ]
+
+        def get(**kwargs):
+            page = kwargs['offset'] // kwargs['limit']
+            if page == 1:
+                # bio.pdf is deleted after its first chunks were read, cs.pdf_a is replaced
+                self.index.delete_source('bio.pdf')
+                self.index.delete_ids(['cs.pdf_a'])
+                self.index.add(['cs.pdf_a'], ['CS102 covers graphs.'], [{'source': 'cs.pdf'}])
+            return pages[page]
+
+        collection = MagicMock()
+        collection.get.side_effect = get
+
+        self.assertEqual(self.index.rebuild(collection, batch_size=2), 4)
+        self.assertEqual(self.index.count(), 1)
+        for query in ('mitosis', 'photosynthesis', 'meiosis', 'recursion'):
+            self.assertEqual(self.index.search(query)['ids'], [], query)
+        self.assertEqual(self.index.search('graphs')['ids'], ['cs.pdf_a'])
+
+        # Deletes after the rebuild are no longer tracked
+        self.index.delete_ids(['cs.pdf_a'])
+        self.assertEqual(self.index._connection().execute("SELECT COUNT(*) FROM rebuild_changes").fetchone()[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
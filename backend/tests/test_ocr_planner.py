@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import patch
+
+import fitz
+import numpy as np
+from PIL import Image
+
+from src import ocr_planner
+
+def make_scanned_page():
+    """A page without text layer: a picture of two columns of text above a dark figure."""
+    source = fitz.open()
+    page = source.new_page()
+    for i in range(15):
+        page.insert_text((72, 72 + 16 * i), f"Line {i} of the notes on membranes.", fontsize=11)
+        page.insert_text((330, 72 + 16 * i), f"Column two line {i}.", fontsize=11)
+    page.draw_rect(fitz.Rect(72, 500, 300, 700), color=(0, 0, 0), fill=(0.2, 0.2, 0.2))
+    png = page.get_pixmap(dpi=150).tobytes("png")
+    scan = fitz.open()
+    scan_page = scan.new_page()
+    scan_page.insert_image(scan_page.rect, stream=png)
+    return scan, scan_page
+
+@patch('src.ocr_planner._ocr_cached', side_effect=lambda image, cache_parts: f"{image.width}x{image.height}")
+class OcrPlannerTestCase(unittest.TestCase):
+    def test_only_text_regions_are_read(self, mock_ocr):
+        doc, page = make_scanned_page()
+        stats = {}
+
+        with doc:
+            text = ocr_planner.ocr_page(page, stats)
+
+        # One region per column, the figure is left out
+        self.assertEqual(mock_ocr.call_count, 2)
+        self.assertEqual(len(text.split("\n")), 2)
+        self.assertLess(stats['coverage'], 0.5)
+        self.assertTrue(ocr_planner.OCR_MIN_DPI <= stats['dpi'] <= ocr_planner.OCR_MAX_DPI)
+
+    def test_blank_pages_are_skipped(self, mock_ocr):
+        doc = fitz.open()
+        stats = {}
+
+        self.assertEqual(ocr_planner.ocr_page(doc.new_page(), stats), "")
+        mock_ocr.assert_not_called()
+        self.assertTrue(stats['ocr_skipped'])
+
+    def test_images_without_text_are_skipped(self, mock_ocr):
+        photo = Image.fromarray(np.random.default_rng(0).integers(0, 100, (400, 600), dtype=np.uint8))
+        stats = {}
+
+        self.assertEqual(ocr_planner.ocr_image(photo, ("photo",), stats), "")
+        mock_ocr.assert_not_called()
+        self.assertEqual(stats['images_skipped'], 1)
+
+class PageDpiTestCase(unittest.TestCase):
+    def test_large_text_gets_a_lower_dpi(self):
+        self.assertLess(ocr_planner.page_dpi(24), ocr_planner.page_dpi(8))
+        self.assertEqual(ocr_planner.page_dpi(1000), ocr_planner.OCR_MIN_DPI)
+        self.assertEqual(ocr_planner.page_dpi(0.5), ocr_planner.OCR_MAX_DPI)
+
+if __name__ == '__main__':
+    unittest.main()
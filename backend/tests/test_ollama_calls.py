@@ -0,0 +1,229 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import requests
+from flask import Flask
+
+from src import ollama_calls
+
+@patch.object(ollama_calls.HealthMonitor, 'start')
+class HealthMonitorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.monitor = ollama_calls.HealthMonitor('http://ollama', failure_threshold=2, reset_timeout=30)
+
+    @patch('src.ollama_calls.http_sessions.get_session')
+    def test_probe_records_latency(self, mock_get_session, mock_start):
+        mock_get_session.return_value.get.return_value = MagicMock(status_code=200)
+
+        self.assertTrue(self.monitor.probe())
+
+        snapshot = self.monitor.snapshot()
+        self.assertEqual(snapshot['circuit'], 'closed')
+        self.assertEqual(snapshot['probes'], 1)
+        self.assertIsNotNone(snapshot['latency_ms'])
+
+    @patch('src.ollama_calls.http_sessions.get_session')
+    def test_circuit_opens_after_repeated_failures(self, mock_get_session, mock_start):
+        mock_get_session.return_value.get.side_effect = requests.exceptions.ConnectionError("refused")
+        self.monitor.probe()
+        self.assertTrue(self.monitor.is_available())
+
+        self.monitor.probe()
+        self.assertFalse(self.monitor.is_available())
+        self.assertEqual(self.monitor.snapshot()['failed_probes'], 2)
+
+    @patch('src.ollama_calls.time.monotonic')
+    def test_half_open_after_reset_timeout(self, mock_monotonic, mock_start):
+        mock_monotonic.return_value = 100.0
+        self.monitor.record_failure("refused")
+        self.monitor.record_failure("refused")
+        self.assertFalse(self.monitor.is_available())
+
+        # After the cooldown one request is let through, a failure opens the circuit again
+        mock_monotonic.return_value = 131.0
+        self.assertTrue(self.monitor.is_available())
+        self.monitor.record_failure("refused")
+        self.assertFalse(self.monitor.is_available())
+
+        mock_monotonic.return_value = 162.0
+        self.assertTrue(self.monitor.is_available())
+        self.monitor.record_success()
+        self.assertEqual(self.monitor.state, 'closed')
+
+    def test_health_check_makes_no_request(self, mock_start):
+        with patch('src.ollama_calls.health_monitor', self.monitor), patch('src.ollama_calls.http_sessions.get_session') as mock_get_session:
+            self.assertTrue(ollama_calls.ollama_health_check())
+            mock_get_session.assert_not_called()
+
+@patch.object(ollama_calls.HealthMonitor, 'start')
+@patch('src.ollama_calls.http_sessions.get_session')
+class ChatHealthTestCase(unittest.TestCase):
+    def setUp(self):
+        self.monitor = ollama_calls.HealthMonitor('http://ollama', failure_threshold=1, reset_timeout=30)
+        self.monitor_patcher = patch('src.ollama_calls.health_monitor', self.monitor)
+        self.monitor_patcher.start()
+        self.search_results = {'documents': [["Cells divide by mitosis."]]}
+
+    def tearDown(self):
+        self.monitor_patcher.stop()
+
+    def server_error(self):
+        response = MagicMock(status_code=500, text='model requires more system memory')
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError("500 Server Error", response=response)
+        return response
+
+    def test_server_errors_open_the_circuit(self, mock_get_session, mock_start):
+        mock_get_session.return_value.post.return_value = self.server_error()
+
+        with Flask(__name__).app_context():
+            _, status = ollama_calls.chat(self.search_results, "question", "llama3.2:3b")
+
+        self.assertEqual(status, 500)
+        self.assertFalse(self.monitor.is_available())
+
+    def test_stream_server_errors_open_the_circuit_and_release_the_connection(self, mock_get_session, mock_start):
+        upstream = self.server_error()
+        mock_get_session.return_value.post.return_value = upstream
+
+        with Flask(__name__).app_context():
+            _, status = ollama_calls.chat_stream(self.search_results, "question", "llama3.2:3b")
+
+        self.assertEqual(status, 500)
+        self.assertFalse(self.monitor.is_available())
+        upstream.close.assert_called_once()
+
+def ndjson(*chunks):
+    return [json.dumps(chunk).encode() for chunk in chunks]
+
+@patch('src.ollama_calls.http_sessions.get_session')
+class ChatStreamTestCase(unittest.TestCase):
+    def setUp(self):
+        app = Flask(__name__)
+        app.add_url_rule('/chat', 'chat', lambda: ollama_calls.chat_stream(
+            {'documents': [["Cells divide by mitosis."]]}, "How do cells divide?", "llama3.2:3b"
+        ), methods=['POST'])
+        self.client = app.test_client()
+        self.upstream = MagicMock()
+
+    def test_deltas_then_done(self, mock_get_session):
+        mock_get_session.return_value.post.return_value = self.upstream
+        self.upstream.iter_lines.return_value = ndjson(
+            {'message': {'content': 'Hello'}, 'done': False},
+            {'message': {'content': ' world'}, 'done': False},
+            {'message': {'content': ''}, 'done': True, 'eval_count': 2},
+        )
+
+        response = self.client.post('/chat')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/event-stream'))
+        body = response.get_data(as_text=True)
+        self.assertIn('data: {"message": "Hello"}\n\ndata: {"message": " world"}\n\nevent: done', body)
+        self.assertIn('"eval_count": 2', body)
+        self.assertTrue(mock_get_session.return_value.post.call_args.kwargs['stream'])
+        self.upstream.close.assert_called_once()
+
+    def test_ollama_error_mid_stream(self, mock_get_session):
+        mock_get_session.return_value.post.return_value = self.upstream
+        self.upstream.iter_lines.return_value = ndjson(
+            {'message': {'content': 'Hello'}, 'done': False},
+            {'error': 'model runner has unexpectedly stopped'},
+        )
+
+        body = self.client.post('/chat').get_data(as_text=True)
+
+        self.assertIn('data: {"message": "Hello"}', body)
+        self.assertIn('event: error\ndata: {"error": "model runner has unexpectedly stopped"}', body)
+        self.assertNotIn('event: done', body)
+        self.upstream.close.assert_called_once()
+
+    def test_connection_lost_mid_stream(self, mock_get_session):
+        def lines():
+            yield from ndjson({'message': {'content': 'Hello'}, 'done': False})
+            raise requests.exceptions.ChunkedEncodingError("Connection broken")
+
+        mock_get_session.return_value.post.return_value = self.upstream
+        self.upstream.iter_lines.return_value = lines()
+
+        response = self.client.post('/chat')
+        body = response.get_data(as_text=True)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('data: {"message": "Hello"}', body)
+        self.assertIn('event: error', body)
+        self.assertIn('Connection broken', body)
+        self.upstream.close.assert_called_once()
+
+    @patch('src.ollama_calls.health_monitor')
+    def test_errors_before_the_stream_are_json(self, mock_monitor, mock_get_session):
+        mock_get_session.return_value.post.side_effect = requests.exceptions.ConnectionError("refused")
+
+        response = self.client.post('/chat')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Ollama is not running', response.get_json()['error'])
+        mock_monitor.record_failure.assert_called_once()
+
+TAGS = {'models': [{
+    'name': 'llama3:8b', 'size': 4661224676, 'modified_at': '2024-05-01T10:00:00Z',
+    'details': {'parameter_size': '8.0B', 'quantization_level': 'Q4_0', 'family': 'llama'},
+}]}
+
+class ModelCatalogueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.catalogue = ollama_calls.ModelCatalogue('http://ollama', ttl=60)
+
+    @patch('src.ollama_calls.http_sessions.get_session')
+    def test_warm_cache_makes_no_request(self, mock_get_session):
+        mock_get_session.return_value.get.return_value.json.return_value = TAGS
+
+        models = self.catalogue.get()
+        self.assertEqual(models[0]['name'], 'llama3:8b')
+        self.assertEqual(models[0]['parameter_size'], '8.0B')
+
+        self.catalogue.get()
+        self.assertEqual(mock_get_session.return_value.get.call_count, 1)
+
+    @patch('src.ollama_calls.time.monotonic')
+    @patch('src.ollama_calls.http_sessions.get_session')
+    def test_stale_cache_is_served_and_refreshed(self, mock_get_session, mock_monotonic):
+        mock_get_session.return_value.get.return_value.json.return_value = TAGS
+        mock_monotonic.return_value = 100.0
+        self.catalogue.fetch()
+
+        mock_monotonic.return_value = 161.0
+        with patch.object(self.catalogue, 'refresh_in_background') as mock_refresh:
+            self.assertEqual(self.catalogue.get()[0]['name'], 'llama3:8b')
+            mock_refresh.assert_called_once()
+
+    def test_get_models_response(self):
+        with Flask(__name__).app_context(), patch.object(ollama_calls.model_catalogue, 'get', return_value=[{'name': 'llama3:8b'}]):
+            response, status = ollama_calls.get_models()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(response.get_json()['models'], ['llama3:8b'])
+
+class ChatPayloadTestCase(unittest.TestCase):
+    def test_static_system_prompt_and_options(self):
+        search_results = {'documents': [["Cells divide by mitosis."]], 'ids': [["bio.pdf_a"]]}
+
+        with patch.object(ollama_calls, 'OLLAMA_KEEP_ALIVE', '-1'):
+            payload, stats = ollama_calls.build_chat_payload(search_results, "How do cells divide?", "llama3.2:3b")
+
+        self.assertEqual(payload['messages'][0]['content'], ollama_calls.prompt_builder.SYSTEM_PROMPT)
+        self.assertIn("Cells divide by mitosis.", payload['messages'][1]['content'])
+        self.assertEqual(payload['keep_alive'], -1)
+        self.assertEqual(payload['options']['num_ctx'], stats['context_window'])
+
+    @patch('src.ollama_calls.warm_model_in_background')
+    def test_get_models_warms_a_listed_model(self, mock_warm):
+        with Flask(__name__).app_context(), patch.object(ollama_calls.model_catalogue, 'get', return_value=[{'name': 'llama3:8b'}]):
+            response, _ = ollama_calls.get_models(warm='llama3:8b')
+            ollama_calls.get_models(warm='not-installed')
+
+        mock_warm.assert_called_once_with('llama3:8b')
+        self.assertEqual(response.get_json()['warming'], 'llama3:8b')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import unittest
+from unittest.mock import ANY, patch
+
+from src import progress
+
+@patch('src.progress.get_redis_client')
+class ProgressReporterTestCase(unittest.TestCase):
+    def published(self, mock_client):
+        return [json.loads(call.args[1]) for call in mock_client.return_value.publish.call_args_list]
+
+    @patch('src.progress.time.monotonic')
+    def test_updates_are_throttled(self, mock_monotonic, mock_client):
+        mock_client.return_value.get.return_value = None
+        mock_monotonic.return_value = 100.0
+        reporter = progress.ProgressReporter('job', interval=1.0)
+        reporter.stage('extract')
+        reporter.update(pages_total=10)
+
+        for i in range(5):
+            mock_monotonic.return_value = 100.1 + i * 0.1
+            reporter.increment(pages_done=1)
+        mock_monotonic.return_value = 101.5
+        reporter.increment(pages_done=1)
+
+        events = self.published(mock_client)
+        # The stage change, then a single update once the interval passed
+        self.assertEqual(len(events), 2)
+        self.assertEqual(events[-1]['pages_done'], 6)
+        self.assertEqual(events[-1]['status'], 'Extracting pages (6/10)')
+        mock_client.return_value.set.assert_called_with('study-buddy:progress:job', ANY, ex=progress.PROGRESS_TTL)
+
+    @patch('src.progress.time.monotonic')
+    def test_eta_from_stage_rate(self, mock_monotonic, mock_client):
+        mock_client.return_value.get.return_value = None
+        mock_monotonic.return_value = 0.0
+        reporter = progress.ProgressReporter('job', interval=0)
+        reporter.stage('embed')
+        reporter.update(chunks_total=100)
+
+        mock_monotonic.return_value = 10.0
+        reporter.increment(chunks_embedded=25)
+
+        self.assertEqual(reporter.snapshot()['eta_seconds'], 30.0)
+
+    def test_next_stage_resumes_progress(self, mock_client):
+        mock_client.return_value.get.return_value = json.dumps({'pages_done': 40, 'pages_total': 40})
+
+        reporter = progress.ProgressReporter('job')
+
+        self.assertEqual(reporter.snapshot()['pages_done'], 40)
+
+    def test_finish_and_fail_are_always_published(self, mock_client):
+        mock_client.return_value.get.return_value = None
+        reporter = progress.ProgressReporter('job', interval=60)
+        reporter.fail(ValueError("bad pdf"))
+
+        event = self.published(mock_client)[-1]
+        self.assertEqual(event['state'], 'FAILURE')
+        self.assertEqual(event['error'], 'bad pdf')
+
+    def test_reporter_without_job_does_not_publish(self, mock_client):
+        reporter = progress.ProgressReporter()
+        reporter.increment(pages_done=1)
+        reporter.finish()
+
+        mock_client.assert_not_called()
+        self.assertEqual(reporter.snapshot()['state'], 'SUCCESS')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import patch
+
+from src import prompt_builder
+
+class DeduplicateChunksTestCase(unittest.TestCase):
+    def test_overlap_between_consecutive_chunks_is_removed(self):
+        first = "The mitochondria is the powerhouse of the cell. It produces ATP through respiration."
+        second = "It produces ATP through respiration. Ribosomes build proteins from amino acids."
+
+        chunks, removed = prompt_builder.deduplicate_chunks([first, second])
+
+        self.assertEqual(chunks, [first, "Ribosomes build proteins from amino acids."])
+        self.assertEqual(removed, len("It produces ATP through respiration. "))
+
+    def test_overlap_is_removed_whatever_the_retrieval_order(self):
+        first = "The mitochondria is the powerhouse of the cell. It produces ATP through respiration."
+        second = "It produces ATP through respiration. Ribosomes build proteins from amino acids."
+
+        chunks, _ = prompt_builder.deduplicate_chunks([second, first])
+
+        self.assertEqual(chunks, [second, "The mitochondria is the powerhouse of the cell."])
+
+    def test_contained_chunks_are_dropped(self):
+        chunks, _ = prompt_builder.deduplicate_chunks(["A long chunk about cells and tissues.", "about cells and tissues"])
+
+        self.assertEqual(chunks, ["A long chunk about cells and tissues."])
+
+class BuildContextTestCase(unittest.TestCase):
+    def test_best_chunks_fit_the_budget(self):
+        documents = [f"Chunk {i} " + "word " * 150 for i in range(10)]
+
+        with patch.object(prompt_builder, 'context_windows', {'tiny': 1024}), patch.object(prompt_builder, 'ANSWER_RESERVE_TOKENS', 256):
+            context, stats = prompt_builder.build_context(documents, "What is chunk 0?", "tiny:latest")
+
+        self.assertTrue(context.startswith("Chunk 0"))
+        self.assertLess(stats['chunks_used'], len(documents))
+        self.assertLessEqual(stats['context_tokens'], stats['budget_tokens'])
+        self.assertLessEqual(stats['prefill_tokens'] + 256, 1024)
+
+    def test_oversized_best_chunk_is_truncated(self):
+        with patch.object(prompt_builder, 'context_windows', {'tiny': 600}), patch.object(prompt_builder, 'ANSWER_RESERVE_TOKENS', 256):
+            context, stats = prompt_builder.build_context(["word " * 2000], "question", "tiny")
+
+        self.assertEqual(stats['chunks_used'], 1)
+        self.assertLessEqual(prompt_builder.estimate_tokens(context), stats['budget_tokens'])
+
+    @patch('src.prompt_builder.RANK_BUCKET_SIZE', 3)
+    def test_close_ranks_make_the_same_prompt(self):
+        documents = ["Cells divide by mitosis.", "Plants make sugar by photosynthesis.", "Enzymes speed up reactions.",
+                     "Osmosis moves water."]
+        ids = ["bio.pdf_c", "bio.pdf_a", "bio.pdf_b", "bio.pdf_0"]
+        swapped = [2, 0, 1, 3]
+
+        first, _ = prompt_builder.build_messages(documents, "question", "model", ids)
+        second, _ = prompt_builder.build_messages([documents[i] for i in swapped], "question", "model",
+                                                  [ids[i] for i in swapped])
+
+        self.assertEqual(first, second)
+        self.assertEqual(first[0], {"role": "system", "content": prompt_builder.SYSTEM_PROMPT})
+        self.assertTrue(first[1]["content"].endswith("Prompt: question"))
+        # The weakest match stays after the best ones, though its id sorts first
+        self.assertIn("mitosis.\n\n---\n\nOsmosis moves water.\n\nPrompt", first[1]["content"])
+
+    def test_context_windows_are_parsed(self):
+        windows = prompt_builder.parse_context_windows("llama3.2:3b=8192, mistral=4096,broken")
+
+        self.assertEqual(windows, {'llama3.2:3b': 8192, 'mistral': 4096})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import sys
+import time
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+from src import reranker
+
+def make_results(count):
+    return {
+        'ids': [[f"doc_{i}" for i in range(count)]],
+        'documents': [[f"chunk {i}" for i in range(count)]],
+        'metadatas': [[{'source': 'doc.txt'}] * count],
+        'distances': [[i / 10 for i in range(count)]],
+    }
+
+class CrossEncoderRerankerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.reranker = reranker.CrossEncoderReranker('model', budget_ms=100)
+
+    def test_reorders_by_score(self):
+        logits = np.array([[0.1], [2.0], [-1.0], [1.0]], dtype=np.float32)
+        with patch.object(self.reranker, 'forward', return_value=[logits]):
+            results, stats = self.reranker.rerank('query', make_results(4), n_results=2)
+
+        self.assertEqual(results['ids'], [['doc_1', 'doc_3']])
+        self.assertEqual(results['distances'], [[0.1, 0.3]])
+        self.assertEqual(results['rerank_scores'], [[2.0, 1.0]])
+        self.assertIsNone(stats['fallback'])
+
+    def test_two_class_models_use_the_relevant_class(self):
+        logits = np.array([[0.0, 0.2], [0.0, 0.9]], dtype=np.float32)
+        with patch.object(self.reranker, 'forward', return_value=[logits]):
+            scores = self.reranker.score('query', ['a', 'b'])
+
+        np.testing.assert_allclose(scores, [0.2, 0.9])
+
+    def test_keeps_retrieval_order_past_the_budget(self):
+        def slow_forward(query, documents):
+            time.sleep(0.3)
+            return [np.zeros((len(documents), 1))]
+
+        with patch.object(self.reranker, 'forward', side_effect=slow_forward):
+            results, stats = self.reranker.rerank('query', make_results(4), n_results=2)
+
+        self.assertEqual(results['ids'], [['doc_0', 'doc_1']])
+        self.assertIsNone(results['rerank_scores'])
+        self.assertIn('budget', stats['fallback'])
+
+    def test_runs_over_budget_do_not_queue_searches(self):
+        self.reranker = reranker.CrossEncoderReranker('model', budget_ms=50, max_in_flight=1)
+        release = threading.Event()
+        calls = []
+
+        def stuck_forward(query, documents):
+            calls.append(query)
+            release.wait(5)
+            return [np.zeros((len(documents), 1))]
+
+        with patch.object(self.reranker, 'forward', side_effect=stuck_forward):
+            _, stats = self.reranker.rerank('first', make_results(3), n_results=3)
+            self.assertIn('budget', stats['fallback'])
+
+            # The overdue run still holds the only slot, the next search doesn't wait for it
+            start = time.perf_counter()
+            results, stats = self.reranker.rerank('second', make_results(3), n_results=2)
+            self.assertLess(time.perf_counter() - start, 0.05)
+            self.assertEqual(results['ids'], [['doc_0', 'doc_1']])
+            self.assertIn('in flight', stats['fallback'])
+            self.assertEqual(calls, ['first'])
+
+            release.set()
+            self.reranker._executor.shutdown(wait=True)
+        self.assertEqual(self.reranker._in_flight, 0)
+
+    def test_keeps_retrieval_order_on_errors(self):
+        with patch.object(self.reranker, 'forward', side_effect=FileNotFoundError('model.onnx')):
+            results, stats = self.reranker.rerank('query', make_results(3), n_results=3)
+
+        self.assertEqual(results['ids'], [['doc_0', 'doc_1', 'doc_2']])
+        self.assertIn('FileNotFoundError', stats['fallback'])
+
+class NativeLockTestCase(unittest.TestCase):
+    def test_gevent_workers_get_an_os_lock(self):
+        monkey = MagicMock()
+        monkey.is_module_patched.return_value = True
+        gevent = MagicMock(monkey=monkey)
+
+        with patch.dict(sys.modules, {'gevent': gevent, 'gevent.monkey': monkey}):
+            lock = reranker._native_lock()
+
+        monkey.get_original.assert_called_once_with("threading", "Lock")
+        self.assertIs(lock, monkey.get_original.return_value.return_value)
+
+if __name__ == '__main__':
+    unittest.main()
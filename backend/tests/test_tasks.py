@@ -0,0 +1,84 @@
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src import catalogue
+from src import tasks
+
+class IngestFileTestCase(unittest.TestCase):
+    @patch('src.tasks.embed_file.apply_async')
+    def test_text_files_go_straight_to_embedding(self, mock_apply_async):
+        job_id = tasks.ingest_file('uploads/notes.txt', 'textracted', 'job-1')
+
+        self.assertEqual(job_id, 'job-1')
+        mock_apply_async.assert_called_once_with((None, 'uploads/notes.txt', 'textracted', 'job-1'), task_id='job-1')
+
+    @patch('src.tasks.chain')
+    def test_pdfs_go_through_every_stage(self, mock_chain):
+        tasks.ingest_file('uploads/book.pdf', 'textracted', 'job-2')
+
+        stages = mock_chain.call_args.args
+        self.assertEqual([stage.task for stage in stages], ['src.tasks.extract_pdf', 'src.tasks.caption_pdf', 'src.tasks.embed_file'])
+        self.assertEqual(stages[-1].options['task_id'], 'job-2')
+        mock_chain.return_value.apply_async.assert_called_once()
+
+    def test_stages_are_routed_by_workload(self):
+        queues = {name: route['queue'] for name, route in tasks.TASK_ROUTES.items()}
+
+        self.assertEqual(queues['src.tasks.extract_pdf'], 'ocr')
+        self.assertEqual(queues['src.tasks.caption_pdf'], 'caption')
+        self.assertEqual(queues['src.tasks.embed_file'], 'embed')
+
+class SegmentsTestCase(unittest.TestCase):
+    def test_images_are_handed_off_as_files(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        path = os.path.join(temp_dir, 'book.pdf.segments.jsonl')
+        image_dir = os.path.join(temp_dir, 'book.pdf.images')
+        jpeg = b"\xff\xd8\xff\xe0jpeg"
+        pages = [(1, [("image", jpeg, "image xref 9")]), (0, [("text", "Mitosis\n"), ("image", jpeg, "image xref 7")])]
+
+        tasks.dump_segments(iter(pages), path, image_dir)
+
+        with open(path, 'rb') as f:
+            self.assertNotIn(base64.b64encode(jpeg), f.read())
+        # The same image on two pages is stored once
+        self.assertEqual(len(os.listdir(image_dir)), 1)
+        loaded = list(tasks.load_segments(path))
+        self.assertEqual([page_index for page_index, _ in loaded], [1, 0])
+        self.assertEqual(loaded[1][1][0], ("text", "Mitosis\n"))
+        kind, image_path, label = loaded[1][1][1]
+        self.assertEqual((kind, label), ("image", "image xref 7"))
+        with open(image_path, 'rb') as f:
+            self.assertEqual(f.read(), jpeg)
+
+class RecordDocumentTestCase(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        self.catalogue = catalogue.DocumentCatalogue(os.path.join(temp_dir, 'catalogue.sqlite3'))
+        self.catalogue.add('book.pdf', 'uploads/book.pdf', 'hash', 100, job_id='job-1')
+        patcher = patch('src.tasks.catalogue.get_catalogue', return_value=self.catalogue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_jobs_are_recorded(self):
+        task = MagicMock()
+        task.request.id = 'job-1'
+
+        tasks.fail_job(task, 'job-1', None, RuntimeError("Chroma is down"), 'uploads/book.pdf')
+
+        document = self.catalogue.get('book.pdf')
+        self.assertEqual((document['status'], document['error']), ('failed', 'Chroma is down'))
+
+    def test_stage_timings_are_recorded(self):
+        tasks.record_document('uploads/book.pdf', 'extract', 2.0, pages=3)
+
+        document = self.catalogue.get('book.pdf')
+        self.assertEqual((document['pages'], document['timings']), (3, {'extract': 2.0}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from src import vector_db
+
+@patch('src.vector_db.lexical_index.get_lexical_index')
+class BatchUpserterTestCase(unittest.TestCase):
+    def test_upserts_in_batches(self, mock_get_index):
+        collection = MagicMock()
+
+        with vector_db.BatchUpserter(collection, batch_size=3, max_pending=1) as upserter:
+            for i in range(7):
+                upserter.add(f"chunk {i}", f"doc_{i}", {"source": "doc.txt"})
+
+        batch_sizes = [len(call.kwargs['ids']) for call in collection.upsert.call_args_list]
+        self.assertEqual(batch_sizes, [3, 3, 1])
+        self.assertEqual(upserter.upserted, 7)
+        self.assertEqual(upserter.failed, 0)
+        indexed = [id for call in mock_get_index.return_value.add.call_args_list for id in call.args[0]]
+        self.assertEqual(indexed, [f"doc_{i}" for i in range(7)])
+
+    @patch('src.vector_db.BatchUpserter._upsert.retry.sleep', return_value=None)
+    def test_retries_failed_batch(self, mock_sleep, mock_get_index):
+        collection = MagicMock()
+        collection.upsert.side_effect = [Exception("Chroma unavailable"), None]
+
+        with vector_db.BatchUpserter(collection, batch_size=10) as upserter:
+            upserter.add("chunk", "doc_0", {"source": "doc.txt"})
+
+        self.assertEqual(collection.upsert.call_count, 2)
+        self.assertEqual(upserter.upserted, 1)
+
+    @patch('src.vector_db.BatchUpserter._upsert.retry.sleep', return_value=None)
+    def test_failed_batch_does_not_stop_others(self, mock_sleep, mock_get_index):
+        collection = MagicMock()
+        collection.upsert.side_effect = [Exception("bad batch")] * vector_db.UPSERT_RETRIES + [None]
+
+        with vector_db.BatchUpserter(collection, batch_size=1) as upserter:
+            upserter.add("chunk 0", "doc_0", {"source": "doc.txt"})
+            upserter.add("chunk 1", "doc_1", {"source": "doc.txt"})
+
+        self.assertEqual(upserter.failed, 1)
+        self.assertEqual(upserter.upserted, 1)
+        mock_get_index.return_value.add.assert_called_once_with(['doc_1'], ['chunk 1'], [{"source": "doc.txt"}])
+
+    def test_failing_callback_does_not_stop_others(self, mock_get_index):
+        collection = MagicMock()
+        on_batch = MagicMock(side_effect=[ValueError("progress store down"), None])
+
+        with vector_db.BatchUpserter(collection, batch_size=1, on_batch=on_batch) as upserter:
+            upserter.add("chunk 0", "doc_0", {"source": "doc.txt"})
+            upserter.add("chunk 1", "doc_1", {"source": "doc.txt"})
+
+        self.assertEqual(on_batch.call_count, 2)
+        self.assertEqual(upserter.upserted, 2)
+
+    def test_close_raises_when_the_thread_stopped(self, mock_get_index):
+        class Stop(BaseException):
+            pass
+
+        collection = MagicMock()
+        upserter = vector_db.BatchUpserter(collection, batch_size=1, max_pending=1, on_batch=MagicMock(side_effect=Stop))
+        with self.assertRaises(RuntimeError):
+            # Nobody reads the queue once the thread stopped, the producer must not wait on it
+            for i in range(5):
+                upserter.add(f"chunk {i}", f"doc_{i}", {"source": "doc.txt"})
+            upserter.close()
+        self.assertIsInstance(upserter._error, Stop)
+
+class FuseResultsTestCase(unittest.TestCase):
+    def test_chunks_found_by_both_searches_come_first(self):
+        vector_results = {
+            'ids': [['a', 'b', 'c']],
+            'documents': [['doc a', 'doc b', 'doc c']],
+            'metadatas': [[{'source': 'x'}] * 3],
+            'distances': [[0.1, 0.2, 0.3]],
+        }
+        lexical_results = {'ids': ['d', 'c'], 'documents': ['doc d', 'doc c'], 'metadatas': [{'source': 'y'}, {'source': 'x'}], 'scores': [-3.0, -2.0]}
+
+        results = vector_db.fuse_results(vector_results, lexical_results, n_results=3)
+
+        self.assertEqual(results['ids'], [['c', 'a', 'd']])
+        self.assertEqual(results['documents'], [['doc c', 'doc a', 'doc d']])
+        self.assertEqual(results['distances'], [[0.3, 0.1, None]])
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = vector_db.TTLCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    @patch('src.vector_db.time.monotonic')
+    def test_entries_expire(self, mock_monotonic):
+        mock_monotonic.return_value = 100.0
+        cache = vector_db.TTLCache(max_size=2, ttl=10)
+        cache.set('a', 1)
+
+        mock_monotonic.return_value = 105.0
+        self.assertEqual(cache.get('a'), 1)
+        mock_monotonic.return_value = 111.0
+        self.assertIsNone(cache.get('a'))
+
+class SearchDocumentsCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        vector_db.query_result_cache.clear()
+        vector_db.query_embedding_cache.clear()
+
+    @patch('src.vector_db.get_query_embedding', return_value=[0.1, 0.2])
+    @patch('src.vector_db.get_collection')
+    @patch('src.vector_db.get_collection_version')
+    def test_repeated_query_is_cached_until_version_changes(self, mock_version, mock_get_collection, mock_embedding):
+        mock_version.return_value = 1
+        collection = mock_get_collection.return_value
+        collection.query.return_value = {'documents': [['result']]}
+
+        self.assertEqual(vector_db.search_documents('query', mode='vector'), ({'documents': [['result']]}, 200))
+        vector_db.search_documents('query', mode='vector')
+        self.assertEqual(collection.query.call_count, 1)
+
+        mock_version.return_value = 2
+        vector_db.search_documents('query', mode='vector')
+        self.assertEqual(collection.query.call_count, 2)
+
+    @patch('src.vector_db.get_query_embedding', return_value=[0.1, 0.2])
+    @patch('src.vector_db.get_collection')
+    @patch('src.vector_db.get_collection_version', return_value=None)
+    def test_no_caching_without_version(self, mock_version, mock_get_collection, mock_embedding):
+        collection = mock_get_collection.return_value
+        collection.query.return_value = {'documents': [['result']]}
+
+        vector_db.search_documents('query', mode='vector')
+        vector_db.search_documents('query', mode='vector')
+
+        self.assertEqual(collection.query.call_count, 2)
+
+class RerankSearchTestCase(unittest.TestCase):
+    def setUp(self):
+        vector_db.query_result_cache.clear()
+
+    @patch('src.vector_db.get_query_embedding', return_value=[0.1, 0.2])
+    @patch('src.vector_db.get_collection')
+    @patch('src.vector_db.get_collection_version', return_value=None)
+    @patch('src.vector_db.reranker.get_reranker')
+    def test_candidates_are_over_fetched_and_reranked(self, mock_get_reranker, mock_version, mock_get_collection, mock_embedding):
+        collection = mock_get_collection.return_value
+        collection.query.return_value = {'documents': [['a', 'b']]}
+        mock_get_reranker.return_value.rerank.return_value = ({'documents': [['b']]}, {})
+
+        results, status = vector_db.search_documents('query', n_results=1, mode='vector')
+
+        self.assertEqual(collection.query.call_args.kwargs['n_results'], vector_db.reranker.RERANK_CANDIDATES)
+        mock_get_reranker.return_value.rerank.assert_called_once_with('query', {'documents': [['a', 'b']]}, 1)
+        self.assertEqual(results, {'documents': [['b']]})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import fcntl
+import shutil
+import tempfile
+import unittest
+import threading
+from unittest.mock import MagicMock, patch
+
+from flask import Flask
+
+from src import warmup
+
+class WarmupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_steps_report_readiness_and_errors(self):
+        def failing():
+            raise ConnectionError("Chroma is down")
+
+        with patch.dict(warmup.STEPS, {'nltk': lambda: None, 'chroma': failing}):
+            steps = warmup.Warmup(self.app, steps=['nltk', 'chroma'])
+            self.assertFalse(steps.is_ready('nltk'))
+            steps.run()
+
+        self.assertTrue(steps.is_ready('nltk'))
+        self.assertFalse(steps.is_ready('chroma'))
+        self.assertFalse(steps.all_ready())
+        self.assertIn('Chroma is down', steps.error())
+        self.assertIsNotNone(steps.status()['steps']['nltk']['seconds'])
+
+    def test_background_start_does_not_block(self):
+        release = threading.Event()
+
+        with patch.dict(warmup.STEPS, {'embeddings': release.wait}):
+            steps = warmup.Warmup(self.app, steps=['embeddings'])
+            steps.start()
+            self.assertFalse(steps.is_ready('embeddings'))
+
+            release.set()
+            self.assertTrue(steps.wait(timeout=5))
+        self.assertTrue(steps.status()['fast_start'])
+
+@patch('src.vector_db.bump_collection_version')
+@patch('src.vector_db.get_collection')
+@patch('src.lexical_index.get_lexical_index')
+class WarmLexicalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.index = MagicMock(path=os.path.join(self.temp_dir, 'index.sqlite3'))
+        self.index.count.return_value = 1
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_rebuilds_when_counts_differ(self, mock_get_index, mock_get_collection, mock_bump):
+        mock_get_index.return_value = self.index
+        mock_get_collection.return_value.count.return_value = 2
+
+        warmup.warm_lexical()
+
+        self.index.rebuild.assert_called_once_with(mock_get_collection.return_value)
+        mock_bump.assert_called_once()
+
+    def test_one_process_rebuilds(self, mock_get_index, mock_get_collection, mock_bump):
+        mock_get_index.return_value = self.index
+        mock_get_collection.return_value.count.return_value = 2
+
+        # Another process holds the rebuild lock
+        with open(f"{self.index.path}.rebuild.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            warmup.warm_lexical()
+
+        self.index.rebuild.assert_not_called()
+        mock_bump.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
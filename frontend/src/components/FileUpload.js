@@ -13,26 +13,38 @@ const FileUpload = ({ isBackendReady, fetchDocuments, setError }) => {
 
   useEffect(() => {
     let pollStatusInterval;
+    let events;
 
-    if (taskId) {
+    if (!taskId) return undefined;
+
+    const describe = ({ status, progress }) => {
+      const eta = progress?.eta_seconds;
+      return eta ? `${status} (about ${Math.ceil(eta)}s left)` : status;
+    };
+
+    const handleDone = (state) => {
+      setIsUploading(false);
+      if (state === "SUCCESS") {
+        alert("File uploaded and processed successfully");
+        fetchDocuments();
+        setTaskId(null); // task is done so set taskid to null.
+      } else {
+        setError("File processing failed");
+      }
+    };
+
+    // Polling is the fallback when the progress stream is unavailable
+    const startPolling = () => {
       pollStatusInterval = setInterval(async () => {
         try {
           const response = await axios.get(`${BACKEND_URL_API}/task_status/${taskId}`);
-          const { state, status } = response.data;
+          const { state } = response.data;
 
-          setUploadStatus(status);
+          setUploadStatus(describe(response.data));
 
           if (state === "SUCCESS" || state === "FAILURE") {
             clearInterval(pollStatusInterval);
-            setIsUploading(false);
-
-            if (state === "SUCCESS") {
-              alert("File uploaded and processed successfully");
-              fetchDocuments();
-              setTaskId(null); // task is done so set taskid to null.
-            } else if (state === "FAILURE") {
-              setError("File processing failed");
-            }
+            handleDone(state);
           }
         } catch (error) {
           clearInterval(pollStatusInterval);
@@ -40,9 +52,30 @@ const FileUpload = ({ isBackendReady, fetchDocuments, setError }) => {
           setError("Error fetching task status");
         }
       }, 1000);
+    };
+
+    if (window.EventSource) {
+      events = new EventSource(`${BACKEND_URL_API}/task_events/${taskId}`);
+      events.onmessage = (event) => {
+        const progress = JSON.parse(event.data);
+        setUploadStatus(describe({ status: progress.status, progress }));
+        if (progress.state === "SUCCESS" || progress.state === "FAILURE") {
+          events.close();
+          handleDone(progress.state);
+        }
+      };
+      events.onerror = () => {
+        events.close();
+        startPolling();
+      };
+    } else {
+      startPolling();
     }
 
-    return () => clearInterval(pollStatusInterval);  
+    return () => {
+      clearInterval(pollStatusInterval);
+      if (events) events.close();
+    };
   }, [taskId, fetchDocuments, setError]);
 
   const handleFileUpload = async (e) => {
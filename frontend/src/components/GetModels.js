@@ -5,9 +5,17 @@ const BACKEND_URL_API = (process.env.REACT_APP_BACKEND_URL ? process.env.REACT_A
 
 const GetModels = ({ isBackendReady, onModelSelect }) => {
     const [models, setModels] = useState([]);
+    const [details, setDetails] = useState({});
     const [selectedModel, setSelectedModel] = useState('');
     const [error, setError] = useState(null);
 
+    // Ask the backend to load the model in the background so the first question doesn't wait for it
+    const warmModel = useCallback((model) => {
+        if (!model) return;
+        axios.get(`${BACKEND_URL_API}/get_models`, { params: { warm: model }, timeout: 5000 })
+            .catch((err) => console.error('Failed to warm model:', err));
+    }, []);
+
     const handleGetModels = useCallback(async () => {
         try {
             setError(null);
@@ -21,9 +29,11 @@ const GetModels = ({ isBackendReady, onModelSelect }) => {
             }
 
             setModels(response.data.models);
+            setDetails(Object.fromEntries((response.data.details || []).map((model) => [model.name, model])));
             if (response.data.models.length > 0 && !selectedModel) {
                 setSelectedModel(response.data.models[0]);
                 onModelSelect(response.data.models[0]);
+                warmModel(response.data.models[0]);
             }
         } catch (err) {
             console.error('Caught error:', err);
@@ -32,7 +42,7 @@ const GetModels = ({ isBackendReady, onModelSelect }) => {
             }
             setError(`Failed to fetch models. Status: ${err.response?.status || 'unknown'}. Is ollama running?`);
         }
-    }, [onModelSelect, selectedModel]);
+    }, [onModelSelect, selectedModel, warmModel]);
 
     useEffect(() => {
         if (isBackendReady) {
@@ -44,6 +54,7 @@ const GetModels = ({ isBackendReady, onModelSelect }) => {
         const value = event.target.value;
         setSelectedModel(value);
         onModelSelect(value);
+        warmModel(value);
     };
 
     return (
@@ -64,7 +75,7 @@ const GetModels = ({ isBackendReady, onModelSelect }) => {
                     <option value="">Select a model</option>
                     {models.map((model) => (
                         <option key={model} value={model}>
-                            {model}
+                            {details[model]?.parameter_size ? `${model} (${details[model].parameter_size})` : model}
                         </option>
                     ))}
                 </select>
@@ -41,30 +41,53 @@ const SearchAndChat = ({ isBackendReady, setError, selectedModel }) => {
     setChatResponse("");
     try {
       console.log("Sending chat request to:", `${BACKEND_URL_API}/chat`);
-      const response = await axios.post(`${BACKEND_URL_API}/chat`, {
-        prompt: searchQuery,
-        model: selectedModel
+      const response = await fetch(`${BACKEND_URL_API}/chat`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          prompt: searchQuery,
+          model: selectedModel,
+          stream: true,
+        }),
       });
-      console.log("Chat response received:", response.data);
-      if (typeof response.data === "object" && response.data.response) {
-        setChatResponse(response.data.response);
-      } else {
-        setChatResponse(JSON.stringify(response.data["message"]));
+      if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        throw new Error(
+          `Server error ${response.status}: ${data.error || JSON.stringify(data)}`
+        );
+      }
+
+      // Read the Server-Sent Events stream and append tokens as they arrive.
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = "";
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split("\n\n");
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          let eventType = "message";
+          let data = "";
+          for (const line of rawEvent.split("\n")) {
+            if (line.startsWith("event: ")) eventType = line.slice(7);
+            else if (line.startsWith("data: ")) data += line.slice(6);
+          }
+          if (!data) continue;
+          const payload = JSON.parse(data);
+          if (eventType === "error") {
+            throw new Error(payload.error);
+          } else if (eventType === "message" && payload.message) {
+            setChatResponse((previous) => previous + payload.message);
+          }
+        }
       }
     } catch (error) {
       console.error("Error in chat:", error);
-      let errorMessage = "An unexpected error occurred during the chat.";
-      if (error.response) {
-        errorMessage = `Server error ${error.response.status}: ${
-          error.response.data.error || JSON.stringify(error.response.data)
-        }`;
-      } else if (error.request) {
-        errorMessage =
-          "No response received from the server. The chat function might not be implemented correctly.";
-      } else {
-        errorMessage = error.message;
-      }
-      setError(errorMessage);
+      setError(
+        error.message || "An unexpected error occurred during the chat."
+      );
     } finally {
       setIsChatting(false);
     }